@@ -31,6 +31,8 @@ def set_properties(project):
     project.license = "Apache 2.0"
     project.url = "https://github.com/rspitler/pybuilder-integration"
     project.depends_on_requirements("src/main/python/requirements.txt")
+    project.build_depends_on("moto[server]")
+    project.build_depends_on("pytest-xdist")
     #Build and test settings
     project.set_property("run_unit_tests_propagate_stdout",True)
     project.set_property("run_unit_tests_propagate_stderr",True)
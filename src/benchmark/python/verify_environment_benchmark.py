@@ -0,0 +1,283 @@
+# Benchmark of the verify_environment phases against synthetic application groups.
+#
+# Runs offline: moto serves as the S3 stand-in and a local HTTP server is the integration target.
+#
+#   PYTHONPATH=src/main/python python src/benchmark/python/verify_environment_benchmark.py \
+#       --roles 20 --tests-per-role 10 --payload-kb 256 --repeat 2 --output target/benchmark.json
+#
+# Every role is packaged and promoted the way its own build would do it, then the verifying project
+# downloads, unzips (and consolidates), and runs the LATEST suites. Wall clock and peak memory are
+# reported for each phase; the plugin's own timing report is written next to the other reports.
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+from moto.server import ThreadedMotoServer
+from pybuilder.cli import StdOutLogger
+from pybuilder.core import Project, Logger
+from pybuilder.errors import BuildFailedException
+from pybuilder.plugins import core_plugin
+from pybuilder.plugins.python.core_plugin import init_python_directories
+
+from pybuilder_integration import init_plugin, tasks
+from pybuilder_integration.artifact_manager import get_artifact_manager, get_latest_artifact_destination, \
+    get_testing_scope, _unzip_downloaded_artifacts
+from pybuilder_integration.directory_utility import package_artifacts, get_latest_distribution_directory, \
+    get_latest_zipped_distribution_directory, prepare_reports_directory
+from pybuilder_integration.properties import *
+from pybuilder_integration.timing_utility import write_timing_report
+
+APPLICATION_GROUP_NAME = "bench"
+APPLICATION_NAME = "app"
+BUCKET = "integration-benchmark"
+BENCHMARK_ENVIRONMENT = "bench"
+
+
+class TargetHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = json.dumps({"path": self.path, "status": "ok"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PhaseRecorder:
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name, iteration, **details):
+        entry = {"phase": name, "iteration": iteration, "status": "ok"}
+        entry.update(details)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield entry
+        except BuildFailedException as ex:
+            entry["status"] = f"failed: {ex}"
+        finally:
+            entry["wall_ms"] = int((time.perf_counter() - start) * 1000)
+            if self.trace_memory:
+                entry["peak_python_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            # high water marks - suites run in subprocesses only show up in the children figure
+            entry["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            entry["max_rss_children_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self.phases.append(entry)
+
+
+def _get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _create_project(basedir, name, options, endpoint_url, target_url):
+    project = Project(basedir=basedir)
+    project.name = name
+    core_plugin.init(project)
+    init_plugin(project)
+    init_python_directories(project)
+    project.set_property(ENVIRONMENT, BENCHMARK_ENVIRONMENT)
+    project.set_property(APPLICATION_GROUP, APPLICATION_GROUP_NAME)
+    project.set_property(APPLICATION, APPLICATION_NAME)
+    project.set_property(INTEGRATION_ARTIFACT_BUCKET, BUCKET)
+    project.set_property(ARTIFACT_MANAGER, "S3_BOTO3")
+    project.set_property(S3_ENDPOINT_URL, endpoint_url)
+    project.set_property(INTEGRATION_TARGET_URL, target_url)
+    project.set_property(INTEGRATION_PUBLIC_TARGET_URL, target_url)
+    project.set_property(CONSOLIDATE_TESTS, options.consolidate)
+    project.set_property(MAX_CONCURRENCY, options.max_concurrency)
+    project.set_property(DOWNLOAD_WORKERS, options.download_workers)
+    project.set_property(TAVERN_RUNNER, options.tavern_runner)
+    project.set_property("record_cypress", False)
+    if options.artifact_cache:
+        project.set_property(ARTIFACT_CACHE_DIR, os.path.join(os.path.dirname(basedir), "artifact-cache"))
+    return project
+
+
+def _write_payload(directory, role, payload_kb):
+    # random bytes do not compress so the payload size is the size added to every zip
+    os.makedirs(f"{directory}/data", exist_ok=True)
+    with open(f"{directory}/data/{role}.bin", "wb") as fp:
+        fp.write(os.urandom(payload_kb * 1024))
+
+
+def generate_tavern_tests(directory, role, tests, payload_kb, test_format):
+    os.makedirs(directory, exist_ok=True)
+    if test_format == "tavern":
+        documents = [f"test_name: {role} request {test}\n"
+                     "stages:\n"
+                     f"  - name: get {role} {test}\n"
+                     "    request:\n"
+                     f"      url: \"{{tavern.env_vars.TARGET}}/{role}/{test}\"\n"
+                     "      method: GET\n"
+                     "    response:\n"
+                     "      status_code: 200\n" for test in range(tests)]
+        with open(f"{directory}/test_{role}.tavern.yaml", "w") as fp:
+            fp.write("---\n".join(documents))
+    else:
+        # plain pytest modules exercise the same pipeline without needing tavern installed
+        with open(f"{directory}/test_{role}.py", "w") as fp:
+            fp.write("import os\nimport urllib.request\n")
+            for test in range(tests):
+                fp.write(f"\n\ndef test_{role}_{test}():\n"
+                         f"    with urllib.request.urlopen(f\"{{os.environ['TARGET']}}/{role}/{test}\") as response:\n"
+                         "        assert response.status == 200\n")
+    _write_payload(directory, role, payload_kb)
+
+
+def generate_cypress_tests(directory, role, tests, payload_kb):
+    os.makedirs(f"{directory}/cypress/e2e", exist_ok=True)
+    with open(f"{directory}/package.json", "w") as fp:
+        json.dump({"name": role, "private": True, "devDependencies": {"cypress": "^13.0.0"}}, fp, indent=2)
+    with open(f"{directory}/cypress/e2e/{role}.cy.js", "w") as fp:
+        fp.write(f"describe('{role}', () => {{\n")
+        for test in range(tests):
+            fp.write(f"  it('requests {test}', () => {{ cy.request('/{role}/{test}') }})\n")
+        fp.write("})\n")
+    _write_payload(directory, role, payload_kb)
+
+
+def seed_artifacts(workdir, options, endpoint_url, target_url, logger, reactor, recorder):
+    with recorder.phase("seed", 0, roles=options.roles) as entry:
+        uploaded_bytes = 0
+        for index in range(options.roles):
+            role = f"role{index:03d}"
+            project = _create_project(f"{workdir}/roles/{role}", f"{APPLICATION_GROUP_NAME}-{APPLICATION_NAME}-{role}",
+                                      options, endpoint_url, target_url)
+            project.set_property(ROLE, role)
+            manager = get_artifact_manager(project)
+            tools = {"tavern": project.expand_path(f"${TAVERN_TEST_DIR}")}
+            generate_tavern_tests(tools["tavern"], role, options.tests_per_role, options.payload_kb,
+                                  options.test_format)
+            if options.cypress:
+                tools["cypress"] = project.expand_path(f"${CYPRESS_TEST_DIR}")
+                generate_cypress_tests(tools["cypress"], role, options.tests_per_role, options.payload_kb)
+            for tool, test_dir in tools.items():
+                zip_file = package_artifacts(project, test_dir, tool, role)
+                manager.upload(file=zip_file, project=project, logger=logger, reactor=reactor)
+                uploaded_bytes += os.path.getsize(zip_file)
+        entry["bytes"] = uploaded_bytes
+
+
+def run_iteration(iteration, project, options, logger, reactor, recorder):
+    manager = get_artifact_manager(project)
+    latest_directory = get_latest_distribution_directory(project)
+    # every iteration starts from an empty LATEST directory, only the optional artifact cache survives
+    shutil.rmtree(latest_directory)
+    zipped_directory = get_latest_zipped_distribution_directory(project)
+    with recorder.phase("download", iteration) as entry:
+        manager._s3_transfer(source=get_latest_artifact_destination(logger, project),
+                             destination=zipped_directory,
+                             project=project,
+                             reactor=reactor,
+                             logger=logger,
+                             scope=get_testing_scope(project))
+        entry["bytes"] = sum(os.path.getsize(os.path.join(zipped_directory, name))
+                             for name in os.listdir(zipped_directory))
+    with recorder.phase("unzip_consolidate" if options.consolidate else "unzip", iteration):
+        _unzip_downloaded_artifacts(zipped_directory, latest_directory, logger, project)
+    with recorder.phase("test", iteration, tests=options.roles * options.tests_per_role):
+        if options.cypress and options.run_cypress:
+            tasks._run_tests_in_directory(latest_directory, logger, project, reactor, latest=True)
+        else:
+            tasks._run_tavern_tests_in_dist_dir(latest_directory, True, logger, project, reactor)
+
+
+def _print_phases(phases):
+    print(f"{'phase':<18} {'iter':>4} {'wall ms':>9} {'peak py KiB':>12} {'rss KiB':>10} {'bytes':>12}  status")
+    for entry in phases:
+        print(f"{entry['phase']:<18} {entry['iteration']:>4} {entry['wall_ms']:>9} "
+              f"{entry.get('peak_python_kb', '-'):>12} {entry['max_rss_kb']:>10} {entry.get('bytes', '-'):>12}  "
+              f"{entry['status']}")
+
+
+def run_benchmark(options):
+    workdir = options.workdir or tempfile.mkdtemp(prefix="integration-benchmark-")
+    logger = StdOutLogger(Logger.DEBUG if options.verbose else Logger.WARN)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    s3_port = _get_free_port()
+    s3_server = ThreadedMotoServer(ip_address="127.0.0.1", port=s3_port, verbose=False)
+    s3_server.start()
+    target = ThreadingHTTPServer(("127.0.0.1", 0), TargetHandler)
+    threading.Thread(target=target.serve_forever, daemon=True).start()
+    endpoint_url = f"http://127.0.0.1:{s3_port}"
+    target_url = f"http://127.0.0.1:{target.server_address[1]}"
+    recorder = PhaseRecorder(options.trace_memory)
+    if options.trace_memory:
+        tracemalloc.start()
+    try:
+        reactor = SimpleNamespace(pybuilder_venv=SimpleNamespace(executable=[sys.executable],
+                                                                 environ=dict(os.environ),
+                                                                 env_dir=f"{workdir}/venv"))
+        seed_artifacts(workdir, options, endpoint_url, target_url, logger, reactor, recorder)
+        project = _create_project(f"{workdir}/verifier", f"{APPLICATION_GROUP_NAME}-{APPLICATION_NAME}-verifier",
+                                  options, endpoint_url, target_url)
+        for iteration in range(1, options.repeat + 1):
+            run_iteration(iteration, project, options, logger, reactor, recorder)
+        timing_report = write_timing_report(project, prepare_reports_directory(project))
+    finally:
+        if options.trace_memory:
+            tracemalloc.stop()
+        target.shutdown()
+        s3_server.stop()
+    _print_phases(recorder.phases)
+    result = {"options": vars(options), "workdir": workdir, "timing_report": timing_report,
+              "phases": recorder.phases}
+    if options.output:
+        os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+        with open(options.output, "w") as fp:
+            json.dump(result, fp, indent=2)
+    if not options.workdir and not options.keep:
+        shutil.rmtree(workdir)
+    return result
+
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark verify_environment with synthetic roles")
+    parser.add_argument("--roles", type=int, default=10, help="number of synthetic roles")
+    parser.add_argument("--tests-per-role", type=int, default=5, help="tests generated for every role")
+    parser.add_argument("--payload-kb", type=int, default=64, help="incompressible data added to every artifact")
+    parser.add_argument("--test-format", choices=["python", "tavern"], default="python",
+                        help="generate plain pytest modules (no tavern needed) or tavern specifications")
+    parser.add_argument("--cypress", action="store_true", help="also generate and download cypress artifacts")
+    parser.add_argument("--run-cypress", action="store_true", help="run the cypress suites (needs npm)")
+    parser.add_argument("--consolidate", action="store_true", help="consolidate the tavern suites")
+    parser.add_argument("--max-concurrency", type=int, default=1, help=f"value of {MAX_CONCURRENCY}")
+    parser.add_argument("--download-workers", type=int, default=8, help=f"value of {DOWNLOAD_WORKERS}")
+    parser.add_argument("--tavern-runner", choices=["in_process", "subprocess"], default="in_process")
+    parser.add_argument("--artifact-cache", action="store_true", help="keep an artifact cache between iterations")
+    parser.add_argument("--repeat", type=int, default=1, help="download and test iterations")
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="skip tracemalloc, which slows down allocation heavy phases")
+    parser.add_argument("--workdir", help="directory for the generated projects (kept)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--output", help="write the results as json")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    run_benchmark(parse_arguments())
@@ -4,6 +4,10 @@ from pybuilder.core import task, Project, Logger, depends, after, init
 from pybuilder.reactor import Reactor
 
 import pybuilder_integration.tasks
+from pybuilder_integration_pytest import WORKER_GROUP_PREFIX
+from pybuilder_integration import tool_utility
+from pybuilder_integration.artifact_manager import ENTRY_POINT_GROUP
+from pybuilder_integration.cloudwatchlogs_utility import HEALTH_CHECK_FILTER_PATTERN
 from pybuilder_integration.properties import *
 
 
@@ -20,6 +24,12 @@ def init_plugin(project):
     project.plugin_depends_on("tavern")
 
 
+@after("prepare")
+def verify_integration_tools(project: Project, logger: Logger, reactor: Reactor):
+    # the plugin venv only exists once prepare ran - missing tools then fail the build before any test does
+    tool_utility.verify_required_tools(project, logger, reactor)
+
+
 @task(description="Runs integration tests against a CI/Prod environment."
                   "\t1. Run current build integration tests found in ${dir_dist}\n"
                   f"\t2. Run integration tests found in 'LATEST-{ENVIRONMENT}' managed by ${ARTIFACT_MANAGER}\n"
@@ -29,22 +39,62 @@ def init_plugin(project):
                   f"\t${ENVIRONMENT} - (required) Environment that is being tested (ci/prod)\n"
                   f"\t${TESTING_SCOPE} - (optional) Will limit scope of tests, default is to the same application - * can be used.\n"
                   f"\t${PROMOTE_ARTIFACT} - Promote integration tests to LATEST-${ENVIRONMENT} (default TRUE)\n"
+                  f"\t${ARTIFACT_MANAGER} - (optional) S3 (aws cli, default), S3_BOTO3 (in process transfers), LOCAL "
+                  f"or one registered under the '{ENTRY_POINT_GROUP}' entry point group\n"
+                  f"\t${ARTIFACT_LOCAL_DIR} - (required by LOCAL) Local or NFS directory holding the artifacts\n"
+                  f"\t${DOWNLOAD_WORKERS} - (optional) Concurrent LATEST downloads with S3_BOTO3 (default 8)\n"
+                  f"\t${ARTIFACT_CACHE_DIR} - (optional) Persistent cache of LATEST downloads with S3_BOTO3\n"
+                  f"\t${ARTIFACT_CACHE_MAX_MB} - (optional) Size bound of the artifact cache (default 1024)\n"
+                  f"\t${CLOUDWATCH_LOG_MODE} - (optional) latest (default) stream or filter events of the failed run\n"
+                  f"\t${CLOUDWATCH_FILTER_PATTERN} - (optional) CloudWatch filter pattern used by the filter mode "
+                  f"(default excludes health checks: {HEALTH_CHECK_FILTER_PATTERN})\n"
+                  f"\t${MAX_CONCURRENCY} - (optional) Number of LATEST role suites run at once (default 1)\n"
+                  f"\t${PREFETCH_LATEST} - (optional) Download LATEST while the current build is tested, its tavern "
+                  f"requirements too with the subprocess ${TAVERN_RUNNER} (default TRUE)\n"
+                  f"\t${SUITE_TIMEOUT} - (optional) Seconds a LATEST role suite run in its own process may take\n"
+                  f"\t${FAILURE_POLICY} - (optional) run_all (default) or fail_fast to stop the remaining LATEST "
+                  "role suites after the first failure\n"
+                  f"\t${INCREMENTAL_TESTS} - (optional) Skip LATEST suites that passed against the same target "
+                  "with the same content (default FALSE)\n"
+                  f"\t${FORCE_FULL_RUN} - (optional) Run every LATEST suite even in incremental mode\n"
+                  f"\t${INTEGRATION_TARGET_VERSION} - (optional) Version deployed to the target (default project "
+                  "version)\n"
+                  f"\t${SHARD_INDEX} - (optional) Shard of the LATEST roles and tests run by this runner (0 based)\n"
+                  f"\t${SHARD_COUNT} - (optional) Number of runners sharing the tests, promotion then needs "
+                  "merge_integration_shards\n"
+                  "\tPer phase timings are written to ${dir_reports}/integration/integration-timings.json\n"
       )
 def verify_environment(project: Project, logger: Logger, reactor: Reactor):
     tasks.verify_environment(project, logger, reactor)
 
 
+@task(description="Merges the junit reports of sharded verify_environment runs and promotes the integration "
+                  "artifacts once every shard passed.\n"
+                  f"\t${SHARD_REPORTS_DIR} - (optional) Directory holding the reports of every shard "
+                  "(default ${dir_reports}/integration)\n"
+                  f"\t${SHARD_COUNT} - (optional) Number of shards expected\n"
+                  f"\t${PROMOTE_ARTIFACT} - Promote integration tests to LATEST-${ENVIRONMENT} (default TRUE)\n"
+      )
+def merge_integration_shards(project: Project, logger: Logger, reactor: Reactor):
+    tasks.merge_integration_shards(project, logger, reactor)
+
+
 @task(description="Run integration tests using a cypress spec. Requires NPM installed.\n"
                   f"\t{INTEGRATION_TARGET_URL} - (required) Full URL target for cypress tests\n"
                   f"\t{INTEGRATION_PUBLIC_TARGET_URL} - (required) Full public URL target for cypress tests\n"
                   f"\t{CYPRESS_TEST_DIR} - directory for test specification (src/integrationtest/cypress)\n"
+                  f"\t{NPM_CACHE_DIR} - node_modules shared by LATEST role suites with identical dependencies\n"
+                  f"\t{CYPRESS_VERSION} - cypress version installed when there is no package.json\n"
       )
 def verify_cypress(project: Project, logger: Logger, reactor: Reactor):
     tasks.verify_cypress(project, logger, reactor)
 
 
 @task(description="Run integration tests using tavern specifications.\n"
-                  f"\t{TAVERN_TEST_DIR} - directory containing tavern specifications ({DEFAULT_TAVERN_TEST_DIR})")
+                  f"\t{TAVERN_TEST_DIR} - directory containing tavern specifications ({DEFAULT_TAVERN_TEST_DIR})\n"
+                  f"\t{TAVERN_RUNNER} - in_process (default) or subprocess to run each suite in its own process\n"
+                  f"\t{RUN_PARALLEL} - pytest-xdist workers balanced with the test durations packaged by earlier runs "
+                  f"(--dist loadgroup then appends @{WORKER_GROUP_PREFIX}<N> to every junit testcase name)")
 def verify_tavern(project: Project, logger: Logger, reactor: Reactor):
     tasks.verify_tavern(project, logger, reactor)
 
@@ -55,7 +105,8 @@ def verify_package():
     pass
 
 
-@task(description="Package artifacts for publishing in integration tests")
+@task(description="Package artifacts for publishing in integration tests\n"
+                  f"\t{PACKAGE_EXCLUDES} - glob patterns left out of the package (node_modules, __pycache__, ...)")
 def package_artifacts(project: Project):
     package_tavern_artifacts(project)
     package_cypress_artifacts(project)
@@ -64,7 +115,7 @@ def package_artifacts(project: Project):
 @task(description="Package tavern artifacts for publishing in integration tests")
 def package_tavern_artifacts(project: Project):
     test_dir = project.expand_path(f"${TAVERN_TEST_DIR}")
-    tasks.package_artifacts(project, test_dir, "tavern", project.get_property(ROLE))
+    tasks.package_tavern_artifacts(project, test_dir, project.get_property(ROLE))
 
 
 @task(description="Package cypress artifacts for publishing in integration tests")
@@ -1,61 +1,161 @@
+import importlib.metadata
+import json
 import os
 import shutil
-from typing import Dict
-
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import weakref
+from abc import ABC, abstractmethod
+from typing import Dict, NamedTuple
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from pybuilder.core import Project, Logger
 from pybuilder.errors import BuildFailedException
 from pybuilder.reactor import Reactor
 
 from pybuilder_integration import exec_utility
+from pybuilder_integration.cache_utility import ArtifactCache
 from pybuilder_integration.directory_utility import get_latest_distribution_directory, \
-    get_latest_zipped_distribution_directory
+    get_latest_zipped_distribution_directory, get_file_checksum, prepare_logs_directory, prepare_reports_directory
 from pybuilder_integration.properties import *
+from pybuilder_integration.timing_utility import timed
+from pybuilder_integration.tool_utility import require_tool
+
+
+CHECKSUM_METADATA_KEY = "sha256"
+CONSOLIDATED_SOURCES_FILE = "sources.json"
+SUITE_STATE_FILE = "integration-suite-state.json"
 
+_metadata = weakref.WeakKeyDictionary()
+_metadata_lock = threading.Lock()
 
-class ArtifactManager:
+
+class ArtifactManager(ABC):
     def __init__(self, name, identifier):
         self.identifier = identifier
         self.friendly_name = name
 
+    @abstractmethod
     def upload(self, file: str, project: Project, logger: Logger, reactor: Reactor):
         pass
 
+    @abstractmethod
     def download_artifacts(self, project: Project, logger: Logger, reactor: Reactor):
         pass
 
+    # suite state is optional - without it every LATEST suite runs
+    def read_suite_state(self, project: Project, logger: Logger, reactor: Reactor):
+        return None
+
+    def write_suite_state(self, state: dict, project: Project, logger: Logger, reactor: Reactor):
+        pass
+
 
 class S3ArtifactManager(ArtifactManager):
 
-    def __init__(self):
-        super().__init__("AWS S3 Artifact Manager", "S3")
+    def __init__(self, name="AWS S3 Artifact Manager", identifier="S3"):
+        super().__init__(name, identifier)
+        # per build (project) so a bucket is looked up and created at most once
+        self._bucket_states = weakref.WeakKeyDictionary()
+        self._bucket_lock = threading.RLock()
 
     def upload(self, file: str, project: Project, logger: Logger, reactor: Reactor):
         if project.get_property("abort_upload","false") != "false":
             return
         # First make sure bucket exists
-        self.create_bucket(logger, project, reactor)
+        with timed(project, "s3_bucket_check"):
+            self.create_bucket(logger, project, reactor)
         relative_path = get_latest_artifact_destination(logger, project)
-        self._s3_transfer(file, relative_path, project, reactor, logger, recursive=False)
+        latest_artifact = f"{relative_path}{os.path.basename(file)}"
+        with timed(project, "s3_upload", artifact=os.path.basename(file)) as timing:
+            checksum = get_file_checksum(file)
+            if self.get_artifact_checksum(latest_artifact, project, reactor, logger) == checksum:
+                logger.info(f"{os.path.basename(file)} is unchanged in {relative_path} - skipping upload")
+                timing["bytes"] = 0
+            else:
+                self._s3_transfer(file, relative_path, project, reactor, logger, recursive=False,
+                                  metadata={CHECKSUM_METADATA_KEY: checksum})
+                timing["bytes"] = os.path.getsize(file)
+        # LATEST now holds this build's artifact so the versioned copy can be made server side
         relative_path = get_versioned_artifact_destination(logger, project)
-        self._s3_transfer(file, relative_path, project, reactor, logger, recursive=False)
+        with timed(project, "s3_copy", artifact=os.path.basename(file)):
+            self._s3_transfer(latest_artifact, relative_path, project, reactor, logger, recursive=False)
 
     def download_artifacts(self, project: Project, logger: Logger, reactor: Reactor):
         # this is a noop if there is no bucket
-        if not self.does_bucket_exist(logger, project, reactor):
-            return
+        with timed(project, "s3_bucket_check"):
+            if not self.does_bucket_exist(logger, project, reactor):
+                return
         s3_location = get_latest_artifact_destination(logger, project)
         zipped_directory = get_latest_zipped_distribution_directory(project)
-        self._s3_transfer(source=s3_location,
-                          destination=zipped_directory,
-                          project=project,
-                          logger=logger,
-                          reactor=reactor)
-        return _unzip_downloaded_artifacts(zipped_directory, get_latest_distribution_directory(project), logger, project)
-
-    @staticmethod
-    def _s3_transfer(source, destination, project, reactor, logger, recursive=True):
+        with timed(project, "s3_download") as timing:
+            self._s3_transfer(source=s3_location,
+                              destination=zipped_directory,
+                              project=project,
+                              logger=logger,
+                              reactor=reactor,
+                              scope=get_testing_scope(project))
+            timing["bytes"] = _get_directory_size(zipped_directory)
+        return _unzip_downloaded_artifacts(zipped_directory, get_latest_distribution_directory(project), logger,
+                                           project)
+
+    def read_suite_state(self, project: Project, logger: Logger, reactor: Reactor):
+        with timed(project, "suite_state", action="read") as timing:
+            if not self.does_bucket_exist(logger, project, reactor):
+                return None
+            state_artifact = get_suite_state_destination(logger, project)
+            # written with its checksum - no checksum means there is no state yet
+            checksum = self.get_artifact_checksum(state_artifact, project, reactor, logger)
+            if not checksum:
+                logger.info(f"No suite state found at {state_artifact} - running every suite")
+                return None
+            state_file = f"{prepare_logs_directory(project)}/{SUITE_STATE_FILE}"
+            self._s3_transfer(state_artifact, state_file, project, reactor, logger, recursive=False)
+            if get_file_checksum(state_file) != checksum:
+                logger.warn(f"Suite state {state_artifact} does not match its checksum - running every suite")
+                return None
+            timing["bytes"] = os.path.getsize(state_file)
+            with open(state_file) as fp:
+                return json.load(fp)
+
+    def write_suite_state(self, state: dict, project: Project, logger: Logger, reactor: Reactor):
+        state_file = f"{prepare_reports_directory(project)}/{SUITE_STATE_FILE}"
+        with open(state_file, "w") as fp:
+            json.dump(state, fp, indent=2, sort_keys=True)
+        with timed(project, "suite_state", action="write", bytes=os.path.getsize(state_file)):
+            self._s3_transfer(state_file, get_suite_state_destination(logger, project), project, reactor, logger,
+                              recursive=False, metadata={CHECKSUM_METADATA_KEY: get_file_checksum(state_file)})
+
+    def get_artifact_checksum(self, artifact, project, reactor, logger):
+        bucket, key = split_s3_url(artifact)
+        log_file_name = 's3-head-object'
+        if not exec_utility.exec_command(command_name='aws',
+                                         args=['s3api', 'head-object', '--bucket', bucket, '--key', key,
+                                               # parsed below whatever output the user's aws config sets
+                                               '--output', 'json'],
+                                         failure_message=f"No existing artifact found at {artifact}",
+                                         log_file_name=log_file_name,
+                                         project=project,
+                                         reactor=reactor,
+                                         logger=logger,
+                                         raise_exception=False,
+                                         report=False):
+            return None
+        try:
+            with open(f"{prepare_logs_directory(project)}/{log_file_name}") as fp:
+                return json.load(fp).get("Metadata", {}).get(CHECKSUM_METADATA_KEY)
+        except ValueError:
+            return None
+
+    def _s3_transfer(self, source, destination, project, reactor, logger, recursive=True, scope="*",
+                     metadata=None):
         logger.info(f"Proceeding to transfer {source} to {destination}")
-        S3ArtifactManager.verify_aws_cli(reactor)
+        S3ArtifactManager.verify_aws_cli(reactor, project)
         #  aws s3 cp myDir s3://mybucket/ --recursive
         args = [
             's3',
@@ -65,6 +165,11 @@ class S3ArtifactManager(ArtifactManager):
         ]
         if recursive:
             args.append("--recursive")
+            if scope != "*":
+                # let the cli skip out of scope artifacts instead of downloading and discarding them
+                args.extend(["--exclude", "*", "--include", f"*{scope}*"])
+        if metadata:
+            args.extend(["--metadata", ",".join(f"{key}={value}" for key, value in metadata.items())])
         exec_utility.exec_command(command_name='aws',
                                   args=args,
                                   failure_message=f"Failed to transfer integration artifacts to {destination}",
@@ -75,17 +180,28 @@ class S3ArtifactManager(ArtifactManager):
                                   report=False)
 
     @staticmethod
-    def verify_aws_cli(reactor):
-        reactor.pybuilder_venv.verify_can_execute(command_and_arguments=["aws", "--version"],
-                                                  prerequisite="aws cli",
-                                                  caller="integration_tests")
+    def verify_aws_cli(reactor, project):
+        # probed once per build - every transfer used to fork a version check of its own
+        require_tool("aws", project, reactor)
 
     def create_bucket(self, logger, project, reactor):
-        app_group, app_name, bucket, environment, role = get_project_metadata(logger, project)
-        S3ArtifactManager.verify_aws_cli(reactor)
-        res = self.does_bucket_exist(logger, project, reactor)
-        if res:
-            return
+        bucket = get_project_metadata(logger, project).bucket
+        with self._bucket_lock:
+            if self.does_bucket_exist(logger, project, reactor):
+                return
+            self._create_bucket(bucket, logger, project, reactor)
+            self._bucket_states.setdefault(project, {})[bucket] = True
+
+    def does_bucket_exist(self, logger, project, reactor):
+        bucket = get_project_metadata(logger, project).bucket
+        with self._bucket_lock:
+            states = self._bucket_states.setdefault(project, {})
+            if bucket not in states:
+                states[bucket] = self._head_bucket(bucket, logger, project, reactor)
+            return states[bucket]
+
+    def _create_bucket(self, bucket, logger, project, reactor):
+        S3ArtifactManager.verify_aws_cli(reactor, project)
         exec_utility.exec_command(command_name='aws',
                                   args=[
                                       's3api',
@@ -102,9 +218,7 @@ class S3ArtifactManager(ArtifactManager):
                                   logger=logger,
                                   report=False)
 
-    def does_bucket_exist(self, logger, project, reactor):
-        app_group, app_name, bucket, environment, role = get_project_metadata(logger, project)
-
+    def _head_bucket(self, bucket, logger, project, reactor):
         args = [
             's3api',
             'head-bucket',
@@ -113,28 +227,305 @@ class S3ArtifactManager(ArtifactManager):
         ]
         if project.get_property("verbose", False):
             args.append('--debug')
-        return exec_utility.exec_command(command_name='aws',
-                                         args=args,
-                                         failure_message=f"Failed to find bucket",
-                                         log_file_name='s3-head-bucket',
-                                         project=project,
-                                         reactor=reactor,
-                                         logger=logger,
-                                         raise_exception=True,
-                                         report=False)
+        log_file_name = 's3-head-bucket'
+        if exec_utility.exec_command(command_name='aws',
+                                     args=args,
+                                     failure_message=f"Bucket {bucket} not found",
+                                     log_file_name=log_file_name,
+                                     project=project,
+                                     reactor=reactor,
+                                     logger=logger,
+                                     raise_exception=False,
+                                     report=False):
+            return True
+        # only a missing bucket is a noop - no access or no connection still fails the build
+        error_file = f"{prepare_logs_directory(project)}/{log_file_name}.err"
+        if os.path.exists(error_file):
+            with open(error_file) as fp:
+                if "(404)" in fp.read():
+                    return False
+        raise BuildFailedException(f"Failed to find bucket {bucket} - see {log_file_name}.err")
+
+
+class Boto3S3ArtifactManager(S3ArtifactManager):
+
+    def __init__(self):
+        super().__init__("AWS S3 Artifact Manager (boto3)", "S3_BOTO3")
+        self.s3client = None
+        self.endpoint_url = None
+        self._client_lock = threading.Lock()
+
+    def _get_s3_client(self, project):
+        endpoint_url = project.get_property(S3_ENDPOINT_URL)
+        with self._client_lock:
+            if not self.s3client or self.endpoint_url != endpoint_url:
+                # one client for the build - its connection pool is shared by every transfer thread
+                config = Config(max_pool_connections=max(10, _get_s3_max_concurrency(project)))
+                self.s3client = boto3.client('s3', endpoint_url=endpoint_url, config=config)
+                self.endpoint_url = endpoint_url
+            return self.s3client
+
+    def get_artifact_checksum(self, artifact, project, reactor, logger):
+        bucket, key = split_s3_url(artifact)
+        try:
+            response = self._get_s3_client(project).head_object(Bucket=bucket, Key=key)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise BuildFailedException(f"Failed to read artifact {artifact}: {ex}")
+        return response.get("Metadata", {}).get(CHECKSUM_METADATA_KEY)
+
+    def _s3_transfer(self, source, destination, project, reactor, logger, recursive=True, scope="*",
+                     metadata=None):
+        logger.info(f"Proceeding to transfer {source} to {destination}")
+        client = self._get_s3_client(project)
+        transfer_config = TransferConfig(max_concurrency=_get_s3_max_concurrency(project))
+        try:
+            if source.startswith("s3://"):
+                bucket, prefix = split_s3_url(source)
+                if recursive:
+                    objects = [item for item in _list_objects(client, bucket, prefix)
+                               if in_scope(scope, os.path.basename(item["Key"]))]
+                    logger.info(f"Downloading {len(objects)} artifacts in scope {scope} from {source}")
+                    cache = _get_artifact_cache(project, logger)
+
+                    def download(item):
+                        key = item["Key"]
+                        target = os.path.join(destination, key[len(prefix):].lstrip("/"))
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+                        def download_to(path):
+                            client.download_file(bucket, key, path, Config=transfer_config)
+
+                        if cache:
+                            # the listing already carries the etag - unchanged objects cost no extra request
+                            cache.fetch(bucket, key, item["ETag"], target, download_to)
+                        else:
+                            download_to(target)
+
+                    with ThreadPoolExecutor(max_workers=_get_download_workers(project),
+                                            thread_name_prefix="s3-download") as executor:
+                        # consume the results so the first failed download is raised here
+                        list(executor.map(download, objects))
+                    if cache:
+                        cache.evict()
+                        cache.log_statistics()
+                elif destination.startswith("s3://"):
+                    destination_bucket, key = split_s3_url(destination)
+                    if not key or key.endswith("/"):
+                        key = f"{key}{os.path.basename(prefix)}"
+                    # managed copy is server side - the object never passes through this machine
+                    client.copy({"Bucket": bucket, "Key": prefix}, destination_bucket, key, Config=transfer_config)
+                else:
+                    client.download_file(bucket, prefix, destination, Config=transfer_config)
+            else:
+                bucket, key = split_s3_url(destination)
+                if not key or key.endswith("/"):
+                    key = f"{key}{os.path.basename(source)}"
+                extra_args = {"Metadata": metadata} if metadata else None
+                client.upload_file(source, bucket, key, ExtraArgs=extra_args, Config=transfer_config)
+        except (BotoCoreError, ClientError) as ex:
+            raise BuildFailedException(f"Failed to transfer integration artifacts to {destination}: {ex}")
+
+    def _create_bucket(self, bucket, logger, project, reactor):
+        client = self._get_s3_client(project)
+        params = {"ACL": "private", "Bucket": bucket}
+        region = client.meta.region_name
+        if region and region != "us-east-1":
+            params["CreateBucketConfiguration"] = {"LocationConstraint": region}
+        try:
+            client.create_bucket(**params)
+        except (BotoCoreError, ClientError) as ex:
+            raise BuildFailedException(f"Failed to create bucket: {ex}")
+
+    def _head_bucket(self, bucket, logger, project, reactor):
+        try:
+            self._get_s3_client(project).head_bucket(Bucket=bucket)
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("404", "NoSuchBucket"):
+                return False
+            raise BuildFailedException(f"Failed to find bucket: {ex}")
+        except BotoCoreError as ex:
+            raise BuildFailedException(f"Failed to find bucket: {ex}")
+        return True
+
+
+class LocalArtifactManager(ArtifactManager):
+    # same layout as the S3 managers under a local or NFS mounted directory: {root}/{bucket}/LATEST-{env}/...
+
+    def __init__(self, name="Local Filesystem Artifact Manager", identifier="LOCAL"):
+        super().__init__(name, identifier)
+
+    def upload(self, file: str, project: Project, logger: Logger, reactor: Reactor):
+        if project.get_property("abort_upload","false") != "false":
+            return
+        latest_artifact = self._get_path(f"{get_latest_artifact_destination(logger, project)}{os.path.basename(file)}",
+                                         project)
+        with timed(project, "artifact_upload", artifact=os.path.basename(file)) as timing:
+            if os.path.exists(latest_artifact) and get_file_checksum(latest_artifact) == get_file_checksum(file):
+                logger.info(f"{os.path.basename(file)} is unchanged in {os.path.dirname(latest_artifact)} "
+                            f"- skipping upload")
+                timing["bytes"] = 0
+            else:
+                _copy_atomically(file, latest_artifact)
+                timing["bytes"] = os.path.getsize(file)
+        versioned_artifact = self._get_path(
+            f"{get_versioned_artifact_destination(logger, project)}{os.path.basename(file)}", project)
+        with timed(project, "artifact_copy", artifact=os.path.basename(file)):
+            _copy_atomically(latest_artifact, versioned_artifact)
+
+    def download_artifacts(self, project: Project, logger: Logger, reactor: Reactor):
+        # this is a noop if nothing was ever promoted
+        if not self.does_bucket_exist(logger, project, reactor):
+            return
+        latest_directory = self._get_path(get_latest_artifact_destination(logger, project), project)
+        zipped_directory = get_latest_zipped_distribution_directory(project)
+        scope = get_testing_scope(project)
+        with timed(project, "artifact_download") as timing:
+            timing["bytes"] = 0
+            if os.path.isdir(latest_directory):
+                for name in sorted(os.listdir(latest_directory)):
+                    if name.endswith(".zip") and in_scope(scope, name):
+                        shutil.copyfile(os.path.join(latest_directory, name), os.path.join(zipped_directory, name))
+                        timing["bytes"] += os.path.getsize(os.path.join(zipped_directory, name))
+        return _unzip_downloaded_artifacts(zipped_directory, get_latest_distribution_directory(project), logger,
+                                           project)
+
+    def read_suite_state(self, project: Project, logger: Logger, reactor: Reactor):
+        state_file = self._get_path(get_suite_state_destination(logger, project), project)
+        with timed(project, "suite_state", action="read") as timing:
+            if not os.path.exists(state_file):
+                logger.info(f"No suite state found at {state_file} - running every suite")
+                return None
+            timing["bytes"] = os.path.getsize(state_file)
+            with open(state_file) as fp:
+                return json.load(fp)
+
+    def write_suite_state(self, state: dict, project: Project, logger: Logger, reactor: Reactor):
+        state_file = f"{prepare_reports_directory(project)}/{SUITE_STATE_FILE}"
+        with open(state_file, "w") as fp:
+            json.dump(state, fp, indent=2, sort_keys=True)
+        with timed(project, "suite_state", action="write", bytes=os.path.getsize(state_file)):
+            _copy_atomically(state_file, self._get_path(get_suite_state_destination(logger, project), project))
+
+    def does_bucket_exist(self, logger, project, reactor):
+        return os.path.isdir(self._get_path(f"s3://{get_project_metadata(logger, project).bucket}", project))
+
+    def create_bucket(self, logger, project, reactor):
+        os.makedirs(self._get_path(f"s3://{get_project_metadata(logger, project).bucket}", project), exist_ok=True)
+
+    def _get_path(self, destination, project):
+        root = project.get_property(ARTIFACT_LOCAL_DIR)
+        if not root:
+            raise BuildFailedException(f"${ARTIFACT_LOCAL_DIR} is required by the {self.identifier} artifact manager")
+        bucket, key = split_s3_url(destination)
+        return os.path.join(project.basedir, os.path.expanduser(project.expand(root)), bucket, key)
+
+
+def _copy_atomically(source, destination):
+    # readers of a shared directory see either the previous or the new file, never a partial copy
+    directory = os.path.dirname(destination)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(prefix=f".{os.path.basename(destination)}.", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as target, open(source, "rb") as fp:
+            shutil.copyfileobj(fp, target, 1024 * 1024)
+        os.replace(temp_file, destination)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def _get_s3_max_concurrency(project):
+    return max(1, int(project.get_property(S3_MAX_CONCURRENCY, 10)))
+
+
+def _get_download_workers(project):
+    return max(1, int(project.get_property(DOWNLOAD_WORKERS, 8)))
+
+
+def _get_artifact_cache(project, logger):
+    cache_directory = project.get_property(ARTIFACT_CACHE_DIR)
+    if not cache_directory:
+        return None
+    max_size_bytes = int(project.get_property(ARTIFACT_CACHE_MAX_MB, 1024)) * 1024 * 1024
+    # allow a path outside of the project (e.g. ~/.cache) so the cache outlives the build directory
+    cache_directory = os.path.join(project.basedir, os.path.expanduser(project.expand(cache_directory)))
+    return ArtifactCache(cache_directory, max_size_bytes, logger)
+
+
+def _get_directory_size(directory):
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, dirnames, filenames in os.walk(directory) for name in filenames)
 
 
-artifact_managers: Dict[str, S3ArtifactManager] = {}
-manager = S3ArtifactManager()
-artifact_managers[manager.identifier] = manager
+def _list_objects(client, bucket, prefix):
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            if not item["Key"].endswith("/"):
+                yield item
+
+
+def split_s3_url(url):
+    bucket, _, key = url[len("s3://"):].partition("/")
+    return bucket, key
+
+
+ENTRY_POINT_GROUP = "pybuilder_integration.artifact_managers"
+
+artifact_managers: Dict[str, ArtifactManager] = {}
+_entry_point_errors = {}
+_entry_points_loaded = False
+_registry_lock = threading.Lock()
+
+
+def register_artifact_manager(manager: ArtifactManager):
+    with _registry_lock:
+        artifact_managers[manager.identifier] = manager
+
+
+for manager in [S3ArtifactManager(), Boto3S3ArtifactManager(), LocalArtifactManager()]:
+    register_artifact_manager(manager)
+
+
+def _load_entry_point_managers():
+    # third party managers are discovered once, a broken one only fails the builds that select it
+    global _entry_points_loaded
+    with _registry_lock:
+        if _entry_points_loaded:
+            return
+        _entry_points_loaded = True
+    discovered = importlib.metadata.entry_points()
+    if hasattr(discovered, "select"):
+        discovered = discovered.select(group=ENTRY_POINT_GROUP)
+    else:
+        discovered = discovered.get(ENTRY_POINT_GROUP, [])
+    for entry_point in discovered:
+        try:
+            manager = entry_point.load()
+            if isinstance(manager, type):
+                manager = manager()
+        except Exception as ex:
+            _entry_point_errors[entry_point.name] = ex
+            continue
+        with _registry_lock:
+            artifact_managers.setdefault(manager.identifier, manager)
 
 
 def get_artifact_manager(project: Project) -> ArtifactManager:
     manager_id = project.get_property(ARTIFACT_MANAGER, "S3")
-    global artifact_managers
-    manager = artifact_managers.get(manager_id)
+    _load_entry_point_managers()
+    with _registry_lock:
+        manager = artifact_managers.get(manager_id)
     if not manager:
-        raise BuildFailedException(f"Failed to find appropriate artifact manager for {manager_id}")
+        message = f"Failed to find appropriate artifact manager for {manager_id} " \
+                  f"(available: {', '.join(sorted(artifact_managers))})"
+        # the identifier of a manager that failed to load is unknown - it may be any of them
+        if _entry_point_errors:
+            message += " - failed to load entry points: " + \
+                       "; ".join(f"{name}: {ex}" for name, ex in sorted(_entry_point_errors.items()))
+        raise BuildFailedException(message)
     return manager
 
 
@@ -174,54 +565,142 @@ def extract_application_role(logger, project):
     return app_group, app_name, role
 
 
+def get_testing_scope(project):
+    return project.get_property(TESTING_SCOPE, project.get_property(APPLICATION, '*'))
+
+
 def in_scope(scope, filename):
     if scope == "*": return True
     return scope in filename
 
 
-def _unzip_downloaded_artifacts(dir_with_zips: str, destination: str, logger: Logger, project:Project) -> str:
-    scope = project.get_property(TESTING_SCOPE,project.get_property(APPLICATION,'*'))
-    for file in os.listdir(dir_with_zips):
+def _unzip_downloaded_artifacts(dir_with_zips: str, destination: str, logger: Logger, project: Project) -> str:
+    scope = get_testing_scope(project)
+    consolidate = project.get_property(CONSOLIDATE_TESTS, False)
+    archives = []
+    for file in sorted(os.listdir(dir_with_zips)):
         # expect {tool}-{self.project.name}.zip
         filename = os.path.basename(file)
         if not in_scope(scope, filename):
             continue
         if filename.find("tavern") >= 0:
-            shutil.unpack_archive(filename=os.path.join(dir_with_zips, file), extract_dir=f"{destination}/tavern",
-                                  format="zip")
+            archives.append((os.path.join(dir_with_zips, file), "tavern"))
         elif filename.find("cypress") >= 0:
-            shutil.unpack_archive(filename=os.path.join(dir_with_zips, file), extract_dir=f"{destination}/cypress",
-                                  format="zip")
+            archives.append((os.path.join(dir_with_zips, file), "cypress"))
         else:
             logger.warn(f"Unexpected file name in downloaded artifacts {file}")
-    if project.get_property(CONSOLIDATE_TESTS,False):
-        consolidated_folder = f"{destination}/tavern/consolidated"
-        logger.debug(f"Consolidating test files into {consolidated_folder}")
+    consolidated_folder = f"{destination}/tavern/consolidated"
+    members_by_archive, roles, owners = _plan_extraction(archives, destination,
+                                                         consolidated_folder if consolidate else None, logger)
+    # every member is read once and written straight to where the tests will run from
+    with timed(project, "unzip", archives=len(members_by_archive)) as timing:
+        with ThreadPoolExecutor(max_workers=_get_download_workers(project), thread_name_prefix="unzip") as executor:
+            timing["bytes"] = sum(executor.map(lambda item: _extract_members(*item), members_by_archive.items()))
+    if consolidate:
         os.makedirs(consolidated_folder, exist_ok=True)
         logger.debug(f"Creating role file for log retrieval {consolidated_folder}/roles")
-        open(f"{consolidated_folder}/roles", 'w').close()
-        for dirn in os.listdir(f"{destination}/tavern"):
-            if "consolidated" != dirn:
-                logger.debug(f"Consolidating directory: {dirn}")
-                shutil.copytree(f"{destination}/tavern/{dirn}", consolidated_folder, dirs_exist_ok=True)
-                shutil.rmtree(f"{destination}/tavern/{dirn}")
-                with open(f"{consolidated_folder}/roles", "a") as fp:
-                    fp.writelines(dirn)
+        with open(f"{consolidated_folder}/roles", "w") as fp:
+            fp.writelines(f"{role}\n" for role in roles)
+        # lets a failed consolidated run be traced back to the roles that own the failing tests
+        sources = {os.path.relpath(target, consolidated_folder).replace(os.sep, "/"): role
+                   for target, (archive_path, role, name) in owners.items()
+                   if os.path.commonpath([consolidated_folder, target]) == os.path.normpath(consolidated_folder)}
+        with open(f"{consolidated_folder}/{CONSOLIDATED_SOURCES_FILE}", "w") as fp:
+            json.dump(sources, fp, indent=2, sort_keys=True)
     return destination
 
 
-def get_project_metadata(logger: Logger, project: Project):
-    app_group, app_name, role = extract_application_role(logger, project)
-    environment = project.get_mandatory_property(ENVIRONMENT)
-    bucket = project.get_property(INTEGRATION_ARTIFACT_BUCKET, f"integration-artifacts-{app_group}-{app_name}")
-    return app_group, app_name, bucket, environment, role
+def _plan_extraction(archives, destination, consolidated_folder, logger):
+    members_by_archive = {}
+    owners = {}
+    roles = []
+    for archive_path, tool in archives:
+        members = members_by_archive.setdefault(archive_path, [])
+        with zipfile.ZipFile(archive_path) as archive:
+            for name in archive.namelist():
+                role, _, relative_path = name.partition("/")
+                if tool == "tavern" and consolidated_folder:
+                    if role not in roles:
+                        logger.debug(f"Consolidating role: {role}")
+                        roles.append(role)
+                    target = os.path.normpath(os.path.join(consolidated_folder, relative_path))
+                    root = consolidated_folder
+                else:
+                    root = os.path.join(destination, tool)
+                    target = os.path.normpath(os.path.join(root, name))
+                if os.path.commonpath([root, target]) != os.path.normpath(root):
+                    raise BuildFailedException(f"Refusing to extract {name} outside of {root} from {archive_path}")
+                if name.endswith("/"):
+                    os.makedirs(target, exist_ok=True)
+                    continue
+                previous = owners.get(target)
+                if previous and previous[1] != role:
+                    logger.warn(f"{relative_path} is provided by roles {previous[1]} and {role} - using {role}")
+                    members_by_archive[previous[0]].remove((previous[2], target))
+                owners[target] = (archive_path, role, name)
+                members.append((name, target))
+    return members_by_archive, roles, owners
+
+
+def _extract_members(archive_path, members):
+    extracted_bytes = 0
+    with zipfile.ZipFile(archive_path) as archive:
+        for name, target in members:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.open(name) as source, open(target, "wb") as destination:
+                shutil.copyfileobj(source, destination, 1024 * 1024)
+            extracted_bytes += archive.getinfo(name).file_size
+    return extracted_bytes
+
+
+class ProjectMetadata(NamedTuple):
+    app_group: str
+    app_name: str
+    bucket: str
+    environment: str
+    role: str
+
+    @property
+    def latest_destination(self):
+        return f"s3://{self.bucket}/LATEST-{self.environment}/"
+
+    def get_versioned_destination(self, version):
+        return f"s3://{self.bucket}/{self.role}/{version}/"
+
+    def get_state_destination(self, name):
+        return f"s3://{self.bucket}/STATE-{self.environment}/{name}.json"
+
+
+def get_project_metadata(logger: Logger, project: Project) -> ProjectMetadata:
+    # everything the naming scheme is derived from - a change to any of it resolves the metadata again
+    key = (project.name, project.get_property(APPLICATION_GROUP), project.get_property(APPLICATION),
+           project.get_property(ROLE), project.get_property(ENVIRONMENT),
+           project.get_property(INTEGRATION_ARTIFACT_BUCKET))
+    with _metadata_lock:
+        cached = _metadata.get(project)
+        if cached and cached[0] == key:
+            return cached[1]
+        app_group, app_name, role = extract_application_role(logger, project)
+        environment = project.get_mandatory_property(ENVIRONMENT)
+        bucket = project.get_property(INTEGRATION_ARTIFACT_BUCKET, f"integration-artifacts-{app_group}-{app_name}")
+        metadata = ProjectMetadata(app_group, app_name, bucket, environment, role)
+        _metadata[project] = (key, metadata)
+        return metadata
 
 
 def get_versioned_artifact_destination(logger, project):
-    app_group, app_name, bucket, environment, role = get_project_metadata(logger, project)
-    return f"s3://{bucket}/{role}/{project.version}/"
+    return get_project_metadata(logger, project).get_versioned_destination(project.version)
 
 
 def get_latest_artifact_destination(logger, project):
-    app_group, app_name, bucket, environment, role = get_project_metadata(logger, project)
-    return f"s3://{bucket}/LATEST-{environment}/"
+    return get_project_metadata(logger, project).latest_destination
+
+
+def get_suite_state_destination(logger, project):
+    metadata = get_project_metadata(logger, project)
+    name = metadata.role
+    shard_count = int(project.get_property(SHARD_COUNT, 1))
+    if shard_count > 1:
+        # every runner records the suites of its own shard
+        name = f"{name}.shard-{project.get_property(SHARD_INDEX, 0)}-of-{shard_count}"
+    return metadata.get_state_destination(name)
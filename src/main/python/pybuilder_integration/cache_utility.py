@@ -0,0 +1,126 @@
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+from pybuilder.core import Logger
+
+
+class ArtifactCache:
+
+    def __init__(self, directory, max_size_bytes, logger: Logger) -> None:
+        super().__init__()
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_entry_path(self, bucket, key, etag):
+        # the etag changes with the content so an entry never needs revalidating once written
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.artifact")
+
+    def fetch(self, bucket, key, etag, destination, download):
+        entry_path = self._get_entry_path(bucket, key, etag)
+        if os.path.exists(entry_path):
+            with self._lock:
+                self.hits += 1
+            # touch the entry so eviction is least recently used
+            os.utime(entry_path)
+        else:
+            with self._lock:
+                self.misses += 1
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".partial")
+            os.close(fd)
+            try:
+                download(temp_path)
+                os.replace(temp_path, entry_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        shutil.copyfile(entry_path, destination)
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".artifact"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            self.logger.debug(f"Evicting {name} from artifact cache")
+            os.remove(os.path.join(self.directory, name))
+            total_size -= size
+
+    def log_statistics(self):
+        self.logger.info(f"Artifact cache {self.directory}: {self.hits} hits, {self.misses} misses")
+
+
+class RequirementsCache:
+
+    def __init__(self, marker_file) -> None:
+        super().__init__()
+        self.marker_file = marker_file
+        self._installed = {}
+        if os.path.exists(marker_file):
+            with open(marker_file) as fp:
+                self._installed = json.load(fp)
+
+    def get_install_millis(self, fingerprint):
+        return self._installed.get(fingerprint)
+
+    def record(self, fingerprint, millis, clear=False):
+        # an install may have changed what an earlier recorded set resolved to
+        if clear:
+            self._installed = {}
+        self._installed[fingerprint] = millis
+        os.makedirs(os.path.dirname(self.marker_file), exist_ok=True)
+        with open(self.marker_file, "w") as fp:
+            json.dump(self._installed, fp)
+
+
+def get_requirements_fingerprint(requirements):
+    return hashlib.sha256("\n".join(sorted(set(requirements))).encode()).hexdigest()
+
+
+def are_requirements_satisfied(requirements, site_paths):
+    # what is actually installed in the venv, not what was installed into it last time
+    installed = {}
+    for distribution in importlib.metadata.distributions(path=list(site_paths)):
+        name = distribution.metadata["Name"]
+        if name:
+            installed.setdefault(canonicalize_name(name), distribution.version)
+    for line in requirements:
+        try:
+            requirement = Requirement(line)
+        except InvalidRequirement:
+            # urls, editables and pip options can not be checked so they are always installed
+            return False
+        if requirement.url:
+            return False
+        if requirement.marker and not requirement.marker.evaluate():
+            continue
+        version = installed.get(canonicalize_name(requirement.name))
+        if version is None or not requirement.specifier.contains(version, prereleases=True):
+            return False
+    return True
+
+
+def read_requirements(requirements_file):
+    requirements = []
+    with open(requirements_file) as fp:
+        for line in fp:
+            requirement = line.split("#", 1)[0].strip()
+            if requirement:
+                requirements.append(requirement)
+    return requirements
@@ -1,17 +1,30 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 from pybuilder.core import Logger
 
+# health checks are most of what a service logs - cloudwatch drops them before they are transferred
+HEALTH_CHECK_FILTER_PATTERN = '-"/health"'
+
 
 class CloudwatchLogs():
 
-    def __init__(self, environment, application, role, logger:Logger) -> None:
+    def __init__(self, environment, application, role, logger:Logger, client=None, output=None) -> None:
         super().__init__()
         self.group_name = f"/{environment}/{application}/{role}"
         self.environment = environment
         self.application = application
         self.role = role
         self.logger = logger
-        self.cwclient = None
+        self.cwclient = client
+        self.output = output
+
+    def _emit(self, line):
+        if self.output:
+            self.output.write(f"{line}\n")
+        else:
+            self.logger.warn(line)
 
     def _get_cloudwatch_logs_client(self):
         if not self.cwclient:
@@ -36,11 +49,50 @@ class CloudwatchLogs():
         #     next_token = events.get('nextForwardToken', None)
         #     to_print.extend(self._process_events(events))
 
-        self.logger.warn(f"Cloudwatch Logs {cloudwatchlogs_group_name}")
+        self._emit(f"Cloudwatch Logs {cloudwatchlogs_group_name}")
         for event in to_print:
             message__format = "{message}".format(**event)
             if '/health' not in message__format:
-                self.logger.warn(f"{cloudwatchlogs_group_name} - {message__format}")
+                self._emit(f"{cloudwatchlogs_group_name} - {message__format}")
+
+    def print_filtered(self, start_time, end_time, filter_pattern=HEALTH_CHECK_FILTER_PATTERN, max_events=1000):
+        try:
+            self.print_filtered_for_group(self.group_name, start_time, end_time, filter_pattern, max_events)
+        except Exception as ex:
+            self.logger.error(f"Error printing cloudwatch logs {str(ex)}")
+
+    def print_filtered_for_group(self, cloudwatchlogs_group_name, start_time, end_time,
+                                 filter_pattern=HEALTH_CHECK_FILTER_PATTERN, max_events=1000):
+        self._emit(f"Cloudwatch Logs {cloudwatchlogs_group_name}")
+        count = 0
+        for event in self.filter_events(cloudwatchlogs_group_name, start_time, end_time, filter_pattern):
+            message__format = "{message}".format(**event)
+            # a custom filter pattern may still let health checks through
+            if '/health' in message__format:
+                continue
+            if count >= max_events:
+                self._emit(f"{cloudwatchlogs_group_name} - stopped after {max_events} events")
+                return
+            count += 1
+            self._emit(f"{cloudwatchlogs_group_name} - {event.get('logStreamName')} - {message__format}")
+
+    def filter_events(self, cloudwatchlogs_group_name, start_time, end_time,
+                      filter_pattern=HEALTH_CHECK_FILTER_PATTERN):
+        # spans every stream of the group, cloudwatch expects milliseconds since the epoch
+        params = {
+            "logGroupName": cloudwatchlogs_group_name,
+            "startTime": int(start_time * 1000),
+            "endTime": int(end_time * 1000)
+        }
+        if filter_pattern:
+            params["filterPattern"] = filter_pattern
+        while True:
+            events = self._get_cloudwatch_logs_client().filter_log_events(**params)
+            yield from events['events']
+            next_token = events.get('nextToken')
+            if not next_token:
+                return
+            params['nextToken'] = next_token
 
     def get_events(self, cloudwatchlogs_group_name, log_stream, nextToken=None):
         params = {
@@ -61,3 +113,48 @@ class CloudwatchLogs():
 
     def _process_events(self, events) -> list:
         return events['events']
+
+
+class CloudwatchLogsCollector():
+
+    def __init__(self, environment, application, logger: Logger, output_directory, max_workers=8) -> None:
+        super().__init__()
+        self.environment = environment
+        self.application = application
+        self.logger = logger
+        self.output_directory = output_directory
+        self.max_workers = max_workers
+        self.cwclient = None
+        self._client_lock = threading.Lock()
+
+    def _get_cloudwatch_logs_client(self):
+        # boto3 clients are thread safe once created, creating them is not
+        with self._client_lock:
+            if not self.cwclient:
+                self.cwclient = boto3.client('logs')
+            return self.cwclient
+
+    def collect(self, requests, filter_pattern=HEALTH_CHECK_FILTER_PATTERN, max_events=1000):
+        # requests are (role, start_time, end_time) - without a start time the latest stream is used
+        if not requests:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(requests)),
+                                thread_name_prefix="cloudwatch") as executor:
+            futures = {role: executor.submit(self._collect_role, role, start_time, end_time, filter_pattern,
+                                             max_events)
+                       for role, start_time, end_time in requests}
+            log_files = {role: future.result() for role, future in futures.items()}
+        for role, log_file in log_files.items():
+            self.logger.warn(f"Cloudwatch logs for {role} written to {log_file}")
+        return log_files
+
+    def _collect_role(self, role, start_time, end_time, filter_pattern, max_events):
+        log_file = f"{self.output_directory}/cloudwatch-{role}.log"
+        with open(log_file, "w") as fp:
+            cloudwatch_logs = CloudwatchLogs(self.environment, self.application, role, self.logger,
+                                             client=self._get_cloudwatch_logs_client(), output=fp)
+            if start_time is None:
+                cloudwatch_logs.print_latest()
+            else:
+                cloudwatch_logs.print_filtered(start_time, end_time, filter_pattern, max_events)
+        return log_file
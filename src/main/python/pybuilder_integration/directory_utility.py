@@ -1,7 +1,16 @@
+import fnmatch
+import hashlib
+import json
 import os
 import shutil
-import tempfile
+import stat
+import zipfile
 
+from pybuilder_integration.properties import PACKAGE_EXCLUDES
+from pybuilder_integration.timing_utility import timed
+
+DEFAULT_PACKAGE_EXCLUDES = ["node_modules", "__pycache__", ".pytest_cache", "*.pyc"]
+PACKAGE_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
 
 
 def prepare_reports_directory(project):
@@ -23,8 +32,8 @@ def prepare_directory(dir_variable, project):
 
 
 def _ensure_directory_exists(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
+    # concurrent suites may race to create the same directory
+    os.makedirs(path, exist_ok=True)
     return path
 
 
@@ -47,6 +56,14 @@ def get_latest_zipped_distribution_directory(project):
     return _ensure_directory_exists(f"{dist_directory}/LATEST-{environment}/zipped")
 
 
+def get_file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def get_local_zip_artifact_path(tool, project, include_ending=False):
     artifact = f"{prepare_dist_directory(project)}/{tool}-{project.name}"
     if include_ending:
@@ -54,17 +71,79 @@ def get_local_zip_artifact_path(tool, project, include_ending=False):
     return artifact
 
 
-def package_artifacts(project, test_dir, tool, role):
+def package_artifacts(project, test_dir, tool, role, extra_files=None):
+    with timed(project, "package", role=role, tool=tool) as timing:
+        zip_file = _package_artifacts(project, test_dir, tool, role, extra_files or {}, timing)
+        timing["bytes"] = os.path.getsize(zip_file)
+    return zip_file
+
+
+def _package_artifacts(project, test_dir, tool, role, extra_files, timing):
+    excludes = project.get_property(PACKAGE_EXCLUDES, DEFAULT_PACKAGE_EXCLUDES)
     # Make a copy for easy access in environment validation
     working_dir = get_working_distribution_directory(project)
-    shutil.copytree(test_dir, f"{working_dir}/{tool}",dirs_exist_ok=True)
-    with tempfile.TemporaryDirectory() as tempdir:
-        shutil.copytree(test_dir, f"{tempdir}/{role}",dirs_exist_ok=True)
-        # package a copy for distribution
-        # zip up the test and add them to the integration test dist directory
-        base_name = get_local_zip_artifact_path(tool=tool, project=project)
-        shutil.make_archive(base_name=base_name,
-                            base_dir=role,
-                            format="zip",
-                            root_dir=tempdir)
-
+    shutil.copytree(test_dir, f"{working_dir}/{tool}", dirs_exist_ok=True, ignore=shutil.ignore_patterns(*excludes))
+    # generated files (e.g. test durations) that are packaged without being written into the test sources
+    for relative_path, source in extra_files.items():
+        shutil.copyfile(source, f"{working_dir}/{tool}/{relative_path}")
+    # package a copy for distribution
+    # zip up the test and add them to the integration test dist directory
+    zip_file = get_local_zip_artifact_path(tool=tool, project=project, include_ending=True)
+    files = _build_package_manifest(test_dir, excludes)
+    for relative_path, source in sorted(extra_files.items()):
+        files.append([relative_path, get_file_checksum(source), stat.S_IMODE(os.stat(source).st_mode)])
+    manifest = {"role": f"{role}", "files": files}
+    manifest_file = f"{prepare_directory('$dir_target', project)}/{tool}-{project.name}.manifest.json"
+    if os.path.exists(zip_file) and os.path.exists(manifest_file):
+        with open(manifest_file) as fp:
+            if json.load(fp) == manifest:
+                timing["reused"] = True
+                return zip_file
+    _write_package(test_dir, zip_file, manifest["role"], manifest["files"], extra_files)
+    with open(manifest_file, "w") as fp:
+        json.dump(manifest, fp)
+    return zip_file
+
+
+def _iterate_package_entries(test_dir, excludes):
+    # sorted walk so that the same tree always produces the same archive
+    for dirpath, dirnames, filenames in os.walk(test_dir):
+        dirnames[:] = sorted(name for name in dirnames if not _is_excluded(name, excludes))
+        yield os.path.relpath(dirpath, test_dir), True
+        for name in sorted(filenames):
+            if not _is_excluded(name, excludes):
+                yield os.path.relpath(os.path.join(dirpath, name), test_dir), False
+
+
+def _is_excluded(name, excludes):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in excludes)
+
+
+def _build_package_manifest(test_dir, excludes):
+    manifest = []
+    for relative_path, is_directory in _iterate_package_entries(test_dir, excludes):
+        path = os.path.join(test_dir, relative_path)
+        checksum = None if is_directory else get_file_checksum(path)
+        manifest.append([relative_path, checksum, stat.S_IMODE(os.stat(path).st_mode)])
+    return manifest
+
+
+def _write_package(test_dir, zip_file, role, files, extra_files=None):
+    temp_file = f"{zip_file}.partial"
+    with zipfile.ZipFile(temp_file, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for relative_path, checksum, mode in files:
+            arcname = role if relative_path == "." else f"{role}/{relative_path.replace(os.sep, '/')}"
+            # fixed timestamps keep the archive byte for byte reproducible
+            if checksum is None:
+                info = zipfile.ZipInfo(f"{arcname}/", date_time=PACKAGE_TIMESTAMP)
+                info.external_attr = ((stat.S_IFDIR | mode) << 16) | 0x10
+                archive.writestr(info, b"")
+            else:
+                info = zipfile.ZipInfo(arcname, date_time=PACKAGE_TIMESTAMP)
+                info.external_attr = (stat.S_IFREG | mode) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                source_path = (extra_files or {}).get(relative_path, os.path.join(test_dir, relative_path))
+                with open(source_path, "rb") as source, \
+                        archive.open(info, "w") as destination:
+                    shutil.copyfileobj(source, destination, 1024 * 1024)
+    os.replace(temp_file, zip_file)
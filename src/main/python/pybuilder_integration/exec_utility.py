@@ -1,8 +1,12 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import Future
+
 from pybuilder.errors import BuildFailedException
-from pybuilder.pluginhelper.external_command import ExternalCommandBuilder, ExternalCommandResult
-from pybuilder.utils import read_file
 
 from pybuilder_integration.directory_utility import prepare_logs_directory, prepare_reports_directory
+from pybuilder_integration.timing_utility import timed
 
 
 def exec_command(command_name,
@@ -15,27 +19,83 @@ def exec_command(command_name,
                  working_dir=None,
                  raise_exception=True,
                  report=True,
-                 env_vars=None):
-    if working_dir:
-        command = WorkingDirCommandBuilder(command_name=command_name,
-                                           project=project,
-                                           reactor=reactor,
-                                           env=env_vars,
-                                           cwd=working_dir)
-    else:
-        command = ExternalCommandBuilder(command_name=command_name,
-                                         project=project,
-                                         reactor=reactor)
-
-    for arg in args:
-        command.use_argument(arg)
+                 env_vars=None,
+                 timeout=None,
+                 stream=False):
+    if timeout or stream:
+        # only a process of our own can be stopped or read while it runs
+        return submit_command(command_name, args, failure_message, log_file_name, project, reactor, logger,
+                              working_dir=working_dir, raise_exception=raise_exception, report=report,
+                              env_vars=env_vars, timeout=timeout, stream=stream).result()
     if report:
         directory = prepare_reports_directory(project)
     else:
         directory = prepare_logs_directory(project)
     outfile_name = f"{directory}/{log_file_name}"
-    res = command.run(outfile_name)
-    if res.exit_code != 0:
+    python_env = reactor.python_env_registry["pybuilder"]
+    kwargs = {"env": env_vars if env_vars else {}, "cwd": working_dir} if working_dir else {}
+    with timed(project, "command", command=command_name, log_file=log_file_name) as timing:
+        # callers only need the exit code - the output stays in the log files rather than being read back
+        exit_code = python_env.execute_command([command_name] + list(args), outfile_name, **kwargs)
+        timing["exit_code"] = exit_code
+        if exit_code != 0:
+            timing["status"] = "failed"
+    return _check_exit_code(exit_code, failure_message, logger, raise_exception)
+
+
+def submit_command(command_name,
+                   args,
+                   failure_message,
+                   log_file_name,
+                   project,
+                   reactor,
+                   logger,
+                   working_dir=None,
+                   raise_exception=True,
+                   report=True,
+                   env_vars=None,
+                   timeout=None,
+                   stream=False):
+    # starts right away and resolves to what exec_command would have returned
+    future = CommandFuture()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(_run_command(future, command_name, args, failure_message, log_file_name, project,
+                                           reactor, logger, working_dir, raise_exception, report, env_vars,
+                                           timeout, stream))
+        except BaseException as ex:
+            future.set_exception(ex)
+
+    threading.Thread(target=run, name=f"command-{os.path.basename(command_name)}", daemon=True).start()
+    return future
+
+
+def _run_command(future, command_name, args, failure_message, log_file_name, project, reactor, logger, working_dir,
+                 raise_exception, report, env_vars, timeout, stream):
+    with timed(project, "command", command=command_name, log_file=log_file_name) as timing:
+        command = start_command([command_name] + list(args), log_file_name, project, reactor,
+                                working_dir=working_dir, report=report, env_vars=env_vars,
+                                stream_to=logger if stream else None)
+        future.started(command)
+        try:
+            exit_code = command.wait(timeout)
+        except subprocess.TimeoutExpired:
+            timing["timed_out"] = True
+            logger.warn(f"{command_name} did not finish within {timeout}s - stopping it")
+            exit_code = stop_command(command)
+            failure_message = f"{failure_message} - timed out after {timeout}s"
+        timing["exit_code"] = exit_code
+        if exit_code != 0:
+            timing["status"] = "failed"
+    if exit_code != 0 and future.terminated:
+        failure_message = f"{failure_message} - terminated"
+    return _check_exit_code(exit_code, failure_message, logger, raise_exception)
+
+
+def _check_exit_code(exit_code, failure_message, logger, raise_exception):
+    if exit_code != 0:
         if raise_exception:
             raise BuildFailedException(failure_message)
         else:
@@ -44,19 +104,124 @@ def exec_command(command_name,
     return True
 
 
-class WorkingDirCommandBuilder(ExternalCommandBuilder):
+def wait_for_command(command, timeout=None, logger=None):
+    # the exit code of a command that ran too long is the one of its termination
+    try:
+        return command.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        if logger:
+            logger.warn(f"{command.outfile_name} did not finish within {timeout}s - stopping it")
+        return stop_command(command)
+
+
+def stop_command(command, grace_period=10):
+    command.terminate()
+    try:
+        return command.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        command.kill()
+        return command.wait()
+
+
+class CommandFuture(Future):
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._command = None
+        self.terminated = False
+
+    def started(self, command):
+        with self._lock:
+            self._command = command
+            terminated = self.terminated
+        # terminated before the process existed
+        if terminated:
+            command.terminate()
+
+    def terminate(self):
+        # the process is already running so cancel() can not stop it - the result reports the failure
+        with self._lock:
+            self.terminated = True
+            command = self._command
+        if command:
+            command.terminate()
+
+
+def start_command(command_and_arguments,
+                  log_file_name,
+                  project,
+                  reactor,
+                  working_dir=None,
+                  report=False,
+                  env_vars=None,
+                  stream_to=None):
+    if report:
+        directory = prepare_reports_directory(project)
+    else:
+        directory = prepare_logs_directory(project)
+    env = dict(reactor.pybuilder_venv.environ)
+    if env_vars:
+        env.update(env_vars)
+    return RunningCommand(command_and_arguments, f"{directory}/{log_file_name}", env=env, cwd=working_dir,
+                          stream_to=stream_to)
+
+
+class RunningCommand:
+
+    def __init__(self, command_and_arguments, outfile_name, env, cwd=None, stream_to=None):
+        self.command_and_arguments = command_and_arguments
+        self.outfile_name = outfile_name
+        self.error_file_name = "{0}.err".format(outfile_name)
+        self._outfile = open(self.outfile_name, "w")
+        self._error_file = open(self.error_file_name, "w")
+        self._reader = None
+        self.terminated = False
+        try:
+            # output is written by the child as it is produced rather than collected in memory
+            self.process = subprocess.Popen(command_and_arguments,
+                                            cwd=cwd,
+                                            env=env,
+                                            stdin=subprocess.DEVNULL,
+                                            stdout=subprocess.PIPE if stream_to else self._outfile,
+                                            stderr=self._error_file)
+        except Exception:
+            self._close()
+            raise
+        if stream_to:
+            self._reader = threading.Thread(target=self._stream, args=(stream_to,), daemon=True,
+                                            name=f"stream-{os.path.basename(outfile_name)}")
+            self._reader.start()
+
+    def _stream(self, logger):
+        # a line at a time into the log file and the build output
+        prefix = os.path.basename(self.outfile_name)
+        for line in iter(self.process.stdout.readline, b""):
+            text = line.decode(errors="replace")
+            self._outfile.write(text)
+            self._outfile.flush()
+            logger.info(f"[{prefix}] {text.rstrip()}")
+
+    def wait(self, timeout=None):
+        exit_code = self.process.wait(timeout)
+        if self._reader:
+            self._reader.join()
+            self.process.stdout.close()
+        self._close()
+        return exit_code
 
-    def __init__(self, command_name, project, cwd, reactor, env=None):
-        super(WorkingDirCommandBuilder, self).__init__(command_name, project, reactor)
-        self.env = env if env else {}
-        self.cwd = cwd
+    def terminate(self):
+        # only a command that was still running when asked counts as terminated
+        if self.process.poll() is None:
+            self.terminated = True
+            self.process.terminate()
+            return True
+        return False
 
-    def run(self, outfile_name):
-        error_file_name = "{0}.err".format(outfile_name)
-        return_code = self._env.execute_command(self.parts, outfile_name, env=self.env, cwd=self.cwd)
-        error_file_lines = read_file(error_file_name)
-        outfile_lines = read_file(outfile_name)
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
 
-        return ExternalCommandResult(return_code,
-                                     outfile_name, outfile_lines,
-                                     error_file_name, error_file_lines)
+    def _close(self):
+        self._outfile.close()
+        self._error_file.close()
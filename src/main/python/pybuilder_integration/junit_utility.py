@@ -0,0 +1,62 @@
+import os
+import re
+from xml.etree import ElementTree
+
+
+def get_failed_tests(report_file):
+    # classname of every testcase with a failure or error, None when there is no usable report
+    if not os.path.exists(report_file):
+        return None
+    try:
+        tree = ElementTree.parse(report_file)
+    except ElementTree.ParseError:
+        return None
+    failed = []
+    for testcase in tree.iter("testcase"):
+        if testcase.find("failure") is not None or testcase.find("error") is not None:
+            failed.append(testcase.get("classname") or testcase.get("name", ""))
+    return failed
+
+
+def get_test_address(relative_path):
+    # mirrors how pytest's junitxml turns a test file into a classname
+    return re.sub(r"\.py$", "", relative_path.replace(os.sep, "/").replace("/", "."))
+
+
+def map_failed_tests_to_roles(failed_tests, sources):
+    addresses = {get_test_address(path): role for path, role in sources.items()}
+    roles = []
+    for failed_test in failed_tests:
+        role = None
+        for address, source_role in addresses.items():
+            if failed_test == address or failed_test.endswith(f".{address}") or \
+                    failed_test.startswith(f"{address}."):
+                role = source_role
+                break
+        if role is None:
+            return None
+        if role not in roles:
+            roles.append(role)
+    return roles
+
+
+def merge_reports(report_files, output_file):
+    # one testsuites document with every suite of every report, e.g. the reports of all shards of a run
+    merged = ElementTree.Element("testsuites")
+    totals = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+    duration = 0.0
+    for report_file in report_files:
+        try:
+            root = ElementTree.parse(report_file).getroot()
+        except ElementTree.ParseError:
+            continue
+        for testsuite in [root] if root.tag == "testsuite" else root.iter("testsuite"):
+            for attribute in totals:
+                totals[attribute] += int(testsuite.get(attribute, 0))
+            duration += float(testsuite.get("time", 0))
+            merged.append(testsuite)
+    for attribute, value in totals.items():
+        merged.set(attribute, str(value))
+    merged.set("time", f"{duration:.3f}")
+    ElementTree.ElementTree(merged).write(output_file, encoding="utf-8", xml_declaration=True)
+    return totals
@@ -18,3 +18,27 @@ APPLICATION_GROUP = "application_group"
 RUN_PARALLEL = "pytest_parallel"
 CONSOLIDATE_TESTS = "consolidate_tavern"
 TESTING_SCOPE = "testing_scope"
+MAX_CONCURRENCY = "integration_max_concurrency"
+TAVERN_RUNNER = "tavern_runner"
+S3_ENDPOINT_URL = "integration_s3_endpoint_url"
+S3_MAX_CONCURRENCY = "integration_s3_max_concurrency"
+DOWNLOAD_WORKERS = "integration_download_workers"
+ARTIFACT_CACHE_DIR = "integration_artifact_cache_dir"
+ARTIFACT_CACHE_MAX_MB = "integration_artifact_cache_max_mb"
+ARTIFACT_LOCAL_DIR = "integration_artifact_local_dir"
+PACKAGE_EXCLUDES = "integration_package_excludes"
+NPM_CACHE_DIR = "integration_npm_cache_dir"
+CYPRESS_VERSION = "cypress_version"
+CLOUDWATCH_LOG_MODE = "cloudwatch_log_mode"
+CLOUDWATCH_FILTER_PATTERN = "cloudwatch_filter_pattern"
+CLOUDWATCH_MAX_EVENTS = "cloudwatch_max_events"
+CLOUDWATCH_WINDOW_PADDING = "cloudwatch_window_padding_seconds"
+SHARD_INDEX = "integration_shard_index"
+SHARD_COUNT = "integration_shard_count"
+SHARD_REPORTS_DIR = "integration_shard_reports_dir"
+FAILURE_POLICY = "integration_failure_policy"
+PREFETCH_LATEST = "integration_prefetch_latest"
+INCREMENTAL_TESTS = "integration_incremental_tests"
+FORCE_FULL_RUN = "integration_force_full_run"
+INTEGRATION_TARGET_VERSION = "integration_target_version"
+SUITE_TIMEOUT = "integration_suite_timeout"
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import threading
+import weakref
+
+from pybuilder_integration.properties import *
+
+_selections = weakref.WeakKeyDictionary()
+_selections_lock = threading.Lock()
+
+
+def get_suite_fingerprint(test_dir):
+    # the content of the suite as unzipped from LATEST - file names and bytes, not timestamps
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(test_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            digest.update(os.path.relpath(path, test_dir).replace(os.sep, "/").encode())
+            digest.update(b"\0")
+            with open(path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_target(project):
+    return {
+        "url": project.get_property(INTEGRATION_TARGET_URL),
+        "public_url": project.get_property(INTEGRATION_PUBLIC_TARGET_URL),
+        "version": str(project.get_property(INTEGRATION_TARGET_VERSION, project.version))
+    }
+
+
+class SuiteSelection:
+
+    def __init__(self, previous_state, target, force=False):
+        previous_state = previous_state or {}
+        # a different deployment under test invalidates every recorded suite
+        self.previous = previous_state.get("suites", {}) if previous_state.get("target") == target else {}
+        self.target = target
+        self.force = force
+        self.fingerprints = {}
+        self._lock = threading.Lock()
+
+    def is_unchanged(self, tool, role, test_dir):
+        key = f"{tool}/{role}"
+        fingerprint = get_suite_fingerprint(test_dir)
+        with self._lock:
+            self.fingerprints[key] = fingerprint
+        return not self.force and self.previous.get(key) == fingerprint
+
+    def to_state(self):
+        with self._lock:
+            return {"target": self.target, "suites": dict(sorted(self.fingerprints.items()))}
+
+
+def set_suite_selection(project, selection):
+    with _selections_lock:
+        _selections[project] = selection
+
+
+def get_suite_selection(project):
+    with _selections_lock:
+        return _selections.get(project)
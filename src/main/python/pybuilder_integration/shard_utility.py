@@ -0,0 +1,73 @@
+import json
+import os
+
+from pybuilder_integration_pytest import PLUGIN_NAME, balance_tests, get_weights, quantize_duration, read_durations
+
+DURATIONS_FILE_PREFIX = ".integration-durations-"
+SHARD_SUMMARY_PREFIX = "integration-shard-"
+
+
+def get_durations_file_name(role):
+    return f"{DURATIONS_FILE_PREFIX}{role}.json"
+
+
+def find_durations_files(test_dir):
+    if not os.path.isdir(test_dir):
+        return []
+    return [os.path.join(test_dir, name) for name in sorted(os.listdir(test_dir))
+            if name.startswith(DURATIONS_FILE_PREFIX) and name.endswith(".json")]
+
+
+def get_suite_duration(test_dir):
+    durations = read_durations(find_durations_files(test_dir))
+    return sum(durations.values()) if durations else None
+
+
+def partition_suites(suite_directories, shard_count):
+    # deterministic for every runner that downloaded the same LATEST artifacts
+    weights = get_weights({name: get_suite_duration(directory) for name, directory in suite_directories})
+    return balance_tests(weights, shard_count)
+
+
+def get_shard_summary_file_name(shard_index):
+    return f"{SHARD_SUMMARY_PREFIX}{shard_index}.json"
+
+
+def read_shard_summaries(directory):
+    # the reports of every runner, e.g. collected into one directory by the CI pipeline
+    summaries = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.startswith(SHARD_SUMMARY_PREFIX) and name.endswith(".json"):
+                with open(os.path.join(dirpath, name)) as fp:
+                    summaries.append(json.load(fp))
+    return summaries
+
+
+def validate_shard_summaries(summaries, shard_count=None):
+    if not summaries:
+        return ["no shard results found"]
+    shard_count = int(shard_count or summaries[0]["count"])
+    problems = []
+    by_index = {}
+    for summary in summaries:
+        if summary["count"] != shard_count:
+            problems.append(f"shard {summary['index']} ran as one of {summary['count']} shards, expected {shard_count}")
+        by_index.setdefault(summary["index"], summary)
+    missing = sorted(set(range(shard_count)) - set(by_index))
+    if missing:
+        problems.append(f"missing results of shards: {', '.join(str(index) for index in missing)}")
+    failed = sorted(index for index, summary in by_index.items() if not summary["passed"])
+    if failed:
+        problems.append(f"failed shards: {', '.join(str(index) for index in failed)}")
+    for tool in sorted(set(tool for summary in by_index.values() for tool in summary["suites"])):
+        suites = [summary["suites"][tool] for summary in by_index.values() if tool in summary["suites"]]
+        if any(suite["tests_sharded"] for suite in suites):
+            continue
+        # runners that downloaded different LATEST artifacts may have skipped or repeated a role
+        all_roles = set(tuple(suite["all_roles"]) for suite in suites)
+        covered = sorted(role for suite in suites for role in suite["roles"])
+        if len(all_roles) > 1 or covered != sorted(all_roles.pop()):
+            problems.append(f"{tool} roles were not run exactly once across the shards")
+    return problems
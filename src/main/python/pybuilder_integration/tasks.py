@@ -1,21 +1,39 @@
+import json
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 from pybuilder.core import Project, Logger, RequirementsFile
 from pybuilder.errors import BuildFailedException
 from pybuilder.install_utils import install_dependencies
 from pybuilder.reactor import Reactor
-from pybuilder.utils import Timer
 
-from pybuilder_integration import exec_utility, tool_utility, directory_utility
-from pybuilder_integration.artifact_manager import get_artifact_manager
-from pybuilder_integration.cloudwatchlogs_utility import CloudwatchLogs
+import pybuilder_integration_pytest
+from pybuilder_integration import exec_utility, tool_utility, directory_utility, shard_utility
+from pybuilder_integration.artifact_manager import get_artifact_manager, get_project_metadata, \
+    CONSOLIDATED_SOURCES_FILE
+from pybuilder_integration.cache_utility import RequirementsCache, get_requirements_fingerprint, read_requirements, \
+    are_requirements_satisfied
+from pybuilder_integration.cloudwatchlogs_utility import CloudwatchLogsCollector, HEALTH_CHECK_FILTER_PATTERN
 from pybuilder_integration.directory_utility import get_working_distribution_directory, \
-    package_artifacts, prepare_reports_directory, get_local_zip_artifact_path, prepare_logs_directory
+    package_artifacts, prepare_reports_directory, get_local_zip_artifact_path, prepare_logs_directory, \
+    prepare_directory
+from pybuilder_integration.junit_utility import get_failed_tests, map_failed_tests_to_roles, merge_reports
 from pybuilder_integration.properties import *
+from pybuilder_integration.selection_utility import SuiteSelection, get_target, get_suite_selection, \
+    set_suite_selection
+from pybuilder_integration.timing_utility import timed, write_timing_report
 from pybuilder_integration.tool_utility import install_cypress
 
+MERGED_REPORT_FILE = "integration-merged.out.xml"
+
+_install_lock = threading.Lock()
+_cypress_output_lock = threading.Lock()
+_requirements_caches = {}
+
 
 def integration_artifact_push(project: Project, logger: Logger, reactor: Reactor):
     logger.info("Starting upload of integration artifacts")
@@ -30,14 +48,133 @@ def integration_artifact_push(project: Project, logger: Logger, reactor: Reactor
 
 
 def verify_environment(project: Project, logger: Logger, reactor: Reactor):
-    dist_directory = project.get_property(WORKING_TEST_DIR, get_working_distribution_directory(project))
-    logger.info(f"Preparing to run tests found in: {dist_directory}")
-    _run_tests_in_directory(dist_directory, logger, project, reactor)
+    shard_index, shard_count = _get_shard(project)
+    latest_directory = None
+    passed = False
+    try:
+        dist_directory = project.get_property(WORKING_TEST_DIR, get_working_distribution_directory(project))
+        # LATEST is only I/O until its tests start so it is prepared while the current build is tested
+        prefetch = None
+        if project.get_property(PREFETCH_LATEST, True):
+            prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="latest-prefetch")
+            # pip must not change the venv the current build's tests are imported from
+            install = project.get_property(TAVERN_RUNNER, "in_process") == "subprocess"
+            prefetch = prefetch_executor.submit(_prepare_latest_artifacts, project, logger, reactor, install)
+            # a failure of the current build's tests is reported without waiting for LATEST
+            prefetch_executor.shutdown(wait=False)
+        try:
+            logger.info(f"Preparing to run tests found in: {dist_directory}")
+            _run_tests_in_directory(dist_directory, logger, project, reactor)
+        except BaseException:
+            if prefetch:
+                prefetch.cancel()
+            raise
+        with timed(project, "latest_wait", prefetched=prefetch is not None):
+            latest_directory = prefetch.result() if prefetch \
+                else _prepare_latest_artifacts(project, logger, reactor)
+        selection = _load_suite_selection(project, logger, reactor)
+        set_suite_selection(project, selection)
+        _run_tests_in_directory(latest_directory, logger, project, reactor, latest=True)
+        passed = True
+        if selection:
+            get_artifact_manager(project=project).write_suite_state(selection.to_state(), project, logger, reactor)
+        if not project.get_property(PROMOTE_ARTIFACT, True):
+            return
+        if shard_count > 1:
+            logger.info(f"Shard {shard_index} of {shard_count} passed - promotion is left to merge_integration_shards")
+            return
+        with timed(project, "promote"):
+            integration_artifact_push(project=project, logger=logger, reactor=reactor)
+    finally:
+        set_suite_selection(project, None)
+        if shard_count > 1:
+            _write_shard_summary(project, logger, latest_directory, passed)
+        _write_timing_report(project, logger)
+
+
+def _prepare_latest_artifacts(project, logger, reactor, install=True):
     artifact_manager = get_artifact_manager(project=project)
     latest_directory = artifact_manager.download_artifacts(project=project, logger=logger, reactor=reactor)
-    _run_tests_in_directory(latest_directory, logger, project, reactor, latest=True)
+    tavern_test_path = f"{latest_directory}/tavern"
+    if install and os.path.exists(tavern_test_path):
+        # recorded in the requirements cache so the LATEST run does not install them again
+        _install_latest_tavern_requirements(tavern_test_path, logger, project, reactor)
+    return latest_directory
+
+
+def _load_suite_selection(project, logger, reactor):
+    if not project.get_property(INCREMENTAL_TESTS, False):
+        return None
+    force = project.get_property(FORCE_FULL_RUN, False)
+    # a forced run still records its fingerprints for the next incremental one
+    state = None if force else get_artifact_manager(project=project).read_suite_state(project, logger, reactor)
+    return SuiteSelection(state, get_target(project), force=force)
+
+
+def merge_integration_shards(project: Project, logger: Logger, reactor: Reactor):
+    reports_directory = project.get_property(SHARD_REPORTS_DIR)
+    reports_directory = project.expand_path(reports_directory) if reports_directory \
+        else prepare_reports_directory(project)
+    summaries = shard_utility.read_shard_summaries(reports_directory)
+    merged_file = f"{prepare_reports_directory(project)}/{MERGED_REPORT_FILE}"
+    report_files = [os.path.join(dirpath, name)
+                    for dirpath, dirnames, filenames in sorted(os.walk(reports_directory))
+                    for name in sorted(filenames)
+                    if name.endswith(".out.xml") and name != MERGED_REPORT_FILE]
+    totals = merge_reports(report_files, merged_file)
+    logger.info(f"Merged {len(report_files)} junit reports of {len(summaries)} shards into {merged_file}: "
+                f"{totals['tests']} tests, {totals['failures']} failures, {totals['errors']} errors")
+    problems = shard_utility.validate_shard_summaries(summaries, project.get_property(SHARD_COUNT))
+    if problems:
+        raise BuildFailedException(f"Not promoting integration artifacts - {'; '.join(problems)}")
     if project.get_property(PROMOTE_ARTIFACT, True):
-        integration_artifact_push(project=project, logger=logger, reactor=reactor)
+        with timed(project, "promote"):
+            integration_artifact_push(project=project, logger=logger, reactor=reactor)
+
+
+def _get_shard(project):
+    shard_count = max(1, int(project.get_property(SHARD_COUNT, 1)))
+    shard_index = int(project.get_property(SHARD_INDEX, 0))
+    if not 0 <= shard_index < shard_count:
+        raise BuildFailedException(f"{SHARD_INDEX} must be between 0 and {shard_count - 1} - got {shard_index}")
+    return shard_index, shard_count
+
+
+def _is_test_sharded(tool, project):
+    # a consolidated run is a single suite so its tests rather than its roles are split
+    return tool == "tavern" and project.get_property(CONSOLIDATE_TESTS, False)
+
+
+def _get_shard_role_directories(tool, test_path, project):
+    role_directories = _get_latest_role_directories(test_path, project)
+    shard_index, shard_count = _get_shard(project)
+    if shard_count == 1 or _is_test_sharded(tool, project):
+        return role_directories
+    shards = shard_utility.partition_suites(role_directories, shard_count)
+    return [(role, directory) for role, directory in role_directories if shards[role] == shard_index]
+
+
+def _write_shard_summary(project, logger, latest_directory, passed):
+    shard_index, shard_count = _get_shard(project)
+    suites = {}
+    for tool in ["tavern", "cypress"]:
+        test_path = f"{latest_directory}/{tool}"
+        if not latest_directory or not os.path.exists(test_path):
+            continue
+        suites[tool] = {
+            "roles": [role for role, directory in _get_shard_role_directories(tool, test_path, project)],
+            "all_roles": [role for role, directory in _get_latest_role_directories(test_path, project)],
+            "tests_sharded": _is_test_sharded(tool, project)
+        }
+    summary_file = f"{prepare_reports_directory(project)}/{shard_utility.get_shard_summary_file_name(shard_index)}"
+    with open(summary_file, "w") as fp:
+        json.dump({"index": shard_index, "count": shard_count, "passed": passed, "suites": suites}, fp, indent=2)
+    logger.info(f"Wrote results of shard {shard_index} of {shard_count}: {summary_file}")
+
+
+def _write_timing_report(project, logger):
+    report_file = write_timing_report(project, prepare_reports_directory(project))
+    logger.info(f"Wrote integration timing report: {report_file}")
 
 
 def _should_run_latest(test_dir, project):
@@ -54,65 +191,250 @@ def _run_tests_in_directory(dist_directory, logger, project, reactor, latest=Fal
 
 
 def _run_cypress_tests_in_dist_dir(dist_directory, latest, logger, project, reactor):
-    total_time = Timer.start()
     cypress_test_path = f"{dist_directory}/cypress"
-    if os.path.exists(cypress_test_path):
+    if not os.path.exists(cypress_test_path):
+        return
+    with timed(project, "cypress_tests", latest=latest) as timing:
         logger.debug(f"Run cypress tests in directory: {cypress_test_path} ")
         logger.debug(f"Run cypress tests in directory files: {os.listdir(cypress_test_path)} ")
         logger.info(f"Found cypress tests - starting run latest: {latest}")
         if latest:
-            for test_dir in os.listdir(cypress_test_path):
-                directory_to_test = f"{cypress_test_path}/{test_dir}"
-                if os.path.isdir(directory_to_test) and _should_run_latest(test_dir, project):
-                    logger.info(f"Running {directory_to_test}")
-                    _run_cypress_tests_in_directory(work_dir=directory_to_test,
-                                                    logger=logger,
-                                                    project=project,
-                                                    reactor=reactor)
+            def run_role_suite(role, directory, isolated, cancellation):
+                return _run_cypress_role_suite(work_dir=directory, role=role, logger=logger, project=project,
+                                               reactor=reactor, cancellation=cancellation)
+
+            results = _run_latest_role_suites("cypress", cypress_test_path, logger, project, run_role_suite)
+            _report_role_suite_results("cypress", results, logger, project)
+        elif _get_shard(project)[0] != 0:
+            logger.info("Skipping cypress tests of this build - they run on shard 0")
         else:
             _run_cypress_tests_in_directory(work_dir=cypress_test_path,
                                             logger=logger,
                                             project=project,
                                             reactor=reactor)
-    total_time.stop()
-    logger.info(f"Ran Cypress tests: {total_time.get_millis()}")
+    logger.info(f"Ran Cypress tests: {timing['duration_ms']}")
 
 
 def _run_tavern_tests_in_dist_dir(dist_directory, latest, logger, project, reactor):
-    total_time = Timer.start()
     tavern_test_path = f"{dist_directory}/tavern"
-    if os.path.exists(tavern_test_path):
+    if not os.path.exists(tavern_test_path):
+        return
+    with timed(project, "tavern_tests", latest=latest) as timing:
         logger.info(f"Found tavern tests - starting run latest: {latest}")
         logger.debug(f"Run tavern tests in directory: {tavern_test_path} ")
         logger.debug(f"Run tavern tests in directory files: {os.listdir(tavern_test_path)} ")
         if latest:
-            for tavern_dir in os.listdir(tavern_test_path):
-                tavern_test_direcotry = f"{tavern_test_path}/{tavern_dir}"
-                if os.path.isdir(tavern_test_direcotry) and _should_run_latest(tavern_dir, project):
-                    logger.info(f"Running {tavern_test_direcotry}")
-                    _run_tavern_tests_in_dir(test_dir=tavern_test_direcotry,
-                                             logger=logger,
-                                             project=project,
-                                             reactor=reactor,
-                                             role=os.path.basename(tavern_dir))
+            def run_role_suite(role, directory, isolated, cancellation):
+                return _execute_tavern_tests(test_dir=directory, logger=logger, project=project, reactor=reactor,
+                                             role=role, isolated=isolated,
+                                             shard_tests=_is_test_sharded("tavern", project),
+                                             cancellation=cancellation)
+
+            _install_latest_tavern_requirements(tavern_test_path, logger, project, reactor)
+            results = _run_latest_role_suites("tavern", tavern_test_path, logger, project, run_role_suite)
+            _report_role_suite_results("tavern", results, logger, project)
         else:
             _run_tavern_tests_in_dir(test_dir=f"{tavern_test_path}",
                                      logger=logger,
                                      project=project,
-                                     reactor=reactor)
-    total_time.stop()
-    logger.info(f"Ran Tavern tests: {total_time.get_millis()}")
+                                     reactor=reactor,
+                                     shard_tests=True)
+    logger.info(f"Ran Tavern tests: {timing['duration_ms']}")
+
+
+class RoleSuiteResult:
+    def __init__(self, tool, role, test_dir, report_file, passed, exit_code=None, log_file=None, started=None,
+                 finished=None, cancelled=False, skipped=False, unchanged=False):
+        self.tool = tool
+        self.role = role
+        self.test_dir = test_dir
+        self.report_file = report_file
+        self.passed = passed
+        self.exit_code = exit_code
+        self.log_file = log_file
+        self.started = started
+        self.finished = finished
+        # stopped or never started because another suite failed first
+        self.cancelled = cancelled
+        self.skipped = skipped
+        # passed on the same inputs in an earlier run
+        self.unchanged = unchanged
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    @property
+    def failed(self):
+        return not self.passed and not self.cancelled and not self.skipped
+
+    @property
+    def status(self):
+        if self.skipped:
+            return "SKIPPED"
+        if self.cancelled:
+            return "CANCELLED"
+        if self.unchanged:
+            return "unchanged"
+        return "passed" if self.passed else "FAILED"
+
+
+class SuiteCancelledException(BuildFailedException):
+    pass
+
+
+class SuiteCancellation:
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._commands = set()
+        self._terminated = set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            commands = list(self._commands)
+        for command in commands:
+            self._terminate(command)
+
+    def register(self, command):
+        with self._lock:
+            self._commands.add(command)
+        # a suite that started while cancelling is stopped straight away
+        if self.cancelled:
+            self._terminate(command)
+
+    def unregister(self, command):
+        with self._lock:
+            self._commands.discard(command)
+
+    def was_terminated(self, command):
+        with self._lock:
+            return command in self._terminated
+
+    def _terminate(self, command):
+        # a suite that finished on its own before the cancel is reported as it ended
+        if command.terminate():
+            with self._lock:
+                self._terminated.add(command)
+
+
+def _wait_for_suite_command(command, project, logger, cancellation=None):
+    # the exit code of the suite and whether it was stopped by cancelling the suites
+    timeout = project.get_property(SUITE_TIMEOUT)
+    timeout = float(timeout) if timeout else None
+    if not cancellation:
+        return exec_utility.wait_for_command(command, timeout, logger), False
+    cancellation.register(command)
+    try:
+        return exec_utility.wait_for_command(command, timeout, logger), cancellation.was_terminated(command)
+    finally:
+        cancellation.unregister(command)
+
+
+def _is_fail_fast(project):
+    policy = project.get_property(FAILURE_POLICY, "run_all")
+    if policy not in ("run_all", "fail_fast"):
+        raise BuildFailedException(f"{FAILURE_POLICY} must be run_all or fail_fast - got {policy}")
+    return policy == "fail_fast"
+
+
+def _get_max_concurrency(project):
+    return max(1, int(project.get_property(MAX_CONCURRENCY, 1)))
+
+
+def _get_latest_role_directories(test_path, project):
+    role_directories = []
+    for role in sorted(os.listdir(test_path)):
+        directory_to_test = f"{test_path}/{role}"
+        if os.path.isdir(directory_to_test) and _should_run_latest(role, project):
+            role_directories.append((role, directory_to_test))
+    return role_directories
+
+
+def _run_latest_role_suites(tool, test_path, logger, project, run_role_suite):
+    role_directories = _get_shard_role_directories(tool, test_path, project)
+    max_concurrency = min(_get_max_concurrency(project), max(1, len(role_directories)))
+    logger.info(f"Running {len(role_directories)} {tool} role suites with max concurrency: {max_concurrency}")
+    fail_fast = _is_fail_fast(project)
+    cancellation = SuiteCancellation()
+    selection = get_suite_selection(project)
+
+    def run(role, directory, isolated):
+        if cancellation.cancelled:
+            return RoleSuiteResult(tool, role, directory, None, False, skipped=True)
+        if selection and selection.is_unchanged(tool, role, directory):
+            logger.info(f"{tool} suite {role} and its target are unchanged since the last passing run - skipping")
+            return RoleSuiteResult(tool, role, directory, None, True, unchanged=True)
+        # without fail fast nothing is ever cancelled so suites need not run stoppable
+        result = run_role_suite(role, directory, isolated, cancellation if fail_fast else None)
+        if fail_fast and result.failed and not cancellation.cancelled:
+            logger.warn(f"{tool} suite {result.role} failed - cancelling the remaining {tool} suites")
+            cancellation.cancel()
+        return result
+
+    if max_concurrency == 1:
+        # keep the historical behavior of running in the build process
+        return [run(role, directory, False) for role, directory in role_directories]
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"{tool}-suite") as executor:
+        futures = [executor.submit(run, role, directory, True) for role, directory in role_directories]
+        return [future.result() for future in futures]
+
+
+def _report_role_suite_results(tool, results, logger, project):
+    failed = [result for result in results if result.failed]
+    for result in results:
+        logger.info(f"{tool} suite {result.role}: {result.status}"
+                    + (f" - {result.report_file}" if result.report_file else "")
+                    + (f" (output: {result.log_file})" if result.log_file else ""))
+    if not failed:
+        return
+    if tool == "tavern":
+        # only the roles whose own tests failed - not the ones stopped on their behalf
+        _collect_cloudwatch_logs(failed, logger, project)
+    message = f"{tool} tests failed for roles: {', '.join(result.role for result in failed)}"
+    for status in ["CANCELLED", "SKIPPED"]:
+        roles = [result.role for result in results if result.status == status]
+        if roles:
+            message += f" - {status.lower()}: {', '.join(roles)}"
+    raise BuildFailedException(message)
 
 
 def verify_cypress(project: Project, logger: Logger, reactor: Reactor):
     # Get directories with test and cypress executable
     work_dir = project.expand_path(f"${CYPRESS_TEST_DIR}")
-    if _run_cypress_tests_in_directory(work_dir=work_dir, logger=logger, project=project, reactor=reactor):
-        package_artifacts(project, work_dir, "cypress", project.get_property(ROLE))
+    try:
+        if _run_cypress_tests_in_directory(work_dir=work_dir, logger=logger, project=project, reactor=reactor):
+            package_artifacts(project, work_dir, "cypress", project.get_property(ROLE))
+    finally:
+        _write_timing_report(project, logger)
 
 
-def _run_cypress_tests_in_directory(work_dir, logger, project, reactor: Reactor):
-    total_time = Timer.start()
+def _run_cypress_role_suite(work_dir, role, logger, project, reactor: Reactor, cancellation=None):
+    results_file, run_name = get_test_report_file(project=project, test_dir=work_dir, tool="cypress")
+    cancelled = False
+    try:
+        _run_cypress_tests_in_directory(work_dir=work_dir, logger=logger, project=project, reactor=reactor, role=role,
+                                        cancellation=cancellation)
+        passed = True
+    except SuiteCancelledException:
+        logger.warn(f"Cypress tests of role {role} were cancelled")
+        passed = False
+        cancelled = True
+    except BuildFailedException as ex:
+        logger.error(f"Cypress tests failed for role {role}: {ex}")
+        passed = False
+    return RoleSuiteResult("cypress", role, work_dir, results_file, passed, cancelled=cancelled)
+
+
+def _run_cypress_tests_in_directory(work_dir, logger, project, reactor: Reactor, role=None, cancellation=None):
     target_url = project.get_mandatory_property(INTEGRATION_TARGET_URL)
     environment = project.get_mandatory_property(ENVIRONMENT)
     if not os.path.exists(work_dir):
@@ -121,15 +443,15 @@ def _run_cypress_tests_in_directory(work_dir, logger, project, reactor: Reactor)
     logger.info(f"Found {len(os.listdir(work_dir))} files in cypress test directory")
     logger.debug(f"Files: {os.listdir(work_dir)} ")
     # Validate NPM install and Install cypress
-    package_json = os.path.join(work_dir, "package.json")
-    if os.path.exists(package_json):
-        logger.info("Found package.json installing dependencies")
-        tool_utility.install_npm_dependencies(work_dir, project=project, logger=logger, reactor=reactor)
-    else:
-        install_cypress(logger=logger, project=project, reactor=reactor, work_dir=work_dir)
-    total_time.stop()
-    logger.info(f"Configured Cypress Environment: {total_time.get_millis()}")
-    total_time = Timer.start()
+    with timed(project, "cypress_configure", role=role) as timing:
+        package_json = os.path.join(work_dir, "package.json")
+        if os.path.exists(package_json):
+            logger.info("Found package.json installing dependencies")
+            tool_utility.install_npm_dependencies(work_dir, project=project, logger=logger, reactor=reactor,
+                                                  role=role)
+        else:
+            install_cypress(logger=logger, project=project, reactor=reactor, work_dir=work_dir, role=role)
+    logger.info(f"Configured Cypress Environment: {timing['duration_ms']}")
     executable = os.path.join(work_dir, "node_modules/cypress/bin/cypress")
     results_file, run_name = get_test_report_file(project=project, test_dir=work_dir, tool="cypress")
     # Run the actual tests against the baseURL provided by ${integration_target}
@@ -145,15 +467,31 @@ def _run_cypress_tests_in_directory(work_dir, logger, project, reactor: Reactor)
     _add_config_file(logger, project, args, environment, work_dir)
     environment_variables = project.get_property(ENVIRONMENT_VARIABLES, {})
     logger.info(f"Running cypress on host: {target_url}")
-    exec_utility.exec_command(command_name=executable, args=args,
-                              failure_message="Failed to execute cypress tests", log_file_name='cypress_run.log',
-                              project=project, reactor=reactor, logger=logger, working_dir=work_dir, report=False,
-                              env_vars=environment_variables)
-    # workaround but cypress output are relative to location of cypress.json, so we need to collapse
-    if os.path.exists(f"{work_dir}/target"):
-        shutil.copytree(f"{work_dir}/target", "./target", dirs_exist_ok=True)
-    total_time.stop()
-    logger.info(f"Ran Cypress Tests: {total_time.get_millis()}")
+    log_file_name = f"cypress_run-{role}.log" if role else "cypress_run.log"
+    with timed(project, "cypress_run", role=role) as timing:
+        if cancellation:
+            # a LATEST role suite runs as a process of our own so a failing sibling can stop it
+            command = exec_utility.start_command([executable] + args, log_file_name, project, reactor,
+                                                 working_dir=work_dir, env_vars=environment_variables)
+            exit_code, cancelled = _wait_for_suite_command(command, project, logger, cancellation)
+            timing["exit_code"] = exit_code
+            if exit_code != 0:
+                timing["status"] = "cancelled" if cancelled else "failed"
+                if cancelled:
+                    raise SuiteCancelledException("Cypress tests were cancelled")
+                raise BuildFailedException("Failed to execute cypress tests")
+        else:
+            exec_utility.exec_command(command_name=executable, args=args,
+                                      failure_message="Failed to execute cypress tests",
+                                      log_file_name=log_file_name,
+                                      project=project, reactor=reactor, logger=logger, working_dir=work_dir,
+                                      report=False, env_vars=environment_variables)
+        # workaround but cypress output are relative to location of cypress.json, so we need to collapse
+        if os.path.exists(f"{work_dir}/target"):
+            # role suites run at the same time and share the project's target directory
+            with _cypress_output_lock:
+                shutil.copytree(f"{work_dir}/target", project.expand_path("$dir_target"), dirs_exist_ok=True)
+    logger.info(f"Ran Cypress Tests: {timing['duration_ms']}")
     return True
 
 
@@ -185,62 +523,252 @@ def _add_config_file(logger, project, args, environment, work_dir):
 def verify_tavern(project: Project, logger: Logger, reactor: Reactor):
     # Expand the directory to get full path
     test_dir = project.expand_path(f"${TAVERN_TEST_DIR}")
-    # Run the tests in the directory
-    if _run_tavern_tests_in_dir(test_dir, logger, project, reactor):
-        package_artifacts(project, test_dir, "tavern", project.get_property(ROLE))
+    try:
+        # Run the tests in the directory
+        if _run_tavern_tests_in_dir(test_dir, logger, project, reactor):
+            package_tavern_artifacts(project, test_dir, project.get_property(ROLE))
+    finally:
+        _write_timing_report(project, logger)
+
+
+def package_tavern_artifacts(project, test_dir, role):
+    extra_files = {}
+    if os.path.exists(get_tavern_durations_file(project)):
+        # lets the next LATEST run balance this role's tests across xdist workers
+        extra_files[shard_utility.get_durations_file_name(role)] = get_tavern_durations_file(project)
+    return package_artifacts(project, test_dir, "tavern", role, extra_files=extra_files)
+
 
+def _run_tavern_tests_in_dir(test_dir: str, logger: Logger, project: Project, reactor: Reactor, role=None,
+                             shard_tests=False):
+    result = _execute_tavern_tests(test_dir, logger, project, reactor, role=role, shard_tests=shard_tests)
+    if not result:
+        return False
+    if not result.passed:
+        if role:
+            _collect_cloudwatch_logs([result], logger, project)
+        raise BuildFailedException(f"Tavern tests failed see complete output here - {result.report_file}")
+    return True
 
-def _run_tavern_tests_in_dir(test_dir: str, logger: Logger, project: Project, reactor: Reactor, role=None):
+
+def _execute_tavern_tests(test_dir: str, logger: Logger, project: Project, reactor: Reactor, role=None,
+                          isolated=False, shard_tests=False, cancellation=None):
     logger.info("Running tavern tests: {}".format(test_dir))
     if not os.path.exists(test_dir):
         logger.info("Skipping tavern run: no tests")
-        return False
+        return None
     logger.info(f"Found {len(os.listdir(test_dir))} files in tavern test directory")
     # todo is this unique enough for each run?
     output_file, run_name = get_test_report_file(project, test_dir)
-    from sys import path as syspath
-    syspath.insert(0, test_dir)
     # install any requirements that my exist
     requirements_file = os.path.join(test_dir, "requirements.txt")
     if os.path.exists(requirements_file):
-        dependency = RequirementsFile(requirements_file)
-        install_dependencies(logger, project, dependency, reactor.pybuilder_venv,
-                             f"{prepare_logs_directory(project)}/install_tavern_pip_dependencies.log")
+        _install_tavern_requirements([requirements_file], logger, project, reactor)
     extra_args = [project.expand(prop) for prop in project.get_property(TAVERN_ADDITIONAL_ARGS, [])]
     args = ["--junit-xml", f"{output_file}", test_dir] + extra_args
     if project.get_property("verbose"):
         args.append("-s")
         args.append("-v")
-    if project.get_property(RUN_PARALLEL, False):
+    shard_index, shard_count = _get_shard(project) if shard_tests else (0, 1)
+    parallel = project.get_property(RUN_PARALLEL, False)
+    durations_files = _get_durations_files(test_dir, project, role) if parallel or shard_count > 1 else []
+    if shard_count > 1 and not role:
+        # the build's own durations are measured by each runner and may differ between them - equal weights
+        # give every runner the same partition so no test runs twice or not at all
+        durations_files = []
+    # a partial run would record partial durations
+    args.extend(_get_durations_args(test_dir, project, role, record=shard_count == 1,
+                                    balance=parallel and bool(durations_files), shard=shard_count > 1))
+    if shard_count > 1:
+        args.extend(["--integration-shard-index", str(shard_index), "--integration-shard-count", str(shard_count)])
+    if parallel:
         args.extend(['-n', 'auto'])
-    os.environ['TARGET'] = project.get_property(INTEGRATION_TARGET_URL)
-    os.environ['PUBLIC_TARGET'] = project.get_property(INTEGRATION_PUBLIC_TARGET_URL)
-    os.environ[ENVIRONMENT] = project.get_property(ENVIRONMENT)
+        if durations_files:
+            args.extend(["--dist", "loadgroup"])
+    for durations_file in durations_files:
+        args.extend(["--integration-durations", durations_file])
+    environment = {
+        'TARGET': project.get_property(INTEGRATION_TARGET_URL),
+        'PUBLIC_TARGET': project.get_property(INTEGRATION_PUBLIC_TARGET_URL),
+        ENVIRONMENT: project.get_property(ENVIRONMENT)
+    }
     logger.info(f"Running against target: {project.get_property(INTEGRATION_TARGET_URL)} and "
                 f"public target: {project.get_property(INTEGRATION_PUBLIC_TARGET_URL)}")
+    logger.debug(f"Running args: {args} ")
+    started = time.time()
+    with timed(project, "tavern_run", role=role) as timing:
+        if isolated or project.get_property(TAVERN_RUNNER, "in_process") == "subprocess":
+            log_file = f"{prepare_logs_directory(project)}/tavern_run-{run_name}.log"
+            logger.info(f"Running tavern in a separate process, output: {log_file}")
+            exit_code, cancelled = _run_tavern_in_subprocess(test_dir, run_name, args, environment, project,
+                                                             reactor, logger, cancellation)
+        else:
+            log_file = None
+            exit_code, cancelled = _run_tavern_in_process(test_dir, args, environment), False
+        # every test of the suite may belong to other shards
+        passed = exit_code == 0 or (shard_count > 1 and exit_code == pytest.ExitCode.NO_TESTS_COLLECTED)
+        cancelled = cancelled and not passed
+        timing["exit_code"] = exit_code
+        if not passed:
+            timing["status"] = "cancelled" if cancelled else "failed"
+    return RoleSuiteResult("tavern", role, test_dir, output_file, passed, exit_code=exit_code,
+                           log_file=log_file, started=started, finished=time.time(), cancelled=cancelled)
+
+
+def get_tavern_durations_file(project):
+    return f"{prepare_directory('$dir_target', project)}/tavern-{project.name}.durations.json"
+
+
+def _get_durations_args(test_dir, project, role, record=True, balance=False, shard=False):
+    # only this project's own suite ends up in its artifact
+    record = record and not role
+    if not (record or balance or shard):
+        return []
+    args = ["-p", shard_utility.PLUGIN_NAME, "--integration-test-dir", test_dir]
+    if record:
+        args.extend(["--integration-durations-out", get_tavern_durations_file(project)])
+    return args
+
+
+def _get_durations_files(test_dir, project, role):
+    durations_files = shard_utility.find_durations_files(test_dir)
+    if not role and os.path.exists(get_tavern_durations_file(project)):
+        durations_files.append(get_tavern_durations_file(project))
+    return durations_files
+
+
+def _install_latest_tavern_requirements(tavern_test_path, logger, project, reactor):
+    requirements_files = []
+    for role, directory in _get_shard_role_directories("tavern", tavern_test_path, project):
+        requirements_file = os.path.join(directory, "requirements.txt")
+        # options such as -r or --index-url are relative to their file so those are left to the role install
+        if os.path.exists(requirements_file) and \
+                not any(requirement.startswith("-") for requirement in read_requirements(requirements_file)):
+            requirements_files.append(requirements_file)
+    if len(requirements_files) < 2:
+        return
+    try:
+        _install_tavern_requirements(requirements_files, logger, project, reactor)
+    except BuildFailedException as ex:
+        logger.warn(f"Failed to install merged tavern requirements, falling back to installing per role: {ex}")
+
+
+def _install_tavern_requirements(requirements_files, logger, project, reactor):
+    requirements = {file: read_requirements(file) for file in requirements_files}
+    fingerprint = get_requirements_fingerprint([req for file in requirements_files for req in requirements[file]])
+    # pip can not safely install into the same venv from several suites at once
+    with _install_lock:
+        cache = _get_requirements_cache(reactor)
+        saved_millis = cache.get_install_millis(fingerprint)
+        all_requirements = [req for file in requirements_files for req in requirements[file]]
+        if saved_millis is not None and \
+                are_requirements_satisfied(all_requirements, reactor.pybuilder_venv.site_paths):
+            logger.info(f"Tavern requirements {', '.join(requirements_files)} already installed - "
+                        f"saved ~{saved_millis} ms")
+            return
+        with timed(project, "pip_install", files=len(requirements_files)) as timing:
+            if len(requirements_files) == 1:
+                dependency = RequirementsFile(requirements_files[0])
+            else:
+                merged_file = f"{prepare_logs_directory(project)}/tavern_merged_requirements.txt"
+                with open(merged_file, "w") as fp:
+                    fp.writelines(f"{requirement}\n" for requirement in
+                                  sorted(set(req for file in requirements_files for req in requirements[file])))
+                logger.info(f"Installing tavern requirements of {len(requirements_files)} roles in one invocation")
+                dependency = RequirementsFile(merged_file)
+            install_dependencies(logger, project, dependency, reactor.pybuilder_venv,
+                                 f"{prepare_logs_directory(project)}/install_tavern_pip_dependencies.log")
+        cache.record(fingerprint, timing["duration_ms"], clear=True)
+        # every role's own set is satisfied by the merged install
+        for file in requirements_files:
+            cache.record(get_requirements_fingerprint(requirements[file]), timing["duration_ms"])
+
+
+def _get_requirements_cache(reactor):
+    # kept in the venv so recreating the venv invalidates it
+    marker_file = os.path.join(reactor.pybuilder_venv.env_dir, ".integration_requirements.json")
+    cache = _requirements_caches.get(marker_file)
+    if not cache:
+        cache = _requirements_caches[marker_file] = RequirementsCache(marker_file)
+    return cache
+
+
+def _run_tavern_in_process(test_dir, args, environment):
+    from sys import path as syspath
+    syspath.insert(0, test_dir)
+    os.environ.update(environment)
     cache_wd = os.getcwd()
+    plugins = []
+    # xdist workers start pytest again from the command line and only load the plugin when it is named there
+    if shard_utility.PLUGIN_NAME in args and "-n" not in args:
+        # already imported by the build - loading it by name would warn that it can not be rewritten
+        index = args.index(shard_utility.PLUGIN_NAME)
+        args = args[:index - 1] + args[index + 1:]
+        plugins.append(pybuilder_integration_pytest)
     try:
         os.chdir(test_dir)
-        logger.debug(f"Running args: {args} ")
-        ret = pytest.main(args)
+        return pytest.main(args, plugins=plugins)
     finally:
         os.chdir(cache_wd)
 
-    if ret != 0:
-        if role:
-            roles = []
-            if project.get_property(CONSOLIDATE_TESTS, False):
-                with open(f"{test_dir}/roles") as fp:
-                    for line in fp:
-                        roles.append(line.strip())
-            else:
-                roles.append(role)
 
-            for service in roles:
-                CloudwatchLogs(project.get_property(ENVIRONMENT), project.get_property(APPLICATION), service,
-                               logger).print_latest()
-        raise BuildFailedException(f"Tavern tests failed see complete output here - {output_file}")
-    return True
+def _run_tavern_in_subprocess(test_dir, run_name, args, environment, project, reactor, logger, cancellation=None):
+    python_command = reactor.pybuilder_venv.executable
+    python_path = reactor.pybuilder_venv.environ.get("PYTHONPATH")
+    # the suite loads this plugin's pytest hooks (-p) so it has to be importable from the venv
+    plugin_path = os.path.dirname(os.path.abspath(pybuilder_integration_pytest.__file__))
+    environment = dict(environment,
+                       PYTHONPATH=os.pathsep.join(filter(None, [test_dir, python_path, plugin_path])))
+    command = exec_utility.start_command(python_command + ["-m", "pytest"] + args,
+                                         log_file_name=f"tavern_run-{run_name}.log",
+                                         project=project,
+                                         reactor=reactor,
+                                         working_dir=test_dir,
+                                         env_vars=environment)
+    return _wait_for_suite_command(command, project, logger, cancellation)
+
+
+def _get_failed_consolidated_roles(result, logger):
+    sources_file = f"{result.test_dir}/{CONSOLIDATED_SOURCES_FILE}"
+    failed_tests = get_failed_tests(result.report_file)
+    if failed_tests and os.path.exists(sources_file):
+        with open(sources_file) as fp:
+            roles = map_failed_tests_to_roles(failed_tests, json.load(fp))
+        if roles:
+            logger.info(f"Failed tests belong to roles: {', '.join(roles)}")
+            return roles
+    logger.info("Could not map failed tests to roles, collecting logs for every consolidated role")
+    roles = []
+    with open(f"{result.test_dir}/roles") as fp:
+        for line in fp:
+            roles.append(line.strip())
+    return roles
+
+
+def _collect_cloudwatch_logs(results, logger, project):
+    filtered = project.get_property(CLOUDWATCH_LOG_MODE, "latest") == "filter"
+    padding = int(project.get_property(CLOUDWATCH_WINDOW_PADDING, 60))
+    requests = {}
+    for result in results:
+        roles = []
+        if project.get_property(CONSOLIDATE_TESTS, False):
+            roles = _get_failed_consolidated_roles(result, logger)
+        else:
+            roles.append(result.role)
+        for service in roles:
+            if filtered and result.started is not None:
+                # only what the services logged while the failed suite was running
+                requests[service] = (service, result.started - padding, result.finished + padding)
+            else:
+                requests[service] = (service, None, None)
+    metadata = get_project_metadata(logger, project)
+    collector = CloudwatchLogsCollector(metadata.environment, metadata.app_name, logger,
+                                        prepare_reports_directory(project))
+    with timed(project, "cloudwatch_logs", roles=len(requests)):
+        return collector.collect(list(requests.values()),
+                                 filter_pattern=project.get_property(CLOUDWATCH_FILTER_PATTERN,
+                                                                    HEALTH_CHECK_FILTER_PATTERN),
+                                 max_events=int(project.get_property(CLOUDWATCH_MAX_EVENTS, 1000)))
 
 
 def get_test_report_file(project, test_dir, tool="tavern"):
@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+TIMING_REPORT_FILE = "integration-timings.json"
+
+_reports = weakref.WeakKeyDictionary()
+_reports_lock = threading.Lock()
+
+
+class TimingReport:
+
+    def __init__(self):
+        self.started = time.time()
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        # suites and transfers record from worker threads
+        with self._lock:
+            self.entries.append(entry)
+
+    def to_dict(self):
+        with self._lock:
+            entries = sorted(self.entries, key=lambda entry: entry["started"])
+        totals = {}
+        for entry in entries:
+            totals[entry["phase"]] = totals.get(entry["phase"], 0) + entry["duration_ms"]
+        return {"started": self.started, "totals_ms": totals, "phases": entries}
+
+
+def get_timing_report(project):
+    with _reports_lock:
+        report = _reports.get(project)
+        if report is None:
+            report = _reports[project] = TimingReport()
+        return report
+
+
+@contextmanager
+def timed(project, phase, role=None, **details):
+    # the yielded entry can be given further details (e.g. bytes) while the phase runs
+    entry = {"phase": phase, "role": role, "started": time.time(), "status": "ok"}
+    entry.update(details)
+    start = time.perf_counter()
+    try:
+        yield entry
+    except BaseException:
+        entry["status"] = "failed"
+        raise
+    finally:
+        entry["duration_ms"] = int((time.perf_counter() - start) * 1000)
+        get_timing_report(project).add(entry)
+
+
+def write_timing_report(project, directory):
+    report_file = os.path.join(directory, TIMING_REPORT_FILE)
+    temp_file = f"{report_file}.partial"
+    with open(temp_file, "w") as fp:
+        json.dump(get_timing_report(project).to_dict(), fp, indent=2, default=str)
+    os.replace(temp_file, report_file)
+    return report_file
@@ -1,24 +1,178 @@
+import hashlib
+import os
+import shutil
+import threading
+import weakref
+
 from pybuilder.core import Logger, Project
+from pybuilder.errors import MissingPrerequisiteException
 from pybuilder.reactor import Reactor
 
+from pybuilder_integration.directory_utility import prepare_directory, prepare_logs_directory
 from pybuilder_integration.exec_utility import exec_command
+from pybuilder_integration.properties import NPM_CACHE_DIR, CYPRESS_VERSION, ARTIFACT_MANAGER, CYPRESS_TEST_DIR
+from pybuilder_integration.timing_utility import timed
+
+_install_locks = {}
+_install_locks_lock = threading.Lock()
+_tool_registries = weakref.WeakKeyDictionary()
+_tool_registries_lock = threading.Lock()
+
+TOOLS = {
+    "aws": (["aws", "--version"], "aws cli"),
+    "npm": (["npm", "--version"], "npm")
+}
+
+
+class ToolRegistry:
+
+    def __init__(self, python_env):
+        self.python_env = python_env
+        self.tools = {}
+        self._lock = threading.Lock()
+
+    def require(self, name, project):
+        # probes serialize so a tool checked by several suites at once is still probed once
+        with self._lock:
+            tool = self.tools.get(name)
+            if tool is None:
+                tool = self.tools[name] = self._probe(name, project)
+        if tool["error"]:
+            raise tool["error"]
+        return tool["version"]
+
+    def _probe(self, name, project):
+        command_and_arguments, prerequisite = TOOLS[name]
+        outfile_name = f"{prepare_logs_directory(project)}/{name}-version.log"
+        with timed(project, "tool_check", tool=name) as timing:
+            # a single process both proves the tool runs and tells its version
+            try:
+                self.python_env.execute_command(list(command_and_arguments), outfile_name)
+            except OSError:
+                timing["status"] = "failed"
+                return {"version": None, "error": MissingPrerequisiteException(prerequisite, "integration_tests")}
+            timing["version"] = version = _read_version(outfile_name)
+        return {"version": version, "error": None}
+
+
+def _read_version(outfile_name):
+    # older aws cli releases print their version to stderr
+    for file_name in [outfile_name, f"{outfile_name}.err"]:
+        if os.path.exists(file_name):
+            with open(file_name) as fp:
+                version = fp.readline().strip()
+            if version:
+                return version
+    return None
+
+
+def get_tool_registry(reactor):
+    # one per venv - it lives as long as the build does
+    python_env = reactor.pybuilder_venv
+    with _tool_registries_lock:
+        registry = _tool_registries.get(python_env)
+        if registry is None:
+            registry = _tool_registries[python_env] = ToolRegistry(python_env)
+        return registry
 
 
-def install_cypress(logger: Logger, project: Project, reactor: Reactor, work_dir):
-    _verify_npm(reactor)
+def require_tool(name, project, reactor):
+    return get_tool_registry(reactor).require(name, project)
+
+
+def verify_required_tools(project, logger, reactor):
+    for name in get_required_tools(project, reactor):
+        logger.info(f"Found {name}: {require_tool(name, project, reactor)}")
+
+
+def get_required_tools(project, reactor):
+    # the tools the tasks in this build's plan will need
+    execution_manager = reactor.execution_manager
+    tools = set()
+    aws_cli = project.get_property(ARTIFACT_MANAGER, "S3") == "S3"
+    if aws_cli and execution_manager.is_task_in_current_execution_plan("verify_environment"):
+        tools.add("aws")
+    for task_name in ["verify_environment", "verify_cypress"]:
+        if execution_manager.is_task_in_current_execution_plan(task_name) and \
+                os.path.exists(project.expand_path(f"${CYPRESS_TEST_DIR}")):
+            tools.add("npm")
+    return sorted(tools)
+
+
+def install_cypress(logger: Logger, project: Project, reactor: Reactor, work_dir, role=None):
+    require_tool("npm", project, reactor)
     logger.info(f"Ensuring cypress is installed")
-    exec_command('npm', ['install', "cypress"], f'Failed to install cypress - required for integration tests',
-                 f'{"cypress"}_npm_install.log', project, reactor, logger, report=False, working_dir=work_dir)
+    cypress_version = project.get_property(CYPRESS_VERSION)
+    package = f"cypress@{cypress_version}" if cypress_version else "cypress"
+    _install_node_modules(work_dir, ['install', package], package.encode(),
+                          f'Failed to install cypress - required for integration tests',
+                          _get_npm_log_file_name("cypress", role), project, reactor, logger,
+                          shared=role is not None)
+
+
+def install_npm_dependencies(work_dir, project, logger, reactor, role=None):
+    require_tool("npm", project, reactor)
+    fingerprint = b""
+    for file_name in ["package.json", "package-lock.json"]:
+        path = os.path.join(work_dir, file_name)
+        if os.path.exists(path):
+            with open(path, "rb") as fp:
+                fingerprint += fp.read()
+    # a lockfile means the install can be reproduced exactly
+    args = ['ci'] if os.path.exists(os.path.join(work_dir, "package-lock.json")) else ['install']
+    _install_node_modules(work_dir, args, fingerprint,
+                          f'Failed to install package.json - required for integration tests',
+                          _get_npm_log_file_name("package_json", role), project, reactor, logger,
+                          shared=role is not None)
+
+
+def _get_npm_log_file_name(name, role):
+    # LATEST role suites install at the same time and must not share a log
+    return f"{name}_npm_install-{role}.log" if role else f"{name}_npm_install.log"
+
+
+def get_npm_cache_directory(project):
+    cache_directory = project.get_property(NPM_CACHE_DIR)
+    if cache_directory:
+        return os.path.join(project.basedir, os.path.expanduser(project.expand(cache_directory)))
+    return f"{prepare_directory('$dir_target', project)}/npm-cache"
 
 
-def _verify_npm(reactor):
-    reactor.pybuilder_venv.verify_can_execute(
-        command_and_arguments=["npm", "--version"], prerequisite="npm", caller="integration_tests")
+def _install_node_modules(work_dir, args, fingerprint, failure_message, log_file_name, project, reactor, logger,
+                          shared=False):
+    if not shared:
+        # the project's own tests keep their node_modules where the developer's npm and cypress expect them,
+        # only a link into a cache that may since have been cleaned is replaced
+        _remove_node_modules(os.path.join(work_dir, "node_modules"), links_only=True)
+        exec_command('npm', args, failure_message, log_file_name, project, reactor, logger, report=False,
+                     working_dir=work_dir)
+        return
+    key = hashlib.sha256(" ".join(args).encode() + b"\0" + fingerprint).hexdigest()
+    cached_node_modules = os.path.join(get_npm_cache_directory(project), key, "node_modules")
+    node_modules = os.path.join(work_dir, "node_modules")
+    with _get_install_lock(key):
+        if os.path.isdir(cached_node_modules):
+            logger.info(f"Reusing node_modules prepared for identical dependencies: {cached_node_modules}")
+            _remove_node_modules(node_modules)
+            os.symlink(cached_node_modules, node_modules, target_is_directory=True)
+            return
+        _remove_node_modules(node_modules, links_only=True)
+        exec_command('npm', args, failure_message, log_file_name, project, reactor, logger, report=False,
+                     working_dir=work_dir)
+        if os.path.isdir(node_modules):
+            # move the result into the cache and share it with every directory that has the same dependencies
+            os.makedirs(os.path.dirname(cached_node_modules), exist_ok=True)
+            shutil.move(node_modules, cached_node_modules)
+            os.symlink(cached_node_modules, node_modules, target_is_directory=True)
 
 
-def install_npm_dependencies(work_dir, project, logger, reactor):
-    _verify_npm(reactor)
-    exec_command('npm', ['install'], f'Failed to install package.json - required for integration tests',
-             f'package_json_npm_install.log', project, reactor, logger, report=False, working_dir=work_dir)
+def _remove_node_modules(node_modules, links_only=False):
+    if os.path.islink(node_modules):
+        os.unlink(node_modules)
+    elif os.path.isdir(node_modules) and not links_only:
+        shutil.rmtree(node_modules)
 
 
+def _get_install_lock(key):
+    with _install_locks_lock:
+        return _install_locks.setdefault(key, threading.Lock())
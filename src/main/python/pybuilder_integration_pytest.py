@@ -0,0 +1,122 @@
+import heapq
+import json
+import math
+import os
+import statistics
+
+import pytest
+
+# pytest plugin (loaded with -p) that records test durations and balances xdist workers and shards with them -
+# a top level module that only needs pytest, a suite run by another python does not import the build plugin
+PLUGIN_NAME = "pybuilder_integration_pytest"
+WORKER_GROUP_PREFIX = "integration-worker-"
+MIN_DURATION = 0.01
+
+
+def read_durations(durations_files):
+    durations = {}
+    for durations_file in durations_files:
+        try:
+            with open(durations_file) as fp:
+                durations.update(json.load(fp))
+        except (OSError, ValueError):
+            continue
+    return durations
+
+
+def quantize_duration(seconds):
+    # power of two buckets - jitter between runs does not change the packaged artifact
+    return 2.0 ** round(math.log2(max(seconds, MIN_DURATION)))
+
+
+def balance_tests(durations, shard_count):
+    # longest processing time first: the next slowest test goes to the least loaded shard
+    shards = [(0.0, index) for index in range(shard_count)]
+    assignment = {}
+    for key, duration in sorted(durations.items(), key=lambda item: (-item[1], item[0])):
+        load, index = heapq.heappop(shards)
+        assignment[key] = index
+        heapq.heappush(shards, (load + duration, index))
+    return assignment
+
+
+def get_weights(durations):
+    # anything without a recorded duration counts as the median of what is known
+    known = [duration for duration in durations.values() if duration is not None]
+    default = statistics.median(known) if known else 1.0
+    return {name: default if duration is None else duration for name, duration in durations.items()}
+
+
+def get_test_key(config, nodeid):
+    # relative to the test directory, the rootdir differs between a role's build and a LATEST run
+    path, separator, name = nodeid.partition("::")
+    if name.rfind("@") > name.rfind("]"):
+        # --dist loadgroup appends the group to the node id
+        name = name[:name.rfind("@")]
+    test_dir = config.getoption("integration_test_dir") or str(config.invocation_params.dir)
+    relative_path = os.path.relpath(os.path.join(str(config.rootpath), path), test_dir)
+    return f"{relative_path.replace(os.sep, '/')}{separator}{name}"
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("integration", "pybuilder integration test balancing")
+    group.addoption("--integration-test-dir", help="directory test durations are relative to")
+    group.addoption("--integration-durations", action="append", default=[],
+                    help="durations of a previous run used to balance xdist workers")
+    group.addoption("--integration-durations-out", help="file the durations of this run are written to")
+    group.addoption("--integration-shard-index", type=int, default=0, help="shard of the tests run here")
+    group.addoption("--integration-shard-count", type=int, default=1, help="number of runners sharing the tests")
+
+
+def pytest_configure(config):
+    # the xdist controller sees the reports of every worker, the workers do not record themselves
+    if not hasattr(config, "workerinput") and config.getoption("integration_durations_out"):
+        config.pluginmanager.register(DurationsRecorder(config), "integration-durations-recorder")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    # runs on every xdist worker - they all derive the same shards so their collections stay identical
+    shard_count = config.getoption("integration_shard_count")
+    # xdist resets dist on its workers and keeps whether groups are honoured in loadgroup
+    balance = hasattr(config, "workerinput") and getattr(config.option, "loadgroup", False)
+    if shard_count <= 1 and not balance:
+        return
+    previous = read_durations(config.getoption("integration_durations"))
+    keys = {item: get_test_key(config, item.nodeid) for item in items}
+    weights = get_weights({key: previous.get(key) for key in keys.values()})
+    if shard_count > 1:
+        shard_index = config.getoption("integration_shard_index")
+        shards = balance_tests(weights, shard_count)
+        deselected = [item for item in items if shards[keys[item]] != shard_index]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [item for item in items if shards[keys[item]] == shard_index]
+    if not balance or not any(keys[item] in previous for item in items):
+        # nothing to balance with - xdist load balancing does better than equal sized shards
+        return
+    assignment = balance_tests({keys[item]: weights[keys[item]] for item in items},
+                               int(config.workerinput["workercount"]))
+    for item in items:
+        item.add_marker(pytest.mark.xdist_group(name=f"{WORKER_GROUP_PREFIX}{assignment[keys[item]]}"))
+
+
+class DurationsRecorder:
+
+    def __init__(self, config):
+        self.config = config
+        self.durations = {}
+
+    def pytest_runtest_logreport(self, report):
+        # setup, call and teardown all count towards what the test costs a worker
+        key = get_test_key(self.config, report.nodeid)
+        self.durations[key] = self.durations.get(key, 0.0) + report.duration
+
+    def pytest_sessionfinish(self, session):
+        if not self.durations:
+            return
+        durations_file = self.config.getoption("integration_durations_out")
+        os.makedirs(os.path.dirname(os.path.abspath(durations_file)), exist_ok=True)
+        with open(durations_file, "w") as fp:
+            json.dump({key: quantize_duration(value) for key, value in self.durations.items()}, fp, indent=2,
+                      sort_keys=True)
@@ -1,12 +1,21 @@
+import json
 import os
 import random
+from importlib.metadata import EntryPoint, EntryPoints
+from unittest.mock import patch
+from zipfile import ZipFile
 
+import boto3
+from moto import mock_aws
 from pybuilder.errors import BuildFailedException
 
-from parent_test_case import ParentTestCase
+from parent_test_case import ParentTestCase, _execute_create_files
+import pybuilder_integration.artifact_manager
+import pybuilder_integration.tasks
 from pybuilder_integration import directory_utility, properties
 from pybuilder_integration.artifact_manager import S3ArtifactManager, get_artifact_manager, get_project_metadata, \
-    _unzip_downloaded_artifacts
+    _unzip_downloaded_artifacts, Boto3S3ArtifactManager, get_latest_artifact_destination, \
+    get_versioned_artifact_destination, LocalArtifactManager, ENTRY_POINT_GROUP
 
 DIRNAME = os.path.dirname(os.path.abspath(__file__))
 
@@ -59,6 +68,23 @@ class ArtifactManagerTestCase(ParentTestCase):
         self.validate_metadata_processing(expected_app_group, expected_app_name, expected_bucket, expected_environment,
                                           expected_role, mock_logger)
 
+    def test_metadata_is_resolved_once(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.name = "oranges"
+        self.project.set_property(properties.INTEGRATION_ARTIFACT_BUCKET, "foo")
+        for _ in range(3):
+            metadata = get_project_metadata(logger=mock_logger, project=self.project)
+            self.assertEqual("s3://foo/LATEST-unit-test/", get_latest_artifact_destination(mock_logger, self.project))
+        self.assertEqual(1, mock_logger.info.call_count, "Expected the naming format warning once")
+        self.assertEqual("s3://foo/Unknown/1.0.0/", metadata.get_versioned_destination("1.0.0"))
+        # a changed property resolves the metadata again
+        self.project.set_property(properties.ROLE, "bananas")
+        self.project.set_property(properties.ENVIRONMENT, "ci")
+        self.assertEqual(("bananas", "ci"), (get_project_metadata(mock_logger, self.project).role,
+                                             get_project_metadata(mock_logger, self.project).environment))
+        self.assertEqual(f"s3://foo/bananas/{self.project.version}/",
+                         get_versioned_artifact_destination(mock_logger, self.project))
+
     def validate_metadata_processing(self, expected_app_group, expected_app_name, expected_bucket, expected_environment,
                                      expected_role, mock_logger):
         artifact_manager = S3ArtifactManager()
@@ -77,11 +103,37 @@ class ArtifactManagerTestCase(ParentTestCase):
         relative_path = "foo"
         artifact_manager._s3_transfer(source=dist_directory, destination=relative_path, project=self.project,
                                       reactor=reactor, logger=mock_logger)
-        self._assert_aws_check(verify_mock)
+        self._assert_aws_check(verify_execute)
 
         self._assert_s3_transfer(dist_directory, relative_path, verify_execute)
 
 
+    def test_s3_artifact_checksum(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+
+        def head_object(command_and_arguments, outfile_name, env=None, cwd=None):
+            with open(outfile_name, "w") as fp:
+                json.dump({"Metadata": {"sha256": "abc"}}, fp)
+            return 0
+
+        verify_execute.side_effect = head_object
+        self.assertEqual("abc", S3ArtifactManager().get_artifact_checksum("s3://foo/LATEST-unit-test/bar.zip",
+                                                                          self.project, reactor, mock_logger))
+        # json regardless of the output format configured for the aws cli
+        verify_execute.assert_called_once_with(["aws", "s3api", "head-object", "--bucket", "foo", "--key",
+                                                "LATEST-unit-test/bar.zip", "--output", "json"],
+                                               f"{self.tmpDir}/target/logs/integration/s3-head-object")
+
+    def test_s3_scoped_download(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        artifact_manager = S3ArtifactManager()
+        destination = directory_utility.get_latest_zipped_distribution_directory(self.project)
+        artifact_manager._s3_transfer(source="s3://foo/LATEST-unit-test/", destination=destination,
+                                      project=self.project, reactor=reactor, logger=mock_logger, scope="bar")
+        verify_execute.assert_any_call(["aws", "s3", "cp", "s3://foo/LATEST-unit-test/", destination, "--recursive",
+                                        "--exclude", "*", "--include", "*bar*"],
+                                       f"{self.tmpDir}/target/logs/integration/s3-artifact-transfer")
+
     def test_s3_artfact_upload_abort(self):
         mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
         artifact_manager = S3ArtifactManager()
@@ -161,6 +213,56 @@ class ArtifactManagerTestCase(ParentTestCase):
             else:
                 self.fail(f"Found unexpected file {files}")
 
+    def test_artifact_packaging_is_reproducible(self):
+        directory = f"{self.tmpDir}/artifact_reproducible_test"
+        cypress_test_file_path, tavern_test_file_path = self._configure_mock_tests(directory)
+        test_dir = os.path.dirname(cypress_test_file_path)
+        self._configure_mock_tests_dir(f"{test_dir}/node_modules/cypress", "index.js")
+        zip_file = directory_utility.package_artifacts(self.project, test_dir, "cypress", "foo")
+        with open(zip_file, "rb") as fp:
+            first = fp.read()
+        with ZipFile(zip_file) as archive:
+            self.assertEqual(["foo/", "foo/test.json"], archive.namelist(), "Expected node_modules to be excluded")
+        # a new timestamp is not a change - the previous archive is reused
+        os.utime(cypress_test_file_path, (0, 0))
+        os.remove(zip_file)
+        directory_utility.package_artifacts(self.project, test_dir, "cypress", "foo")
+        with open(zip_file, "rb") as fp:
+            self.assertEqual(first, fp.read(), "Expected identical archive for identical content")
+        modified = os.stat(zip_file).st_mtime_ns
+        directory_utility.package_artifacts(self.project, test_dir, "cypress", "foo")
+        self.assertEqual(modified, os.stat(zip_file).st_mtime_ns, "Expected unchanged archive to be reused")
+        with open(cypress_test_file_path, "w") as fp:
+            fp.write("{}")
+        directory_utility.package_artifacts(self.project, test_dir, "cypress", "foo")
+        with open(zip_file, "rb") as fp:
+            self.assertNotEqual(first, fp.read(), "Expected changed content to be repackaged")
+
+    def test_artifact_consolidation(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.CONSOLIDATE_TESTS, True)
+        for role in ["bar", "foo"]:
+            test_dir = f"{self.tmpDir}/consolidation_test/{role}"
+            self._configure_mock_tests_dir(f"{test_dir}/nested", f"test_{role}.tavern.yaml")
+            with open(f"{test_dir}/conftest.py", "w") as fp:
+                fp.write(role)
+            self.project.name = f"integration-test-{role}"
+            directory_utility.package_artifacts(self.project, test_dir, "tavern", role)
+        directory = f"{self.tmpDir}/consolidation_dest"
+        _unzip_downloaded_artifacts(directory_utility.prepare_dist_directory(self.project), directory, mock_logger,
+                                    self.project)
+        self.assertEqual(["consolidated"], os.listdir(f"{directory}/tavern"), "Expected only the consolidated suite")
+        consolidated = f"{directory}/tavern/consolidated"
+        self.assertEqual(["test_bar.tavern.yaml", "test_foo.tavern.yaml"], sorted(os.listdir(f"{consolidated}/nested")))
+        with open(f"{consolidated}/roles") as fp:
+            self.assertEqual(["bar", "foo"], fp.read().splitlines())
+        with open(f"{consolidated}/conftest.py") as fp:
+            self.assertEqual("foo", fp.read())
+        with open(f"{consolidated}/sources.json") as fp:
+            self.assertEqual({"conftest.py": "foo", "nested/test_bar.tavern.yaml": "bar",
+                              "nested/test_foo.tavern.yaml": "foo"}, json.load(fp))
+        mock_logger.warn.assert_any_call("conftest.py is provided by roles bar and foo - using foo")
+
     def test_artifact_repackaging(self):
         mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
         directory = f"{self.tmpDir}/artifact_packaging_test"
@@ -169,6 +271,146 @@ class ArtifactManagerTestCase(ParentTestCase):
         directory_utility.package_artifacts(self.project, os.path.dirname(tavern_test_file_path), "tavern","foo")
         # we didn't fail we are good!!!
 
+    @mock_aws
+    @patch.dict(os.environ, {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                             "AWS_SECRET_ACCESS_KEY": "testing"})
+    def test_boto3_artifact_transfer(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.ARTIFACT_MANAGER, "S3_BOTO3")
+        self.project.set_property(properties.INTEGRATION_ARTIFACT_BUCKET, "boto3-artifacts")
+        artifact_manager = get_artifact_manager(self.project)
+        self.assertIsInstance(artifact_manager, Boto3S3ArtifactManager)
+        # nothing to download before the first upload creates the bucket
+        self.assertIsNone(artifact_manager.download_artifacts(project=self.project, logger=mock_logger,
+                                                              reactor=reactor))
+        directory = f"{self.tmpDir}/boto3_packaging_test"
+        cypress_test_file_path, tavern_test_file_path = self._configure_mock_tests(directory)
+        directory_utility.package_artifacts(self.project, os.path.dirname(tavern_test_file_path), "tavern", "foo")
+        artifact_file = directory_utility.get_local_zip_artifact_path(tool="tavern", project=self.project,
+                                                                      include_ending=True)
+        artifact_manager.upload(file=artifact_file, project=self.project, logger=mock_logger, reactor=reactor)
+        keys = [item["Key"] for item in
+                boto3.client("s3").list_objects_v2(Bucket="boto3-artifacts")["Contents"]]
+        self.assertEqual(sorted([f"LATEST-unit-test/{os.path.basename(artifact_file)}",
+                                 f"pybuilder/{self.project.version}/{os.path.basename(artifact_file)}"]),
+                         sorted(keys))
+        # an artifact outside of the testing scope should never be fetched
+        boto3.client("s3").put_object(Bucket="boto3-artifacts", Key="LATEST-unit-test/tavern-other-app.zip",
+                                      Body=b"not a zip")
+        self.project.set_property(properties.TESTING_SCOPE, "integration-test")
+        self.project.set_property(properties.ARTIFACT_CACHE_DIR, f"{self.tmpDir}/artifact-cache")
+        latest_directory = artifact_manager.download_artifacts(project=self.project, logger=mock_logger,
+                                                               reactor=reactor)
+        self.assertEqual(["test.tavern.yaml"], os.listdir(f"{latest_directory}/tavern/foo"))
+        # pushing the same artifact again only copies it to the new version
+        self.project.version = "2.0.0"
+        artifact_manager.upload(file=artifact_file, project=self.project, logger=mock_logger, reactor=reactor)
+        mock_logger.info.assert_any_call(f"{os.path.basename(artifact_file)} is unchanged in "
+                                         f"s3://boto3-artifacts/LATEST-unit-test/ - skipping upload")
+        boto3.client("s3").head_object(Bucket="boto3-artifacts",
+                                       Key=f"pybuilder/2.0.0/{os.path.basename(artifact_file)}")
+        artifact_manager.download_artifacts(project=self.project, logger=mock_logger, reactor=reactor)
+        mock_logger.info.assert_any_call(f"Artifact cache {self.tmpDir}/artifact-cache: 1 hits, 0 misses")
+        self.assertEqual([os.path.basename(artifact_file)],
+                         os.listdir(directory_utility.get_latest_zipped_distribution_directory(self.project)))
+        # no aws cli process should be needed for any of it
+        verify_mock.assert_not_called()
+        verify_execute.assert_not_called()
+
+    def test_bucket_checked_once(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.INTEGRATION_ARTIFACT_BUCKET, "foo")
+        head_bucket_error = []
 
+        def execute(command_and_arguments, outfile_name, env=None, cwd=None):
+            exit_code = _execute_create_files(command_and_arguments, outfile_name, env=env, cwd=cwd)
+            if command_and_arguments[1:3] == ["s3api", "head-bucket"] and head_bucket_error:
+                with open(f"{outfile_name}.err", "w") as fp:
+                    fp.write(head_bucket_error[0])
+                return 254
+            if command_and_arguments[1:3] == ["s3api", "create-bucket"]:
+                head_bucket_error.clear()
+            return exit_code
 
+        def head_bucket_calls():
+            return len([call for call in verify_execute.call_args_list if call.args[0][2:3] == ["head-bucket"]])
+
+        verify_execute.side_effect = execute
+        artifact_manager = S3ArtifactManager()
+        # a missing bucket is a noop for the download and is created once for the uploads
+        head_bucket_error.append("An error occurred (404) when calling the HeadBucket operation: Not Found")
+        self.assertIsNone(artifact_manager.download_artifacts(project=self.project, logger=mock_logger,
+                                                              reactor=reactor))
+        for tool in ["tavern", "cypress"]:
+            with open(f"{self.tmpDir}/{tool}.zip", "w") as fp:
+                fp.write(tool)
+            artifact_manager.upload(file=f"{self.tmpDir}/{tool}.zip", project=self.project, logger=mock_logger,
+                                    reactor=reactor)
+        self.assertEqual(1, head_bucket_calls())
+        self.assertEqual(1, len([call for call in verify_execute.call_args_list
+                                 if call.args[0][2:3] == ["create-bucket"]]))
+        # anything but a missing bucket still fails the build
+        head_bucket_error.append("An error occurred (403) when calling the HeadBucket operation: Forbidden")
+        with self.assertRaises(BuildFailedException):
+            S3ArtifactManager().does_bucket_exist(mock_logger, self.project, reactor)
+
+    def test_local_artifact_transfer(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.ARTIFACT_MANAGER, "LOCAL")
+        self.project.set_property(properties.INTEGRATION_ARTIFACT_BUCKET, "local-artifacts")
+        self.project.set_property(properties.ARTIFACT_LOCAL_DIR, "shared")
+        artifact_manager = get_artifact_manager(self.project)
+        self.assertIsInstance(artifact_manager, LocalArtifactManager)
+        # nothing to download before the first upload
+        self.assertIsNone(artifact_manager.download_artifacts(project=self.project, logger=mock_logger,
+                                                              reactor=reactor))
+        directory = f"{self.tmpDir}/local_packaging_test"
+        cypress_test_file_path, tavern_test_file_path = self._configure_mock_tests(directory)
+        directory_utility.package_artifacts(self.project, os.path.dirname(tavern_test_file_path), "tavern", "foo")
+        artifact_file = directory_utility.get_local_zip_artifact_path(tool="tavern", project=self.project,
+                                                                      include_ending=True)
+        pybuilder_integration.tasks.integration_artifact_push(self.project, mock_logger, reactor)
+        bucket = f"{self.tmpDir}/shared/local-artifacts"
+        self.assertEqual([os.path.basename(artifact_file)], os.listdir(f"{bucket}/LATEST-unit-test"))
+        self.assertEqual([os.path.basename(artifact_file)], os.listdir(f"{bucket}/pybuilder/{self.project.version}"))
+        # pushing the same artifact again only copies it to the new version
+        self.project.version = "2.0.0"
+        artifact_manager.upload(file=artifact_file, project=self.project, logger=mock_logger, reactor=reactor)
+        mock_logger.info.assert_any_call(f"{os.path.basename(artifact_file)} is unchanged in "
+                                         f"{bucket}/LATEST-unit-test - skipping upload")
+        self.assertTrue(os.path.exists(f"{bucket}/pybuilder/2.0.0/{os.path.basename(artifact_file)}"))
+        # the whole verify pipeline runs offline against the shared directory
+        self.project.set_property(properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self.project.set_property(properties.INCREMENTAL_TESTS, True)
+        for expected in [["tavern", "foo"], ["tavern"]]:
+            before = self.pytest_main_mock.call_count
+            pybuilder_integration.tasks.verify_environment(project=self.project, logger=mock_logger, reactor=reactor)
+            self.assertEqual(expected, [os.path.basename(call.args[0][2])
+                                        for call in self.pytest_main_mock.call_args_list[before:]])
+        with open(f"{bucket}/STATE-unit-test/pybuilder.json") as fp:
+            self.assertEqual(["tavern/foo"], list(json.load(fp)["suites"]))
+        self.assertEqual([], [name for name in os.listdir(f"{bucket}/LATEST-unit-test") if name.startswith(".")],
+                         "Expected no partial copies")
+        verify_mock.assert_not_called()
+        verify_execute.assert_not_called()
 
+    def test_artifact_manager_entry_points(self):
+        entry_points = [EntryPoint("LOCAL_TEST", "pybuilder_integration.artifact_manager:LocalArtifactManager",
+                                   ENTRY_POINT_GROUP),
+                        EntryPoint("broken-plugin", "pybuilder_integration.missing:Manager", ENTRY_POINT_GROUP)]
+        with patch.object(pybuilder_integration.artifact_manager, "_entry_points_loaded", False), \
+                patch.dict(pybuilder_integration.artifact_manager.artifact_managers), \
+                patch.dict(pybuilder_integration.artifact_manager._entry_point_errors), \
+                patch("importlib.metadata.entry_points", return_value=EntryPoints(entry_points)) as entry_points_mock:
+            # registered under the identifier of the manager, not the entry point name
+            pybuilder_integration.artifact_manager.artifact_managers.pop("LOCAL")
+            self.project.set_property(properties.ARTIFACT_MANAGER, "LOCAL")
+            self.assertIsInstance(get_artifact_manager(self.project), LocalArtifactManager)
+            self.project.set_property(properties.ARTIFACT_MANAGER, "BROKEN")
+            with self.assertRaises(BuildFailedException) as context:
+                get_artifact_manager(self.project)
+            # the identifier of a broken manager is unknown so every load error is reported
+            self.assertIn("failed to load entry points: broken-plugin: No module named 'pybuilder_integration.missing'",
+                          str(context.exception))
+            self.assertEqual(1, entry_points_mock.call_count, "Expected entry points to be discovered once")
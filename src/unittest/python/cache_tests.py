@@ -0,0 +1,46 @@
+import os
+import time
+from unittest.mock import Mock
+
+from pybuilder.core import Logger
+
+from parent_test_case import ParentTestCase
+from pybuilder_integration.cache_utility import ArtifactCache
+
+DIRNAME = os.path.dirname(os.path.abspath(__file__))
+
+
+class ArtifactCacheTestCase(ParentTestCase):
+
+    def _download(self, content):
+        def download(path):
+            self.downloads += 1
+            with open(path, "w") as fp:
+                fp.write(content)
+        return download
+
+    def test_cache_hit_and_miss(self):
+        self.downloads = 0
+        cache = ArtifactCache(f"{self.tmpDir}/cache", 1024, Mock(Logger))
+        destination = f"{self.tmpDir}/artifact.zip"
+        cache.fetch("bucket", "LATEST-ci/tavern-foo.zip", '"etag1"', destination, self._download("one"))
+        cache.fetch("bucket", "LATEST-ci/tavern-foo.zip", '"etag1"', destination, self._download("one"))
+        self.assertEqual(1, self.downloads, "Expected unchanged artifact to come from the cache")
+        cache.fetch("bucket", "LATEST-ci/tavern-foo.zip", '"etag2"', destination, self._download("two"))
+        self.assertEqual(2, self.downloads, "Expected changed etag to download again")
+        with open(destination) as fp:
+            self.assertEqual("two", fp.read())
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_cache_eviction(self):
+        self.downloads = 0
+        cache = ArtifactCache(f"{self.tmpDir}/cache", 6, Mock(Logger))
+        destination = f"{self.tmpDir}/artifact.zip"
+        for etag in ["a", "b", "c"]:
+            cache.fetch("bucket", "key", etag, destination, self._download("four"))
+            # make sure modification times are ordered
+            time.sleep(0.01)
+        cache.evict()
+        self.assertEqual(1, len(os.listdir(f"{self.tmpDir}/cache")), "Expected least recently used entries evicted")
+        cache.fetch("bucket", "key", "c", destination, self._download("four"))
+        self.assertEqual(3, self.downloads, "Expected most recent entry to be kept")
@@ -9,7 +9,7 @@ import pybuilder_integration.properties
 import pybuilder_integration.tasks
 import pybuilder_integration.tool_utility
 from parent_test_case import ParentTestCase
-from pybuilder_integration.cloudwatchlogs_utility import CloudwatchLogs
+from pybuilder_integration.cloudwatchlogs_utility import CloudwatchLogs, CloudwatchLogsCollector
 
 DIRNAME = os.path.dirname(os.path.abspath(__file__))
 
@@ -33,9 +33,56 @@ class DummyClient:
             ]
         }
 
+class DummyFilterClient:
+    def __init__(self):
+        self.calls = []
+
+    def filter_log_events(self, **params):
+        self.calls.append(params)
+        if "nextToken" not in params:
+            return {
+                "events": [{"logStreamName": "one", "message": "GET /health"},
+                           {"logStreamName": "one", "message": "first"}],
+                "nextToken": "page2"
+            }
+        return {"events": [{"logStreamName": "two", "message": "second"},
+                           {"logStreamName": "two", "message": "third"}]}
+
+
 class CWTestCase(ParentTestCase):
 
     def test_cw(self):
         cwLogs = CloudwatchLogs('unit-test','foo','bar',Mock(Logger))
         cwLogs.cwclient = DummyClient()
         cwLogs.print_latest()
+
+    def test_cw_filtered(self):
+        mock_logger = Mock(Logger)
+        cwLogs = CloudwatchLogs('unit-test', 'foo', 'bar', mock_logger)
+        cwLogs.cwclient = client = DummyFilterClient()
+        cwLogs.print_filtered(start_time=10, end_time=20.5, filter_pattern="ERROR", max_events=2)
+        self.assertEqual({"logGroupName": "/unit-test/foo/bar", "startTime": 10000, "endTime": 20500,
+                          "filterPattern": "ERROR"}, client.calls[0])
+        self.assertEqual("page2", client.calls[1]["nextToken"])
+        messages = [call.args[0] for call in mock_logger.warn.call_args_list]
+        self.assertEqual(["Cloudwatch Logs /unit-test/foo/bar",
+                          "/unit-test/foo/bar - one - first",
+                          "/unit-test/foo/bar - two - second",
+                          "/unit-test/foo/bar - stopped after 2 events"], messages)
+
+    def test_cw_filtered_excludes_health_checks(self):
+        cwLogs = CloudwatchLogs('unit-test', 'foo', 'bar', Mock(Logger))
+        cwLogs.cwclient = client = DummyFilterClient()
+        cwLogs.print_filtered(start_time=10, end_time=20)
+        self.assertEqual('-"/health"', client.calls[0]["filterPattern"])
+
+    def test_cw_collector(self):
+        mock_logger = Mock(Logger)
+        collector = CloudwatchLogsCollector('unit-test', 'foo', mock_logger, self.tmpDir)
+        collector.cwclient = DummyClient()
+        log_files = collector.collect([("bar", None, None), ("baz", None, None)])
+        self.assertEqual({"bar": f"{self.tmpDir}/cloudwatch-bar.log", "baz": f"{self.tmpDir}/cloudwatch-baz.log"},
+                         log_files)
+        with open(log_files["baz"]) as fp:
+            self.assertEqual(["Cloudwatch Logs /unit-test/foo/baz", "/unit-test/foo/baz - br"], fp.read().splitlines())
+        mock_logger.warn.assert_any_call(f"Cloudwatch logs for bar written to {self.tmpDir}/cloudwatch-bar.log")
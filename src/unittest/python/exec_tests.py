@@ -0,0 +1,48 @@
+import sys
+import time
+
+from pybuilder.errors import BuildFailedException
+
+from parent_test_case import ParentTestCase
+from pybuilder_integration import exec_utility
+from pybuilder_integration.directory_utility import prepare_logs_directory
+
+
+class ExecTestCase(ParentTestCase):
+
+    def _submit(self, code, log_file_name, reactor, logger, **kwargs):
+        return exec_utility.submit_command(sys.executable, ["-c", code], "Failed", log_file_name, self.project,
+                                           reactor, logger, report=False, **kwargs)
+
+    def test_submit_commands_concurrently(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        started = time.time()
+        futures = [self._submit("import time; time.sleep(1); print('done')", f"sleep-{index}", reactor, mock_logger)
+                   for index in range(3)]
+        self.assertEqual([True, True, True], [future.result() for future in futures])
+        self.assertLess(time.time() - started, 2.5, "Commands did not run at once")
+        with open(f"{prepare_logs_directory(self.project)}/sleep-0") as fp:
+            self.assertEqual("done\n", fp.read())
+        verify_execute.assert_not_called()
+
+    def test_stream_output(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.assertTrue(exec_utility.exec_command(sys.executable, ["-c", "print('one'); print('two')"], "Failed",
+                                                  "streamed", self.project, reactor, mock_logger, report=False,
+                                                  stream=True))
+        mock_logger.info.assert_any_call("[streamed] one")
+        mock_logger.info.assert_any_call("[streamed] two")
+        with open(f"{prepare_logs_directory(self.project)}/streamed") as fp:
+            self.assertEqual("one\ntwo\n", fp.read())
+
+    def test_timeout_and_terminate(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        future = self._submit("import time; time.sleep(30)", "timeout", reactor, mock_logger, timeout=0.5)
+        with self.assertRaises(BuildFailedException) as context:
+            future.result(10)
+        self.assertEqual("Failed - timed out after 0.5s", str(context.exception))
+        future = self._submit("import time; time.sleep(30)", "terminate", reactor, mock_logger,
+                              raise_exception=False)
+        future.terminate()
+        self.assertFalse(future.result(10))
+        mock_logger.warn.assert_any_call("Failed - terminated")
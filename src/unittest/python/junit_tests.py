@@ -0,0 +1,34 @@
+import os
+
+from parent_test_case import ParentTestCase
+from pybuilder_integration.junit_utility import get_failed_tests, map_failed_tests_to_roles
+
+DIRNAME = os.path.dirname(os.path.abspath(__file__))
+
+REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest" errors="1" failures="1" tests="3">
+<testcase classname="nested.test_foo.tavern.yaml" name="Get foo" time="0.1"><failure message="boom"/></testcase>
+<testcase classname="test_bar.tavern.yaml" name="Get bar" time="0.2"/>
+<testcase classname="test_baz" name="test_baz" time="0.3"><error message="boom"/></testcase>
+</testsuite></testsuites>
+"""
+
+
+class JunitTestCase(ParentTestCase):
+
+    def _write_report(self):
+        report_file = f"{self.tmpDir}/report.xml"
+        with open(report_file, "w") as fp:
+            fp.write(REPORT)
+        return report_file
+
+    def test_failed_tests(self):
+        self.assertEqual(["nested.test_foo.tavern.yaml", "test_baz"], get_failed_tests(self._write_report()))
+        self.assertIsNone(get_failed_tests(f"{self.tmpDir}/missing.xml"))
+
+    def test_map_failed_tests_to_roles(self):
+        sources = {"nested/test_foo.tavern.yaml": "foo", "test_bar.tavern.yaml": "bar", "test_baz.py": "baz"}
+        failed_tests = get_failed_tests(self._write_report())
+        self.assertEqual(["foo", "baz"], map_failed_tests_to_roles(failed_tests, sources))
+        # anything that can not be traced back means the roles are unknown
+        self.assertIsNone(map_failed_tests_to_roles(["conftest"], sources))
@@ -60,6 +60,9 @@ class ParentTestCase(TestCase):
         reactor.python_env_registry = {}
         reactor.python_env_registry["pybuilder"] = pyb_env = Mock()
         pyb_env.environ = {}
+        pyb_env.executable = ["python"]
+        pyb_env.env_dir = f"{self.tmpDir}/venv"
+        pyb_env.site_paths = [f"{self.tmpDir}/venv/site-packages"]
         pytest.main = pytest_main = Mock(side_effect=_pytest_main)
         self.pytest_main_mock = pytest_main
         verify_mock = pyb_env.verify_can_execute = Mock()
@@ -67,20 +70,17 @@ class ParentTestCase(TestCase):
         reactor.pybuilder_venv = pyb_env
         return mock_logger, verify_mock, verify_execute, reactor
 
-    def _assert_aws_check(self, verify_mock):
-        verify_mock.assert_any_call(command_and_arguments=["aws", "--version"],
-                                    prerequisite="aws cli",
-                                    caller="integration_tests")
+    def _assert_aws_check(self, verify_execute):
+        verify_execute.assert_any_call(["aws", "--version"], f"{self.tmpDir}/target/logs/integration/aws-version.log")
 
-    def _assert_npm_install(self, verify_mock):
-        verify_mock.assert_any_call(command_and_arguments=["npm", "--version"],
-                                    prerequisite="npm",
-                                    caller="integration_tests")
+    def _assert_npm_install(self, verify_execute):
+        verify_execute.assert_any_call(["npm", "--version"], f"{self.tmpDir}/target/logs/integration/npm-version.log")
 
-    def _assert_s3_transfer(self, source, destination, verify_execute, recursive=True):
+    def _assert_s3_transfer(self, source, destination, verify_execute, recursive=True, extra_args=()):
         args = ["aws", "s3", "cp", source, destination]
         if recursive:
             args.append("--recursive")
+        args.extend(extra_args)
         verify_execute.assert_any_call(args,
                                        f"{self.tmpDir}/target/logs/integration/s3-artifact-transfer")
 
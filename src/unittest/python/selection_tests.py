@@ -0,0 +1,69 @@
+import json
+import os
+from unittest.mock import patch
+
+import boto3
+from moto import mock_aws
+from pybuilder.errors import BuildFailedException
+
+import pybuilder_integration.tasks
+from parent_test_case import ParentTestCase
+from pybuilder_integration import properties, directory_utility
+from pybuilder_integration.artifact_manager import get_suite_state_destination, split_s3_url
+from pybuilder_integration.selection_utility import get_suite_fingerprint
+
+
+class SelectionTestCase(ParentTestCase):
+
+    def _verify_environment(self, reactor, mock_logger):
+        before = self.pytest_main_mock.call_count
+        pybuilder_integration.tasks.verify_environment(project=self.project, logger=mock_logger, reactor=reactor)
+        return [os.path.basename(call.args[0][2]) for call in self.pytest_main_mock.call_args_list[before:]]
+
+    def test_suite_fingerprint(self):
+        cypress_test_file, tavern_test_file = self._configure_mock_tests(f"{self.tmpDir}/suite")
+        test_dir = os.path.dirname(tavern_test_file)
+        fingerprint = get_suite_fingerprint(test_dir)
+        os.utime(tavern_test_file, (0, 0))
+        self.assertEqual(fingerprint, get_suite_fingerprint(test_dir))
+        os.rename(tavern_test_file, f"{test_dir}/renamed.tavern.yaml")
+        self.assertNotEqual(fingerprint, get_suite_fingerprint(test_dir))
+
+    @mock_aws
+    @patch.dict(os.environ, {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                             "AWS_SECRET_ACCESS_KEY": "testing"})
+    def test_incremental_verify_environment(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.ARTIFACT_MANAGER, "S3_BOTO3")
+        self.project.set_property(properties.INTEGRATION_ARTIFACT_BUCKET, "incremental-artifacts")
+        self.project.set_property(properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self.project.set_property(properties.PROMOTE_ARTIFACT, False)
+        self.project.set_property(properties.INCREMENTAL_TESTS, True)
+        boto3.client("s3").create_bucket(Bucket="incremental-artifacts")
+        self._configure_mock_tests(directory_utility.get_working_distribution_directory(self.project))
+        latest_dir = directory_utility.get_latest_distribution_directory(self.project)
+        for role in ["bar", "foo"]:
+            self._configure_mock_tests(latest_dir, role=role)
+        self.assertEqual(["tavern", "bar", "foo"], self._verify_environment(reactor, mock_logger))
+        bucket, key = split_s3_url(get_suite_state_destination(mock_logger, self.project))
+        state = json.loads(boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read())
+        self.assertEqual(["cypress/bar", "cypress/foo", "tavern/bar", "tavern/foo"], sorted(state["suites"]))
+        # the current build's tests always run, LATEST suites only when they changed
+        self.assertEqual(["tavern"], self._verify_environment(reactor, mock_logger))
+        with open(f"{latest_dir}/tavern/foo/test.tavern.yaml", "w") as fp:
+            fp.write("changed")
+        self.assertEqual(["tavern", "foo"], self._verify_environment(reactor, mock_logger))
+        self.project.set_property(properties.INTEGRATION_TARGET_VERSION, "2.0.0")
+        self.assertEqual(["tavern", "bar", "foo"], self._verify_environment(reactor, mock_logger))
+        self.project.set_property(properties.FORCE_FULL_RUN, True)
+        self.assertEqual(["tavern", "bar", "foo"], self._verify_environment(reactor, mock_logger))
+        # a failed run does not record its suites
+        self.project.set_property(properties.FORCE_FULL_RUN, False)
+        with open(f"{latest_dir}/tavern/bar/test.tavern.yaml", "w") as fp:
+            fp.write("changed")
+        self.pytest_main_mock.side_effect = lambda args, plugins=None: 1 if args[2].endswith("bar") else 0
+        with self.assertRaises(BuildFailedException):
+            self._verify_environment(reactor, mock_logger)
+        self.pytest_main_mock.side_effect = lambda args, plugins=None: 0
+        self.assertEqual(["tavern", "bar"], self._verify_environment(reactor, mock_logger))
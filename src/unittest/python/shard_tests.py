@@ -0,0 +1,178 @@
+import json
+import os
+from xml.etree import ElementTree
+from unittest.mock import patch
+from zipfile import ZipFile
+
+import pytest
+from _pytest.config import main as run_pytest
+from pybuilder.errors import BuildFailedException
+
+import pybuilder_integration.tasks
+from parent_test_case import ParentTestCase
+from pybuilder_integration import properties, shard_utility, directory_utility, artifact_manager
+from pybuilder_integration.shard_utility import balance_tests, quantize_duration, read_durations
+
+DIRNAME = os.path.dirname(os.path.abspath(__file__))
+
+
+class ShardTestCase(ParentTestCase):
+
+    def _configure_suite(self):
+        # an ini file above the tests moves the rootdir away from the test directory
+        with open(f"{self.tmpDir}/tox.ini", "w") as fp:
+            fp.write("[pytest]\n")
+        test_dir = f"{self.tmpDir}/suite"
+        os.makedirs(f"{test_dir}/nested")
+        for module, tests in [("test_a.py", ["one", "two"]), ("nested/test_b.py", ["three", "four"])]:
+            with open(f"{test_dir}/{module}", "w") as fp:
+                for test in tests:
+                    fp.write(f"def test_{test}():\n    pass\n\n\n")
+        return test_dir
+
+    def test_balance_tests(self):
+        durations = {"a": 8, "b": 7, "c": 6, "d": 5, "e": 4}
+        self.assertEqual({"a": 0, "b": 1, "c": 1, "d": 0, "e": 0}, balance_tests(durations, 2))
+        self.assertEqual({0, 1, 2}, set(balance_tests(durations, 3).values()))
+        self.assertEqual(0.5, quantize_duration(0.6))
+        self.assertEqual(quantize_duration(0.001), quantize_duration(0.002))
+
+    def test_record_durations(self):
+        test_dir = self._configure_suite()
+        durations_file = f"{self.tmpDir}/durations.json"
+        exit_code = run_pytest(["-q", "-p", "no:cacheprovider", "--import-mode=importlib",
+                                "-p", shard_utility.PLUGIN_NAME,
+                                "--integration-test-dir", test_dir, "--integration-durations-out", durations_file,
+                                test_dir])
+        self.assertEqual(0, exit_code)
+        self.assertEqual({"test_a.py::test_one", "test_a.py::test_two", "nested/test_b.py::test_three",
+                          "nested/test_b.py::test_four"}, set(read_durations([durations_file])))
+
+    def test_balance_xdist_workers(self):
+        test_dir = self._configure_suite()
+        durations_file = f"{test_dir}/{shard_utility.get_durations_file_name('foo')}"
+        with open(durations_file, "w") as fp:
+            json.dump({"test_a.py::test_one": 4.0, "test_a.py::test_two": 1.0,
+                       "nested/test_b.py::test_three": 2.0}, fp)
+        self.assertEqual([durations_file], shard_utility.find_durations_files(test_dir))
+        report_file = f"{self.tmpDir}/report.xml"
+        exit_code = run_pytest(["-q", "-p", "no:cacheprovider", "--import-mode=importlib",
+                                "-p", shard_utility.PLUGIN_NAME,
+                                "--integration-test-dir", test_dir, "--integration-durations", durations_file,
+                                "-n", "2", "--dist", "loadgroup", "--junit-xml", report_file, test_dir])
+        self.assertEqual(0, exit_code)
+        groups = {}
+        for testcase in ElementTree.parse(report_file).iter("testcase"):
+            name, _, group = testcase.get("name").partition("@")
+            groups.setdefault(group, set()).add(name)
+        # the group is part of the reported test names
+        self.assertEqual({"integration-worker-0", "integration-worker-1"}, set(groups))
+        # the unknown test counts as the median (2s) - longest first gives shards of 5s and 4s
+        self.assertEqual({frozenset({"test_one", "test_two"}), frozenset({"test_three", "test_four"})},
+                         set(frozenset(names) for names in groups.values()))
+
+    def test_package_durations(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.ROLE, "foo")
+        test_dir = self._configure_suite()
+        durations_file = pybuilder_integration.tasks.get_tavern_durations_file(self.project)
+        with open(durations_file, "w") as fp:
+            json.dump({"test_a.py::test_one": 1.0}, fp)
+        zip_file = pybuilder_integration.tasks.package_tavern_artifacts(self.project, test_dir, "foo")
+        with ZipFile(zip_file) as archive:
+            self.assertIn(f"foo/{shard_utility.get_durations_file_name('foo')}", archive.namelist())
+        self.assertFalse(shard_utility.find_durations_files(test_dir), "Wrote durations into the test sources")
+
+    def _run_shard(self, test_dir, shard_index, durations_file):
+        report_file = f"{self.tmpDir}/report-{shard_index}.xml"
+        exit_code = run_pytest(["-q", "-p", "no:cacheprovider", "--import-mode=importlib",
+                                "-p", shard_utility.PLUGIN_NAME,
+                                "--integration-test-dir", test_dir, "--integration-durations", durations_file,
+                                "--integration-shard-index", str(shard_index), "--integration-shard-count", "2",
+                                "--junit-xml", report_file, test_dir])
+        self.assertEqual(0, exit_code)
+        return set(testcase.get("name") for testcase in ElementTree.parse(report_file).iter("testcase"))
+
+    def test_shard_tests(self):
+        test_dir = self._configure_suite()
+        durations_file = f"{self.tmpDir}/durations.json"
+        with open(durations_file, "w") as fp:
+            json.dump({"test_a.py::test_one": 4.0, "nested/test_b.py::test_three": 3.0}, fp)
+        # the unknown tests count as the median (3.5s) - longest first gives both runners 7s
+        self.assertEqual({"test_one", "test_three"}, self._run_shard(test_dir, 0, durations_file))
+        self.assertEqual({"test_two", "test_four"}, self._run_shard(test_dir, 1, durations_file))
+
+    def _run_verify_environment_shard(self, shard_index, reactor, mock_logger):
+        self.project.set_property(properties.SHARD_INDEX, shard_index)
+        before = self.pytest_main_mock.call_count
+        pybuilder_integration.tasks.verify_environment(project=self.project, logger=mock_logger, reactor=reactor)
+        return [call.args[0][2] for call in self.pytest_main_mock.call_args_list[before:]]
+
+    def test_shard_own_tests_ignores_runner_durations(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self.project.set_property(properties.SHARD_COUNT, 2)
+        test_dir = self._configure_suite()
+        names = []
+        # every runner measured its own durations differently
+        for shard_index, slow_test in [(0, "test_a.py::test_one"), (1, "nested/test_b.py::test_four")]:
+            durations = {key: 1.0 for key in ["test_a.py::test_one", "test_a.py::test_two",
+                                              "nested/test_b.py::test_three", "nested/test_b.py::test_four"]}
+            with open(pybuilder_integration.tasks.get_tavern_durations_file(self.project), "w") as fp:
+                json.dump(dict(durations, **{slow_test: 8.0}), fp)
+            self.project.set_property(properties.SHARD_INDEX, shard_index)
+            with patch.object(pytest, "main", run_pytest):
+                result = pybuilder_integration.tasks._execute_tavern_tests(test_dir, mock_logger, self.project,
+                                                                           reactor, shard_tests=True)
+            names.extend(testcase.get("name") for testcase in ElementTree.parse(result.report_file).iter("testcase"))
+        self.assertEqual(["test_four", "test_one", "test_three", "test_two"], sorted(names),
+                         "Expected every test to run exactly once across the shards")
+
+    def test_sharded_verify_environment(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self.project.set_property(properties.SHARD_COUNT, 2)
+        latest_dir = directory_utility.get_latest_distribution_directory(self.project)
+        roles = ["bar", "baz", "foo"]
+        for role in roles:
+            self._configure_mock_tests(latest_dir, role=role)
+        # bar is known to be slow so it gets a runner of its own, foo counts as the median
+        for role, duration in [("bar", 10.0), ("baz", 1.0)]:
+            with open(f"{latest_dir}/tavern/{role}/{shard_utility.get_durations_file_name(role)}", "w") as fp:
+                json.dump({"test.tavern.yaml::test": duration}, fp)
+        zip_artifact_path = directory_utility.get_local_zip_artifact_path(tool="tavern", project=self.project,
+                                                                          include_ending=True)
+        with open(zip_artifact_path, "w") as fp:
+            fp.write("artifact")
+        first = self._run_verify_environment_shard(0, reactor, mock_logger)
+        second = self._run_verify_environment_shard(1, reactor, mock_logger)
+        self.assertEqual([f"{latest_dir}/tavern/bar"], first)
+        self.assertEqual([f"{latest_dir}/tavern/baz", f"{latest_dir}/tavern/foo"], second)
+        latest_destination = artifact_manager.get_latest_artifact_destination(logger=mock_logger,
+                                                                               project=self.project)
+        upload = ["aws", "s3", "cp", zip_artifact_path, latest_destination]
+        self.assertFalse([call for call in verify_execute.call_args_list if call.args[0][:5] == upload],
+                         "Promoted the artifact from a single shard")
+        reports_directory = directory_utility.prepare_reports_directory(self.project)
+        with open(f"{reports_directory}/{shard_utility.get_shard_summary_file_name(1)}") as fp:
+            summary = json.load(fp)
+        self.assertEqual((1, 2, True), (summary["index"], summary["count"], summary["passed"]))
+        self.assertEqual(["baz", "foo"], summary["suites"]["tavern"]["roles"])
+        pybuilder_integration.tasks.merge_integration_shards(self.project, mock_logger, reactor)
+        self.assertTrue([call for call in verify_execute.call_args_list if call.args[0][:5] == upload],
+                        "Expected the merge to promote the artifact")
+        self.assertTrue(os.path.exists(f"{reports_directory}/{pybuilder_integration.tasks.MERGED_REPORT_FILE}"))
+        # a missing shard keeps the artifact from being promoted
+        os.remove(f"{reports_directory}/{shard_utility.get_shard_summary_file_name(1)}")
+        with self.assertRaises(BuildFailedException):
+            pybuilder_integration.tasks.merge_integration_shards(self.project, mock_logger, reactor)
+
+    def test_validate_shard_summaries(self):
+        suites = {"tavern": {"roles": ["bar"], "all_roles": ["bar", "foo"], "tests_sharded": False}}
+        summaries = [{"index": 0, "count": 2, "passed": True, "suites": suites},
+                     {"index": 1, "count": 2, "passed": False, "suites": suites}]
+        self.assertEqual(["failed shards: 1", "tavern roles were not run exactly once across the shards"],
+                         shard_utility.validate_shard_summaries(summaries))
+        self.assertEqual(["no shard results found"], shard_utility.validate_shard_summaries([]))
@@ -1,16 +1,25 @@
+import json
 import os
+import shutil
+import sys
+import threading
+import time
+from unittest.mock import patch, Mock
 from zipfile import ZipFile
 
+import pytest
+from _pytest.config import main as run_pytest
 from pybuilder.errors import BuildFailedException
 
 import parent_test_case
 import pybuilder_integration
+import pybuilder_integration_pytest
 import pybuilder_integration.directory_utility
 import pybuilder_integration.properties
 import pybuilder_integration.tasks
 import pybuilder_integration.tool_utility
 from parent_test_case import ParentTestCase
-from pybuilder_integration import directory_utility, artifact_manager, exec_utility, properties
+from pybuilder_integration import directory_utility, artifact_manager, exec_utility, properties, shard_utility
 
 DIRNAME = os.path.dirname(os.path.abspath(__file__))
 
@@ -88,17 +97,18 @@ class TaskTestCase(ParentTestCase):
         self._assert_called_tavern_execution(f"{self.tmpDir}/src/integrationtest/tavern", target_url, verify_execute)
         self._validate_zip_file(file_name, "tavern")
 
-    def _assert_called_tavern_execution(self, test_dir, target_url, verify_execute):
+    def _assert_called_tavern_execution(self, test_dir, target_url, verify_execute, latest=False):
         output_file, run_name = pybuilder_integration.tasks.get_test_report_file(project=self.project,
                                                                                  test_dir=test_dir)
+        # the plugin is only needed to record this build's own durations and is passed in rather than loaded
         self.pytest_main_mock.assert_any_call(
-            [
-                "--junit-xml",
-                f"{output_file}",
-                f"{test_dir}"
-            ])
+            ["--junit-xml", f"{output_file}", f"{test_dir}"] +
+            ([] if latest else ["--integration-test-dir", f"{test_dir}", "--integration-durations-out",
+                                pybuilder_integration.tasks.get_tavern_durations_file(self.project)]),
+            plugins=[] if latest else [pybuilder_integration_pytest])
 
-    def _assert_cypress_run(self, test_directory, target_url, verify_execute, config_file=False,env={}):
+    def _assert_cypress_run(self, test_directory, target_url, verify_execute, config_file=False, env={},
+                            log_file_name="cypress_run.log"):
         results_file, run_name = pybuilder_integration.tasks.get_test_report_file(project=self.project,
                                                                                  test_dir=test_directory,
                                                                                  tool="cypress")
@@ -115,7 +125,7 @@ class TaskTestCase(ParentTestCase):
             args.append("--config-file")
             args.append(f'{environment}-config.json')
         verify_execute.assert_any_call(args,
-                                       f"{self.tmpDir}/target/logs/integration/cypress_run.log",
+                                       f"{self.tmpDir}/target/logs/integration/{log_file_name}",
                                        cwd=test_directory,
                                        env=env)
 
@@ -153,17 +163,333 @@ class TaskTestCase(ParentTestCase):
                                                                                          project=self.project),
                                  verify_execute=verify_execute, recursive=True)
         # Run against latest
-        self._assert_called_tavern_execution(os.path.dirname(tavern_latest_test_dir), target_url, verify_execute)
-        self._assert_cypress_run(os.path.dirname(cypress_latest_test_dir), target_url, verify_execute, env=env_vars)
-        # Promote local tavern archive to latest & upload local archive to versioned dir - cypress does not exist
+        self._assert_called_tavern_execution(os.path.dirname(tavern_latest_test_dir), target_url, verify_execute,
+                                             latest=True)
+        self._assert_cypress_run(os.path.dirname(cypress_latest_test_dir), target_url, verify_execute, env=env_vars,
+                                 log_file_name=f"cypress_run-{role}.log")
+        # Promote local tavern archive to latest & copy it to the versioned dir - cypress does not exist
         zip_artifact_path = directory_utility.get_local_zip_artifact_path(tool="tavern", project=self.project,
                                                                           include_ending=True)
+        latest_destination = artifact_manager.get_latest_artifact_destination(logger=mock_logger,
+                                                                               project=self.project)
         self._assert_s3_transfer(source=zip_artifact_path,
+                                 destination=latest_destination,
+                                 verify_execute=verify_execute, recursive=False,
+                                 extra_args=["--metadata",
+                                             f"sha256={directory_utility.get_file_checksum(zip_artifact_path)}"])
+        self._assert_s3_transfer(source=f"{latest_destination}{os.path.basename(zip_artifact_path)}",
                                  destination=artifact_manager.get_versioned_artifact_destination(logger=mock_logger,
                                                                                                  project=self.project),
                                  verify_execute=verify_execute, recursive=False)
-        self._assert_s3_transfer(source=zip_artifact_path,
-                                     destination=artifact_manager.get_latest_artifact_destination(logger=mock_logger,
-                                                                                                  project=self.project),
-                                     verify_execute=verify_execute, recursive=False)
 
+    def _configure_latest_roles(self, roles):
+        target_url = "foo"
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_TARGET_URL, target_url)
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_PUBLIC_TARGET_URL, target_url)
+        self.project.set_property(pybuilder_integration.properties.MAX_CONCURRENCY, len(roles))
+        latest_dir = directory_utility.get_latest_distribution_directory(self.project)
+        for role in roles:
+            self._configure_mock_tests(latest_dir, role=role)
+        return latest_dir, target_url
+
+    def test_tavern_in_process_with_xdist(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self.project.set_property(pybuilder_integration.properties.RUN_PARALLEL, True)
+        test_file = self._configure_mock_test_files("test_parallel.py", "tavern")
+        with open(test_file, "w") as fp:
+            fp.write("def test_one():\n    pass\n\n\ndef test_two():\n    pass\n")
+        # xdist workers start pytest again from the command line so the plugin has to be named on it
+        with patch.object(pytest, "main", run_pytest):
+            result = pybuilder_integration.tasks._execute_tavern_tests(os.path.dirname(test_file), mock_logger,
+                                                                       self.project, reactor)
+        self.assertEqual(0, result.exit_code)
+        with open(pybuilder_integration.tasks.get_tavern_durations_file(self.project)) as fp:
+            self.assertEqual(["test_parallel.py::test_one", "test_parallel.py::test_two"], sorted(json.load(fp)))
+
+    def test_tavern_subprocess_plugin_needs_only_pytest(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        reactor.pybuilder_venv.executable = [sys.executable]
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self.project.set_property(pybuilder_integration.properties.TAVERN_RUNNER, "subprocess")
+        test_file = self._configure_mock_test_files("test_plugin.py", "tavern")
+        with open(test_file, "w") as fp:
+            fp.write("import sys\n\n\n"
+                     "def test_plugin_imports():\n"
+                     "    assert 'pybuilder_integration_pytest' in sys.modules\n"
+                     "    assert 'pybuilder' not in sys.modules\n"
+                     "    assert 'pybuilder_integration' not in sys.modules\n")
+        # the build's own suite records its durations so the child loads the plugin
+        result = pybuilder_integration.tasks._execute_tavern_tests(os.path.dirname(test_file), mock_logger,
+                                                                   self.project, reactor)
+        with open(result.log_file) as fp:
+            self.assertTrue(result.passed, fp.read())
+        with open(pybuilder_integration.tasks.get_tavern_durations_file(self.project)) as fp:
+            self.assertEqual(["test_plugin.py::test_plugin_imports"], list(json.load(fp)))
+
+    @patch("pybuilder_integration.tasks.exec_utility.start_command")
+    def test_verify_latest_concurrently(self, start_command):
+        start_command.return_value.wait.return_value = 0
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        roles = ["bar", "foo"]
+        latest_dir, target_url = self._configure_latest_roles(roles)
+        before_pytest = self.pytest_main_mock.call_count
+        pybuilder_integration.tasks._run_tests_in_directory(latest_dir, mock_logger, self.project, reactor,
+                                                            latest=True)
+        # concurrent tavern suites run in their own process rather than in the build process
+        self.assertEqual(before_pytest, self.pytest_main_mock.call_count, "Ran tavern in the build process")
+        for role in roles:
+            tavern_dir = f"{latest_dir}/tavern/{role}"
+            output_file, run_name = pybuilder_integration.tasks.get_test_report_file(project=self.project,
+                                                                                     test_dir=tavern_dir)
+            call = next(call for call in start_command.call_args_list
+                        if call.kwargs.get("working_dir") == tavern_dir)
+            # LATEST suites record no durations so the plugin is not loaded without balancing or sharding
+            self.assertEqual(["python", "-m", "pytest", "--junit-xml", output_file, tavern_dir], call.args[0])
+            self.assertEqual(tavern_dir, call.kwargs["env_vars"]["PYTHONPATH"].split(os.pathsep)[0])
+            self.assertEqual(target_url, call.kwargs["env_vars"]["TARGET"])
+            self._assert_cypress_run(f"{latest_dir}/cypress/{role}", target_url, verify_execute,
+                                     log_file_name=f"cypress_run-{role}.log")
+            verify_execute.assert_any_call(["npm", "install", "cypress"],
+                                           f"{self.tmpDir}/target/logs/integration/cypress_npm_install-{role}.log",
+                                           env={}, cwd=f"{latest_dir}/cypress/{role}")
+
+    def test_tavern_subprocess_runner(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        reactor.pybuilder_venv.executable = [sys.executable]
+        target_url = "foo"
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_TARGET_URL, target_url)
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_PUBLIC_TARGET_URL, target_url)
+        self.project.set_property(pybuilder_integration.properties.TAVERN_RUNNER, "subprocess")
+        test_file = self._configure_mock_test_files("test_subprocess.py", "tavern")
+        with open(test_file, "w") as fp:
+            fp.write("import os\n\n\n"
+                     "def test_environment():\n"
+                     "    assert os.environ['TARGET'] == 'foo'\n")
+        test_dir = os.path.dirname(test_file)
+        before_pytest = self.pytest_main_mock.call_count
+        result = pybuilder_integration.tasks._execute_tavern_tests(test_dir, mock_logger, self.project, reactor,
+                                                                   role="foo")
+        self.assertEqual(before_pytest, self.pytest_main_mock.call_count, "Ran tavern in the build process")
+        self.assertTrue(result.passed, "Expected isolated tavern run to pass")
+        self.assertEqual(0, result.exit_code)
+        self.assertTrue(os.path.exists(result.report_file), "Did not find junit report")
+        self.assertGreaterEqual(result.duration, 0)
+        with open(result.log_file) as fp:
+            self.assertIn("1 passed", fp.read())
+
+    @patch("pybuilder_integration.tasks.exec_utility.start_command")
+    @patch("pybuilder_integration.tasks.CloudwatchLogsCollector")
+    def test_verify_latest_concurrently_reports_failed_roles(self, cloudwatch_logs_collector, start_command):
+        start_command.return_value.wait.return_value = 1
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        roles = ["bar", "foo"]
+        latest_dir, target_url = self._configure_latest_roles(roles)
+        with self.assertRaises(BuildFailedException) as context:
+            pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger,
+                                                                      self.project, reactor)
+        self.assertIn("bar, foo", str(context.exception))
+        cloudwatch_logs_collector.return_value.collect.assert_called_once()
+        self.assertEqual([("bar", None, None), ("foo", None, None)],
+                         cloudwatch_logs_collector.return_value.collect.call_args.args[0],
+                         "Expected logs for every failed role")
+
+    @patch("pybuilder_integration.tasks.install_dependencies")
+    def test_tavern_requirements_installed_once(self, install_dependencies):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        latest_dir, target_url = self._configure_latest_roles(["bar", "foo"])
+        self.project.set_property(pybuilder_integration.properties.MAX_CONCURRENCY, 1)
+        for role, requirements in [("bar", "requests\ntavern\n"), ("foo", "# shared\ntavern\n")]:
+            with open(f"{latest_dir}/tavern/{role}/requirements.txt", "w") as fp:
+                fp.write(requirements)
+        site_packages = reactor.pybuilder_venv.site_paths[0]
+
+        def install(*args):
+            for name in ["requests", "tavern"]:
+                os.makedirs(f"{site_packages}/{name}-2.5.dist-info", exist_ok=True)
+                with open(f"{site_packages}/{name}-2.5.dist-info/METADATA", "w") as fp:
+                    fp.write(f"Metadata-Version: 2.1\nName: {name}\nVersion: 2.5\n")
+
+        install_dependencies.side_effect = install
+        for run in range(2):
+            pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger, self.project,
+                                                                      reactor)
+        # both roles are resolved together and nothing is installed again afterwards
+        install_dependencies.assert_called_once()
+        merged_file = install_dependencies.call_args.args[2].name
+        with open(merged_file) as fp:
+            self.assertEqual(["requests", "tavern"], fp.read().splitlines())
+        # a recorded install no longer satisfied by the venv is installed again
+        shutil.rmtree(f"{site_packages}/requests-2.5.dist-info")
+        pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger, self.project,
+                                                                  reactor)
+        self.assertEqual(2, install_dependencies.call_count)
+        with open(f"{latest_dir}/tavern/bar/requirements.txt", "w") as fp:
+            fp.write("requests==2.5\ntavern\n")
+        for run in range(2):
+            pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger, self.project,
+                                                                      reactor)
+        self.assertEqual(3, install_dependencies.call_count)
+        # e.g. another role or a manual pip install changed the version since
+        with open(f"{site_packages}/requests-2.5.dist-info/METADATA", "w") as fp:
+            fp.write("Metadata-Version: 2.1\nName: requests\nVersion: 2.4\n")
+        pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger, self.project,
+                                                                  reactor)
+        self.assertEqual(4, install_dependencies.call_count, "Expected an unsatisfied version to be installed")
+
+    @patch("pybuilder_integration.tasks.CloudwatchLogsCollector")
+    def test_consolidated_failure_collects_failed_roles(self, cloudwatch_logs_collector):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(pybuilder_integration.properties.CONSOLIDATE_TESTS, True)
+        test_dir = f"{self.tmpDir}/consolidated"
+        os.makedirs(test_dir)
+        with open(f"{test_dir}/roles", "w") as fp:
+            fp.write("bar\nfoo\n")
+        with open(f"{test_dir}/sources.json", "w") as fp:
+            json.dump({"test_bar.tavern.yaml": "bar", "test_foo.tavern.yaml": "foo"}, fp)
+        report_file = f"{self.tmpDir}/report.xml"
+        with open(report_file, "w") as fp:
+            fp.write('<testsuite><testcase classname="test_foo.tavern.yaml" name="foo"><failure/></testcase>'
+                     '<testcase classname="test_bar.tavern.yaml" name="bar"/></testsuite>')
+        result = pybuilder_integration.tasks.RoleSuiteResult("tavern", "consolidated", test_dir, report_file, False)
+        pybuilder_integration.tasks._collect_cloudwatch_logs([result], mock_logger, self.project)
+        self.assertEqual([("foo", None, None)], cloudwatch_logs_collector.return_value.collect.call_args.args[0])
+        # without a usable report every consolidated role is collected
+        os.remove(report_file)
+        pybuilder_integration.tasks._collect_cloudwatch_logs([result], mock_logger, self.project)
+        self.assertEqual([("bar", None, None), ("foo", None, None)],
+                         cloudwatch_logs_collector.return_value.collect.call_args.args[0])
+
+    @patch("pybuilder_integration.tasks.exec_utility.start_command")
+    @patch("pybuilder_integration.tasks.CloudwatchLogsCollector")
+    def test_fail_fast_cancels_running_suites(self, cloudwatch_logs_collector, start_command):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        roles = ["bar", "foo"]
+        latest_dir, target_url = self._configure_latest_roles(roles)
+        self.project.set_property(pybuilder_integration.properties.FAILURE_POLICY, "fail_fast")
+        terminated = threading.Event()
+        foo_started = threading.Event()
+
+        def fail(timeout=None):
+            # fail once foo is running so there is a suite to cancel
+            foo_started.wait(10)
+            return 1
+
+        def start(args, working_dir, **kwargs):
+            command = Mock()
+            if working_dir.endswith("foo"):
+                foo_started.set()
+                command.terminate.side_effect = lambda: terminated.set() or True
+                command.wait.side_effect = lambda timeout=None: -15 if terminated.wait(10) else 0
+            else:
+                command.wait.side_effect = fail
+            return command
+
+        start_command.side_effect = start
+        with self.assertRaises(BuildFailedException) as context:
+            pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger,
+                                                                      self.project, reactor)
+        self.assertTrue(terminated.is_set(), "Expected the running foo suite to be terminated")
+        self.assertEqual("tavern tests failed for roles: bar - cancelled: foo", str(context.exception))
+        self.assertEqual([("bar", None, None)], cloudwatch_logs_collector.return_value.collect.call_args.args[0],
+                         "Collected logs for a cancelled role")
+
+    @patch("pybuilder_integration.tasks.exec_utility.start_command")
+    @patch("pybuilder_integration.tasks.CloudwatchLogsCollector")
+    def test_fail_fast_cancels_running_cypress_suites(self, cloudwatch_logs_collector, start_command):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        roles = ["bar", "baz", "foo"]
+        latest_dir, target_url = self._configure_latest_roles(roles)
+        self.project.set_property(pybuilder_integration.properties.FAILURE_POLICY, "fail_fast")
+        terminated = threading.Event()
+        running = threading.Barrier(3, timeout=10)
+
+        def wait(role):
+            running.wait()
+            if role == "bar":
+                return 1
+            # baz fails on its own once the cancel was requested - it was not stopped by it
+            terminated.wait(10)
+            return 1 if role == "baz" else -15
+
+        def start(args, log_file_name, project, reactor, working_dir=None, **kwargs):
+            command = Mock()
+            role = os.path.basename(working_dir)
+            command.wait.side_effect = lambda timeout=None: wait(role)
+            command.terminate.side_effect = lambda: role == "foo" and (terminated.set() or True)
+            return command
+
+        start_command.side_effect = start
+        with self.assertRaises(BuildFailedException) as context:
+            pybuilder_integration.tasks._run_cypress_tests_in_dist_dir(latest_dir, True, mock_logger,
+                                                                       self.project, reactor)
+        self.assertEqual("cypress tests failed for roles: bar, baz - cancelled: foo", str(context.exception))
+        self.assertEqual(["cypress_run-bar.log", "cypress_run-baz.log", "cypress_run-foo.log"],
+                         sorted(call.args[1] for call in start_command.call_args_list))
+
+    @patch("pybuilder_integration.tasks.CloudwatchLogsCollector")
+    def test_failure_policy_sequential(self, cloudwatch_logs_collector):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        roles = ["bar", "baz", "foo"]
+        latest_dir, target_url = self._configure_latest_roles(roles)
+        self.project.set_property(pybuilder_integration.properties.MAX_CONCURRENCY, 1)
+        self.pytest_main_mock.side_effect = lambda args, plugins=None: 1
+        self.project.set_property(pybuilder_integration.properties.FAILURE_POLICY, "fail_fast")
+        before_pytest = self.pytest_main_mock.call_count
+        with self.assertRaises(BuildFailedException) as context:
+            pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger,
+                                                                      self.project, reactor)
+        self.assertEqual(before_pytest + 1, self.pytest_main_mock.call_count, "Ran suites after the first failure")
+        self.assertEqual("tavern tests failed for roles: bar - skipped: baz, foo", str(context.exception))
+        self.project.set_property(pybuilder_integration.properties.FAILURE_POLICY, "run_all")
+        with self.assertRaises(BuildFailedException) as context:
+            pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger,
+                                                                      self.project, reactor)
+        self.assertEqual("tavern tests failed for roles: bar, baz, foo", str(context.exception))
+        self.assertEqual(3, len(cloudwatch_logs_collector.return_value.collect.call_args.args[0]))
+        self.project.set_property(pybuilder_integration.properties.FAILURE_POLICY, "stop")
+        with self.assertRaises(BuildFailedException):
+            pybuilder_integration.tasks._run_tavern_tests_in_dist_dir(latest_dir, True, mock_logger,
+                                                                      self.project, reactor)
+
+    @patch("pybuilder_integration.tasks._prepare_latest_artifacts",
+           wraps=pybuilder_integration.tasks._prepare_latest_artifacts)
+    @patch("pybuilder_integration.tasks.get_artifact_manager")
+    def test_verify_environment_prefetches_latest(self, get_artifact_manager, prepare_latest):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(pybuilder_integration.properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self.project.set_property(pybuilder_integration.properties.PROMOTE_ARTIFACT, False)
+        distribution_directory = directory_utility.get_working_distribution_directory(self.project)
+        self._configure_mock_tests(distribution_directory)
+        latest_dir = directory_utility.get_latest_distribution_directory(self.project)
+        self._configure_mock_tests(latest_dir, role="foo")
+        downloaded = threading.Event()
+
+        def download_artifacts(project, logger, reactor):
+            downloaded.set()
+            return latest_dir
+
+        def current_build_tests(args, plugins=None):
+            # the current build is still being tested while LATEST downloads
+            self.assertTrue(downloaded.wait(10), "LATEST was not downloaded in the background")
+            return 0
+
+        get_artifact_manager.return_value.download_artifacts.side_effect = download_artifacts
+        self.pytest_main_mock.side_effect = current_build_tests
+        pybuilder_integration.tasks.verify_environment(project=self.project, logger=mock_logger, reactor=reactor)
+        self.assertEqual([distribution_directory + "/tavern", f"{latest_dir}/tavern/foo"],
+                         [call.args[0][2] for call in self.pytest_main_mock.call_args_list])
+        # the in process runner imports from the venv so LATEST requirements are left to the LATEST run
+        self.assertEqual([False], [call.args[3] for call in prepare_latest.call_args_list])
+        # a failing current build is reported without waiting for LATEST
+        release = threading.Event()
+        get_artifact_manager.return_value.download_artifacts.side_effect = lambda **kwargs: release.wait(10)
+        self.pytest_main_mock.side_effect = lambda args, plugins=None: 1
+        started = time.time()
+        with self.assertRaises(BuildFailedException):
+            pybuilder_integration.tasks.verify_environment(project=self.project, logger=mock_logger, reactor=reactor)
+        self.assertLess(time.time() - started, 5, "Waited for the LATEST prefetch")
+        release.set()
@@ -0,0 +1,54 @@
+import json
+import os
+import threading
+
+import pybuilder_integration.tasks
+from parent_test_case import ParentTestCase
+from pybuilder_integration import properties
+from pybuilder_integration.directory_utility import prepare_reports_directory, get_local_zip_artifact_path
+from pybuilder_integration.timing_utility import timed, get_timing_report, write_timing_report, TIMING_REPORT_FILE
+
+
+class TimingTestCase(ParentTestCase):
+
+    def test_timed_records_phases(self):
+        with timed(self.project, "s3_download") as timing:
+            timing["bytes"] = 42
+        with self.assertRaises(ValueError):
+            with timed(self.project, "tavern_run", role="foo"):
+                raise ValueError("boom")
+
+        def unzip():
+            with timed(self.project, "unzip"):
+                pass
+
+        threads = [threading.Thread(target=unzip) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report = get_timing_report(self.project).to_dict()
+        download, run = [entry for entry in report["phases"] if entry["phase"] != "unzip"]
+        self.assertEqual(("s3_download", None, 42, "ok"),
+                         (download["phase"], download["role"], download["bytes"], download["status"]))
+        self.assertEqual(("tavern_run", "foo", "failed"), (run["phase"], run["role"], run["status"]))
+        self.assertEqual(6, len(report["phases"]))
+        self.assertEqual({"s3_download", "tavern_run", "unzip"}, set(report["totals_ms"]))
+        report_file = write_timing_report(self.project, self.tmpDir)
+        self.assertEqual(f"{self.tmpDir}/{TIMING_REPORT_FILE}", report_file)
+        with open(report_file) as fp:
+            self.assertEqual(6, len(json.load(fp)["phases"]))
+
+    def test_verify_tavern_writes_timing_report(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+        self.project.set_property(properties.INTEGRATION_TARGET_URL, "foo")
+        self.project.set_property(properties.INTEGRATION_PUBLIC_TARGET_URL, "foo")
+        self._configure_mock_test_files("test.tavern.yaml", "tavern")
+        pybuilder_integration.tasks.verify_tavern(project=self.project, logger=mock_logger, reactor=reactor)
+        with open(os.path.join(prepare_reports_directory(self.project), TIMING_REPORT_FILE)) as fp:
+            phases = {entry["phase"]: entry for entry in json.load(fp)["phases"]}
+        self.assertEqual(0, phases["tavern_run"]["exit_code"])
+        package = phases["package"]
+        self.assertEqual("tavern", package["tool"])
+        zip_file = get_local_zip_artifact_path(tool="tavern", project=self.project, include_ending=True)
+        self.assertEqual(os.path.getsize(zip_file), package["bytes"])
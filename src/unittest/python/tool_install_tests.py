@@ -1,11 +1,15 @@
 import os
+from unittest.mock import call
+
+from pybuilder.errors import MissingPrerequisiteException
 
 import pybuilder_integration
 import pybuilder_integration.directory_utility
 import pybuilder_integration.properties
 import pybuilder_integration.tasks
 import pybuilder_integration.tool_utility
-from parent_test_case import ParentTestCase
+from parent_test_case import ParentTestCase, _execute_create_files
+from pybuilder_integration.timing_utility import get_timing_report
 
 DIRNAME = os.path.dirname(os.path.abspath(__file__))
 
@@ -16,8 +20,79 @@ class ToolInstallTestCase(ParentTestCase):
         mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
         pybuilder_integration.tool_utility.install_cypress(logger=mock_logger, project=self.project, reactor=reactor,
                                                            work_dir=self.tmpDir)
-        self._assert_npm_install(verify_mock)
+        self._assert_npm_install(verify_execute)
         verify_execute.assert_any_call(["npm", "install", "cypress"],
                                           f"{self.tmpDir}/target/logs/integration/cypress_npm_install.log",
                                        env={},
                                        cwd=self.tmpDir)
+
+    def test_npm_install_cache(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+
+        def npm_install(command_and_arguments, outfile_name, env=None, cwd=None):
+            if cwd:
+                os.makedirs(f"{cwd}/node_modules/cypress")
+            return _execute_create_files(command_and_arguments, outfile_name, env=env, cwd=cwd)
+
+        verify_execute.side_effect = npm_install
+        work_dirs = [f"{self.tmpDir}/cypress/{role}" for role in ["bar", "foo"]]
+        for work_dir in work_dirs:
+            os.makedirs(work_dir)
+            for file_name in ["package.json", "package-lock.json"]:
+                with open(f"{work_dir}/{file_name}", "w") as fp:
+                    fp.write("{}")
+            pybuilder_integration.tool_utility.install_npm_dependencies(work_dir, project=self.project,
+                                                                        logger=mock_logger, reactor=reactor,
+                                                                        role=os.path.basename(work_dir))
+        # npm is probed once for the build, identical dependencies of LATEST roles are installed once and shared
+        self._assert_npm_install(verify_execute)
+        self.assertEqual([call(["npm", "--version"], f"{self.tmpDir}/target/logs/integration/npm-version.log"),
+                          call(["npm", "ci"],
+                               f"{self.tmpDir}/target/logs/integration/package_json_npm_install-bar.log",
+                               env={}, cwd=work_dirs[0])],
+                         verify_execute.call_args_list)
+        for work_dir in work_dirs:
+            self.assertTrue(os.path.islink(f"{work_dir}/node_modules"), "Expected node_modules from the cache")
+            self.assertTrue(os.path.isdir(f"{work_dir}/node_modules/cypress"))
+        with open(f"{work_dirs[1]}/package.json", "w") as fp:
+            fp.write('{"dependencies": {}}')
+        pybuilder_integration.tool_utility.install_npm_dependencies(work_dirs[1], project=self.project,
+                                                                    logger=mock_logger, reactor=reactor, role="foo")
+        self.assertEqual(3, verify_execute.call_count, "Expected changed dependencies to be installed")
+        # the project's own node_modules stay in its source tree
+        own_dir = f"{self.tmpDir}/src/integrationtest/cypress"
+        os.makedirs(own_dir)
+        with open(f"{own_dir}/package.json", "w") as fp:
+            fp.write("{}")
+        pybuilder_integration.tool_utility.install_npm_dependencies(own_dir, project=self.project,
+                                                                    logger=mock_logger, reactor=reactor)
+        self.assertFalse(os.path.islink(f"{own_dir}/node_modules"), "Moved the project's node_modules")
+        self.assertTrue(os.path.isdir(f"{own_dir}/node_modules/cypress"))
+
+    def test_tool_registry(self):
+        mock_logger, verify_mock, verify_execute, reactor = self.generate_mock()
+
+        def probe(command_and_arguments, outfile_name, env=None, cwd=None):
+            if command_and_arguments[0] == "npm":
+                raise FileNotFoundError("npm")
+            with open(f"{outfile_name}.err", "w") as fp:
+                fp.write("aws-cli/1.18.0 Python/3.8.0\n")
+            with open(outfile_name, "w"):
+                pass
+            return 0
+
+        verify_execute.side_effect = probe
+        reactor.execution_manager.is_task_in_current_execution_plan.side_effect = \
+            lambda task_name: task_name == "verify_environment"
+        os.makedirs(self.project.expand_path("$cypress_test_dir"))
+        self.assertEqual(["aws", "npm"], pybuilder_integration.tool_utility.get_required_tools(self.project, reactor))
+        for _ in range(2):
+            self.assertEqual("aws-cli/1.18.0 Python/3.8.0",
+                             pybuilder_integration.tool_utility.require_tool("aws", self.project, reactor))
+            with self.assertRaises(MissingPrerequisiteException):
+                pybuilder_integration.tool_utility.verify_required_tools(self.project, mock_logger, reactor)
+        self.assertEqual(2, verify_execute.call_count, "Expected every tool to be probed once")
+        checks = [entry for entry in get_timing_report(self.project).to_dict()["phases"]
+                  if entry["phase"] == "tool_check"]
+        self.assertEqual([("aws", "ok", "aws-cli/1.18.0 Python/3.8.0"), ("npm", "failed", None)],
+                         [(entry["tool"], entry["status"], entry.get("version")) for entry in checks])